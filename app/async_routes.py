@@ -0,0 +1,150 @@
+import logging
+from datetime import date
+from typing import List, Optional
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from . import main, schemas, database
+from .database import get_async_db
+from .replicas import get_async_read_db
+from .catalog import PRODUCTS_STREAM_BATCH_SIZE, ProductListParams, ndjson_lines
+from .cache import product_lookups
+from .journal import purchase_journal
+from .responses import fast_response
+
+logger = logging.getLogger(__name__)
+
+# 非同期モード用ルーター
+# 各ハンドラはAsyncSession.run_syncで同期版のロジックを実行する。
+# DB I/Oは非同期ドライバ上で行われるため、スレッドプールを占有しない。
+router = APIRouter()
+
+
+async def stream_products(stmt, bind):
+    """AsyncSession.streamでサーバーサイドカーソルから逐次出力する"""
+    async with database.AsyncSessionLocal(bind=bind) as session:
+        result = await session.stream(
+            stmt.execution_options(yield_per=PRODUCTS_STREAM_BATCH_SIZE)
+        )
+        async for row in result.mappings():
+            for line in ndjson_lines([row]):
+                yield line
+
+
+@router.get("/products", response_model=List[schemas.Product])
+async def get_all_products(
+    response: Response,
+    params: ProductListParams = Depends(),
+    db: AsyncSession = Depends(get_async_read_db),
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    if params.format == "ndjson":
+        return StreamingResponse(stream_products(params.query(), db.bind), media_type="application/x-ndjson")
+    return await db.run_sync(
+        lambda session: main.get_all_products(response, params, session, accept_encoding, if_none_match)
+    )
+
+
+@router.get("/catalog/sync", response_model=schemas.CatalogSyncResponse)
+async def sync_catalog(
+    response: Response,
+    since: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    return await db.run_sync(lambda session: main.sync_catalog(response, since, if_none_match, session))
+
+
+@router.get("/products/{code}", response_model=schemas.Product)
+async def get_product(code: str, db: AsyncSession = Depends(get_async_read_db)):
+    try:
+        logger.info("🔍 Searching for product with code: %s", code)
+        cached = main.cached_product(code)
+        if cached is not None:
+            return fast_response(cached)
+        # 同じコードの検索が実行中なら、そのクエリの結果を待って使う（イベントループ上でまとめる）
+        result = await product_lookups.do_async(
+            code, lambda: db.run_sync(lambda session: main.load_product(code, session))
+        )
+        return main.product_response(code, result)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("❌ Error fetching product %s: %s", code, e)
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+
+@router.get("/product/{code}", response_model=schemas.Product)
+async def get_product_singular(code: str, db: AsyncSession = Depends(get_async_read_db)):
+    """フロントエンド互換性のための単数形エンドポイント"""
+    return await get_product(code, db)
+
+
+@router.get("/transactions/{transaction_id}", response_model=schemas.TransactionDetailWithTotals)
+async def get_transaction_details(transaction_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(lambda session: main.get_transaction_details(transaction_id, session))
+
+
+@router.post("/purchase", response_model=schemas.TransactionResponse)
+async def create_purchase(
+    purchase_data: schemas.PurchaseRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=64),
+    db: AsyncSession = Depends(get_async_db)
+):
+    result, journal_seq = await db.run_sync(lambda session: main.process_purchase(purchase_data, idempotency_key, session))
+    if journal_seq is not None:
+        # fsyncの完了はイベントループの外で待つ
+        await run_in_threadpool(purchase_journal.wait_durable, journal_seq)
+    return result
+
+
+@router.post("/purchases/batch", response_model=schemas.BatchPurchaseResponse)
+async def create_purchases_batch(batch: schemas.BatchPurchaseRequest, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda session: main.create_purchases_batch(batch, session))
+
+
+@router.get("/reports/daily-sales", response_model=List[schemas.DailySalesRow])
+async def get_daily_sales(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    store_cd: Optional[str] = None,
+    pos_no: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    return await db.run_sync(lambda session: main.get_daily_sales(date_from, date_to, store_cd, pos_no, session))
+
+
+@router.get("/reports/top-products", response_model=List[schemas.TopProductRow])
+async def get_top_products(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    store_cd: Optional[str] = None,
+    order_by: str = Query("qty", pattern="^(qty|revenue)$"),
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    return await db.run_sync(
+        lambda session: main.get_top_products(date_from, date_to, store_cd, order_by, limit, session)
+    )
+
+
+def install_async_routes(app: FastAPI):
+    """同じパス/メソッドの同期ルートを非同期ルートに差し替える"""
+    replaced = {
+        (route.path, method)
+        for route in router.routes
+        for method in route.methods
+    }
+    app.router.routes = [
+        route for route in app.router.routes
+        if not (
+            isinstance(route, APIRoute)
+            and any((route.path, method) in replaced for method in route.methods)
+        )
+    ]
+    app.include_router(router)
+    logger.info("⚡ Async handlers installed for %s routes", len(router.routes))
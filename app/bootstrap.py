@@ -0,0 +1,188 @@
+"""ローカル・ベンチマーク用DBのスキーマ作成とデータ投入
+
+models.Base のメタデータでテーブルを作成（Alembicがあれば最新リビジョンを記録）し、
+商品・税率・取引を一括INSERTする。売上集計は投入後にまとめて作り直す。
+
+    python -m app.bootstrap --db-url sqlite:///local.db --products 100000 --transactions 1000000
+    python -m app.bootstrap --db-url sqlite:///local.db --schema-only
+"""
+import os
+import time
+import random
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, select, func
+from sqlalchemy.orm import Session
+
+from . import models
+from .tax import tax_for, rate_to_bp
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 10000
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+TAX_RATES = {"10": 10, "08": 8}
+# 商品名の組み立てに使う語（それらしい商品名・価格帯にする）
+PRODUCT_KINDS = (
+    ("おにぎり", 120, 250), ("サンドイッチ", 250, 450), ("弁当", 450, 900), ("お茶", 100, 180),
+    ("コーヒー", 120, 300), ("菓子", 100, 350), ("パン", 120, 300), ("文具", 100, 1200),
+    ("日用品", 150, 1500), ("雑誌", 400, 1200),
+)
+PRODUCT_VARIANTS = ("", "大盛", "ミニ", "限定", "徳用", "プレミアム")
+
+
+def product_code(index: int) -> str:
+    """JAN風の13桁コード（index 0 -> 4900000000000）"""
+    return f"{4900000000000 + index:013d}"
+
+
+def create_schema(engine, drop: bool = False):
+    """テーブルを作成する（drop=Trueなら作り直す）。Alembicがあれば最新リビジョンとして記録する"""
+    if drop:
+        models.Base.metadata.drop_all(engine)
+        with engine.begin() as connection:
+            connection.exec_driver_sql("DROP TABLE IF EXISTS alembic_version")
+    models.Base.metadata.create_all(engine)
+    try:
+        from alembic.config import Config
+        from alembic.migration import MigrationContext
+        from alembic.script import ScriptDirectory
+    except ImportError:
+        return
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    script = ScriptDirectory.from_config(config)
+    with engine.begin() as connection:
+        context = MigrationContext.configure(connection)
+        # 既にリビジョンが記録されているDB（alembic upgrade済み）はそのまま
+        if context.get_current_revision() is None:
+            context.stamp(script, "heads")
+
+
+def seed(engine, products: int, transactions: int, max_lines: int = 5, stock: int = 1_000_000,
+         seed_value: int = 42, days: int = 365, stores: int = 1, registers: int = 20, drop: bool = True):
+    """スキーマを作成してデータを投入し、件数と所要時間を返す"""
+    rng = random.Random(seed_value)
+    started = time.perf_counter()
+
+    create_schema(engine, drop=drop)
+    with Session(engine) as db:
+        if db.execute(select(func.count()).select_from(models.Product)).scalar():
+            raise RuntimeError("product_master is not empty (use drop=True / --drop to recreate)")
+
+    product_table = models.Product.__table__
+    transaction_table = models.Transaction.__table__
+    detail_table = models.TransactionDetail.__table__
+    rates_bp = {cd: rate_to_bp(rate) for cd, rate in TAX_RATES.items()}
+
+    with engine.begin() as conn:
+        conn.execute(insert(models.TaxMaster.__table__), [
+            {"TAX_CD": cd, "TAX_RATE": rate} for cd, rate in TAX_RATES.items()
+        ])
+
+        catalog = []  # (CODE, NAME, PRICE)
+        for start in range(0, products, BATCH_SIZE):
+            rows = []
+            for i in range(start, min(start + BATCH_SIZE, products)):
+                kind, low, high = PRODUCT_KINDS[i % len(PRODUCT_KINDS)]
+                name = f"{kind}{rng.choice(PRODUCT_VARIANTS)}{i:06d}"[:50]
+                price = rng.randrange(low, high + 1, 10)
+                catalog.append((product_code(i), name, price))
+                rows.append({"PRD_ID": i + 1, "CODE": product_code(i), "NAME": name, "PRICE": price, "STOCK": stock})
+            conn.execute(insert(product_table), rows)
+
+        # 売れ筋に偏らせる（先頭の商品ほど選ばれやすい）
+        weights = [1.0 / (rank + 1) ** 0.8 for rank in range(products)]
+        cumulative = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+
+        detail_count = 0
+        base_time = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+        for start in range(0, transactions, BATCH_SIZE):
+            headers = []
+            details = []
+            for trd_id in range(start + 1, min(start + BATCH_SIZE, transactions) + 1):
+                total_ex_tax = 0
+                for dtl_id in range(1, rng.randint(1, max_lines) + 1):
+                    index = rng.choices(range(products), cum_weights=cumulative)[0] if products > 1 else 0
+                    code, name, price = catalog[index]
+                    qty = rng.choices((1, 2, 3), weights=(8, 2, 1))[0]
+                    total_ex_tax += price * qty
+                    details.append({
+                        "TRD_ID": trd_id,
+                        "DTL_ID": dtl_id,
+                        "PRD_ID": index + 1,
+                        "PRD_CODE": code,
+                        "PRD_NAME": name,
+                        "PRD_PRICE": price,
+                        "QTY": qty,
+                        "TAX_CD": "10",
+                    })
+                # 営業時間（7時〜23時）に分布させる
+                day = (trd_id - 1) * days // max(1, transactions)
+                headers.append({
+                    "TRD_ID": trd_id,
+                    "DATETIME": base_time + timedelta(days=day, seconds=rng.randint(7 * 3600, 23 * 3600)),
+                    "EMP_CD": "9999999999",
+                    "STORE_CD": f"{30 + rng.randrange(stores)}",
+                    "POS_NO": f"{rng.randint(1, registers):03d}",
+                    "TOTAL_AMT": total_ex_tax + tax_for(total_ex_tax, rates_bp["10"]),
+                    "TTL_AMT_EX_TAX": total_ex_tax,
+                })
+            conn.execute(insert(transaction_table), headers)
+            conn.execute(insert(detail_table), details)
+            detail_count += len(details)
+            logger.info("🌱 Seeded transactions: %s/%s", min(start + BATCH_SIZE, transactions), transactions)
+
+    rollups = None
+    if transactions:
+        from .reporting import backfill
+        with Session(engine) as db:
+            rollups = backfill(db, batch_days=max(days, 1))
+
+    return {
+        "products": products,
+        "transactions": transactions,
+        "transaction_details": detail_count,
+        "rollups": rollups,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default="sqlite:///local.db")
+    parser.add_argument("--schema-only", action="store_true", help="テーブル作成のみ行う")
+    parser.add_argument("--drop", action="store_true", help="既存のテーブルを削除して作り直す")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--transactions", type=int, default=10000)
+    parser.add_argument("--max-lines", type=int, default=5, help="1取引あたりの最大明細数")
+    parser.add_argument("--days", type=int, default=365, help="取引を分布させる日数（今日まで）")
+    parser.add_argument("--stores", type=int, default=1)
+    parser.add_argument("--registers", type=int, default=20)
+    args = parser.parse_args()
+
+    from .logging_config import setup_logging
+    setup_logging()
+
+    engine = create_engine(args.db_url)
+    if args.schema_only:
+        create_schema(engine, drop=args.drop)
+        print({"schema": "created", "tables": sorted(models.Base.metadata.tables)})
+        return
+    try:
+        print(seed(
+            engine, args.products, args.transactions, args.max_lines,
+            days=args.days, stores=args.stores, registers=args.registers, drop=args.drop
+        ))
+    except RuntimeError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
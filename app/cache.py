@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# キャッシュ設定（環境変数で上書き可能）
+PRODUCT_CACHE_ENABLED = os.getenv("PRODUCT_CACHE_ENABLED", "true").lower() == "true"
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "30"))         # 秒
+PRODUCT_CACHE_MAX_SIZE = int(os.getenv("PRODUCT_CACHE_MAX_SIZE", "10000"))
+# 確定済み取引のレシートキャッシュ（取引は変更されないためTTLなし）
+RECEIPT_CACHE_ENABLED = os.getenv("RECEIPT_CACHE_ENABLED", "true").lower() == "true"
+RECEIPT_CACHE_MAX_SIZE = int(os.getenv("RECEIPT_CACHE_MAX_SIZE", "5000"))
+# 存在しない商品コードのネガティブキャッシュ（秒、0で無効）
+PRODUCT_NEGATIVE_CACHE_TTL = float(os.getenv("PRODUCT_NEGATIVE_CACHE_TTL", "5"))
+PRODUCT_NEGATIVE_CACHE_MAX_SIZE = int(os.getenv("PRODUCT_NEGATIVE_CACHE_MAX_SIZE", "10000"))
+# 同じ商品コードへの同時検索を1回のDBクエリにまとめる
+PRODUCT_SINGLE_FLIGHT = os.getenv("PRODUCT_SINGLE_FLIGHT", "true").lower() == "true"
+
+
+class LRUCache:
+    """TTL・サイズ上限(LRU)付きのインメモリキャッシュ
+
+    TTL切れ・サイズ上限で追い出し、データ更新時はinvalidate()でエントリを破棄する。
+    versionはキャッシュ内容が変化するたびに増加し、外部からの整合性確認に使用できる。
+    ttl=Noneの場合は期限なし（サイズ上限のみ）。
+    """
+
+    def __init__(self, ttl: Optional[float], max_size: int, enabled: bool = True):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.enabled = enabled
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= now:
+                # TTL切れ
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """指定キーのエントリを破棄する（商品キャッシュは在庫変更時に呼び出す）"""
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+            self.version += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.version += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """同じキーの同時呼び出しを1回の実行にまとめ、結果（例外を含む）を待っている全員で共有する
+
+    do() はスレッド（同期ハンドラ）用、do_async() はイベントループ（非同期ハンドラ）用。
+    実行中の呼び出しがなければ自分で実行するため、結果はキャッシュしない。
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Hashable, asyncio.Future] = {}
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        if not self.enabled:
+            return func()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.enabled:
+            return await func()
+        future = self._async_calls.get(key)
+        if future is not None:
+            self.shared += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # 実行していたリクエストがキャンセルされた場合は自分で実行し直す
+                    return await self.do_async(key, func)
+                raise
+        future = asyncio.get_running_loop().create_future()
+        # 待っているリクエストがない場合に "exception was never retrieved" を出さない
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._async_calls[key] = future
+        self.executions += 1
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._async_calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._calls) + len(self._async_calls)
+        requests = self.executions + self.shared
+        return {
+            "enabled": self.enabled,
+            "in_flight": in_flight,
+            "executions": self.executions,
+            "shared": self.shared,
+            "shared_ratio": round(self.shared / requests, 4) if requests else 0.0,
+        }
+
+
+# 商品マスタ(product_master)のリードスルーキャッシュ（CODE -> 商品dict）
+product_cache = LRUCache(PRODUCT_CACHE_TTL, PRODUCT_CACHE_MAX_SIZE, PRODUCT_CACHE_ENABLED)
+# レシート（TRD_ID -> TransactionDetailWithTotalsのdict）
+receipt_cache = LRUCache(None, RECEIPT_CACHE_MAX_SIZE, RECEIPT_CACHE_ENABLED)
+# 存在しない商品コード（CODE -> True）。商品登録はcatalog_changes経由で破棄する
+missing_product_cache = LRUCache(
+    PRODUCT_NEGATIVE_CACHE_TTL, PRODUCT_NEGATIVE_CACHE_MAX_SIZE, PRODUCT_CACHE_ENABLED and PRODUCT_NEGATIVE_CACHE_TTL > 0
+)
+# 商品コード検索の同時実行まとめ
+product_lookups = SingleFlight(PRODUCT_SINGLE_FLIGHT)
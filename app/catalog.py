@@ -0,0 +1,263 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+from fastapi import HTTPException, Query
+from sqlalchemy import select, func, insert, delete, event
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .inventory import available_stock
+from .responses import PrecompressedBody
+
+logger = logging.getLogger(__name__)
+
+# 商品一覧の1ページあたり最大件数
+PRODUCTS_MAX_PAGE_SIZE = int(os.getenv("PRODUCTS_MAX_PAGE_SIZE", "1000"))
+# NDJSONストリーミング時にサーバーサイドカーソルから一度に取り出す件数
+PRODUCTS_STREAM_BATCH_SIZE = int(os.getenv("PRODUCTS_STREAM_BATCH_SIZE", "500"))
+
+# 他のワーカー・インスタンスでの商品変更を商品キャッシュに反映する間隔（秒、0で無効）
+CATALOG_WATCH_INTERVAL = float(os.getenv("CATALOG_WATCH_INTERVAL", "1"))
+# 変更の書き込みからコミットまでの上限（秒）。これより新しい変更はバージョンに含めない
+CATALOG_COMMIT_LAG_SECONDS = float(os.getenv("CATALOG_COMMIT_LAG_SECONDS", "2"))
+# 変更履歴の保持期間（時間）と古い履歴の削除間隔（秒、0で削除しない）
+CATALOG_CHANGES_RETENTION_HOURS = float(os.getenv("CATALOG_CHANGES_RETENTION_HOURS", "72"))
+CATALOG_CHANGES_PRUNE_INTERVAL = float(os.getenv("CATALOG_CHANGES_PRUNE_INTERVAL", "600"))
+
+PRODUCT_FIELDS = ("PRD_ID", "CODE", "NAME", "PRICE", "STOCK")
+
+
+def parse_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    """fields=CODE,PRICE 形式の射影指定を検証する（PRD_IDは常に含める）"""
+    if not fields:
+        return PRODUCT_FIELDS
+    requested = [f.strip().upper() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in PRODUCT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return tuple(f for f in PRODUCT_FIELDS if f == "PRD_ID" or f in requested)
+
+
+class ProductListParams:
+    """GET /products のクエリパラメータ（同期・非同期ハンドラで共通）"""
+
+    def __init__(
+        self,
+        after_id: Optional[int] = Query(None, description="このPRD_IDより後の商品を返す（キーセットページネーション）"),
+        limit: Optional[int] = Query(None, ge=1, le=PRODUCTS_MAX_PAGE_SIZE),
+        code_prefix: Optional[str] = Query(None, description="商品コードの前方一致"),
+        in_stock: bool = Query(False, description="在庫ありの商品のみ"),
+        fields: Optional[str] = Query(None, description="返す項目（例: CODE,PRICE）。PRD_IDは常に含む"),
+        format: str = Query("json", pattern="^(json|ndjson)$"),
+    ):
+        self.after_id = after_id
+        self.limit = limit
+        self.code_prefix = code_prefix
+        self.in_stock = in_stock
+        self.columns = parse_fields(fields)
+        self.format = format
+
+    @property
+    def full_catalog(self) -> bool:
+        """絞り込み・射影なしの全商品JSON（圧縮済みボディをキャッシュする対象）"""
+        return (
+            self.after_id is None and self.limit is None and not self.code_prefix and not self.in_stock
+            and self.columns == PRODUCT_FIELDS and self.format == "json"
+        )
+
+    def query(self):
+        return build_products_query(self.columns, self.after_id, self.limit, self.code_prefix, self.in_stock)
+
+
+def build_products_query(
+    columns: Tuple[str, ...] = PRODUCT_FIELDS,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    code_prefix: Optional[str] = None,
+    in_stock: bool = False,
+):
+    """PRD_IDによるキーセットページネーション付きの商品一覧クエリ"""
+    # STOCKは販売可能数（在庫スロットの合計を含む）
+    stock = available_stock()
+    stmt = select(*(stock.label("STOCK") if column == "STOCK" else getattr(models.Product, column) for column in columns))
+    if after_id is not None:
+        stmt = stmt.where(models.Product.PRD_ID > after_id)
+    if code_prefix:
+        stmt = stmt.where(models.Product.CODE.startswith(code_prefix, autoescape=True))
+    if in_stock:
+        stmt = stmt.where(stock > 0)
+    stmt = stmt.order_by(models.Product.PRD_ID)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def next_after_id(rows: List[dict], limit: Optional[int]) -> Optional[int]:
+    """次ページ取得用のカーソル（最終ページならNone）"""
+    if limit is None or len(rows) < limit:
+        return None
+    return rows[-1]["PRD_ID"]
+
+
+def ndjson_lines(rows: Iterable) -> Iterable[bytes]:
+    for row in rows:
+        yield (json.dumps(dict(row), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+# --- 差分同期（変更履歴 catalog_changes） ---
+
+def settled_before() -> datetime:
+    """これより前に書き込まれた変更はコミット済みとみなす（CHANGED_ATが秒精度のDBのため1秒余分に待つ）"""
+    return datetime.now() - timedelta(seconds=CATALOG_COMMIT_LAG_SECONDS + 1)
+
+
+def catalog_version(db: Session) -> int:
+    """カタログのバージョン（コミット済みとみなせる変更履歴の最大CHG_ID）
+
+    CHG_IDは採番順で、コミットは購入毎に前後する。最大CHG_IDをそのまま渡すと、
+    まだコミットされていない小さいCHG_IDの変更が後から見えても、そのトークン以降の差分に含まれない。
+    CATALOG_COMMIT_LAG_SECONDS より新しい変更（とそれ以降のCHG_ID）はバージョンに含めず、次回以降の差分で返す。
+    """
+    C = models.CatalogChange
+    # 直近の変更（CHANGED_ATのインデックスの範囲）の最小CHG_IDより前が、コミット済みとみなせる範囲
+    unsettled = min(db.execute(select(C.CHG_ID).where(C.CHANGED_AT >= settled_before())).scalars(), default=None)
+    stmt = select(func.max(C.CHG_ID))
+    if unsettled is not None:
+        stmt = stmt.where(C.CHG_ID < unsettled)
+    return db.execute(stmt).scalar() or 0
+
+
+def oldest_change_id(db: Session) -> int:
+    """保持している変更履歴の最小CHG_ID（これより前は削除済み）"""
+    return db.execute(select(func.min(models.CatalogChange.CHG_ID))).scalar() or 0
+
+
+def catalog_etag(version: int) -> str:
+    return f'W/"catalog-{version}"'
+
+
+def products_etag(version: int) -> str:
+    """全商品一覧（GET /products）のETag（/catalog/syncとは別の表現）"""
+    return f'W/"products-{version}"'
+
+
+# 全商品一覧のシリアライズ・圧縮済みボディ（カタログのバージョンが変わるまで再利用）
+catalog_body = PrecompressedBody()
+
+
+def record_catalog_changes(connection, changes: List[dict]):
+    """変更履歴を一括INSERTする（changes: PRD_ID, CODE, OP）"""
+    if changes:
+        connection.execute(insert(models.CatalogChange.__table__), changes)
+
+
+def changed_since(db: Session, since: int, version: int):
+    """since〜versionの間に変更された商品（現行値）と削除された商品コードを返す"""
+    changes = db.execute(
+        select(models.CatalogChange.PRD_ID, models.CatalogChange.CODE, models.CatalogChange.OP)
+        .where(models.CatalogChange.CHG_ID > since, models.CatalogChange.CHG_ID <= version)
+        .order_by(models.CatalogChange.CHG_ID)
+    ).all()
+    # 同じ商品の最後の操作だけを採用する
+    last_op = {}
+    for prd_id, code, op in changes:
+        last_op[prd_id] = (code, op)
+    updated_ids = [prd_id for prd_id, (_, op) in last_op.items() if op != "D"]
+    products = []
+    if updated_ids:
+        products = [
+            dict(row) for row in db.execute(
+                build_products_query().where(models.Product.PRD_ID.in_(updated_ids))
+            ).mappings()
+        ]
+    deleted = [code for _, (code, op) in last_op.items() if op == "D"]
+    return products, deleted
+
+
+def prune_changes(db: Session) -> int:
+    """保持期間を過ぎた変更履歴を削除する
+
+    カタログのバージョン（最大CHG_ID）が巻き戻らないよう、最新の1行は残す。
+    """
+    version = catalog_version(db)
+    cutoff = datetime.now() - timedelta(hours=CATALOG_CHANGES_RETENTION_HOURS)
+    result = db.execute(
+        delete(models.CatalogChange)
+        .where(models.CatalogChange.CHANGED_AT < cutoff, models.CatalogChange.CHG_ID < version)
+    )
+    db.commit()
+    return result.rowcount
+
+
+async def prune_changes_periodically(session_factory):
+    """バックグラウンドで古い変更履歴を定期削除する"""
+    while True:
+        await asyncio.sleep(CATALOG_CHANGES_PRUNE_INTERVAL)
+        try:
+            def _prune():
+                with session_factory() as db:
+                    return prune_changes(db)
+            deleted = await run_in_threadpool(_prune)
+            if deleted:
+                logger.info("🧹 Old catalog changes removed: %s", deleted)
+        except Exception as e:
+            logger.warning("⚠️ Catalog change prune failed: %s", e)
+
+
+def changed_codes(db: Session, since: int) -> Tuple[List[str], int]:
+    """sinceより後、現在のバージョンまでに変更された商品コードと、そのバージョンを返す"""
+    version = catalog_version(db)
+    if version <= since:
+        return [], since
+    codes = db.execute(
+        select(models.CatalogChange.CODE)
+        .where(models.CatalogChange.CHG_ID > since, models.CatalogChange.CHG_ID <= version)
+        .distinct()
+    ).scalars().all()
+    return list(codes), version
+
+
+async def watch_catalog_changes(session_factory, *caches):
+    """変更履歴をポーリングし、変更された商品を各キャッシュから破棄する
+
+    ワーカー（プロセス）毎のキャッシュは他のワーカーでの購入を知らないため、
+    catalog_changes を共有の無効化ログとして使う。
+    """
+    def _initial_version():
+        with session_factory() as db:
+            return catalog_version(db)
+
+    def _poll(since):
+        with session_factory() as db:
+            return changed_codes(db, since)
+
+    version = None
+    while True:
+        await asyncio.sleep(CATALOG_WATCH_INTERVAL)
+        try:
+            if version is None:
+                version = await run_in_threadpool(_initial_version)
+                continue
+            codes, version = await run_in_threadpool(_poll, version)
+            if codes:
+                for cache in caches:
+                    cache.invalidate(*codes)
+        except Exception as e:
+            logger.warning("⚠️ Catalog change watch failed: %s", e)
+
+
+# ORM経由の商品登録・更新・削除を変更履歴に記録する
+# （在庫の一括UPDATEなどCore経由の更新は呼び出し側でrecord_catalog_changesを呼ぶ）
+def _track_product_change(op: str):
+    def listener(mapper, connection, target):
+        record_catalog_changes(connection, [{"PRD_ID": target.PRD_ID, "CODE": target.CODE, "OP": op}])
+    return listener
+
+
+event.listen(models.Product, "after_insert", _track_product_change("U"))
+event.listen(models.Product, "after_update", _track_product_change("U"))
+event.listen(models.Product, "after_delete", _track_product_change("D"))
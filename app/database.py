@@ -1,11 +1,22 @@
 import os
+import ssl
 import logging
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import pymysql
 from urllib.parse import urlparse, parse_qs
 
+from .pool_metrics import (
+    InstrumentedQueuePool,
+    InstrumentedAsyncAdaptedQueuePool,
+    register_pool_events,
+)
+from .metrics import instrument_engine
+from .models import Base  # モデル定義と同じメタデータ（create_allはこのBaseで行う）
+
 # PyMySQLをMySQLドライバとして使用
 pymysql.install_as_MySQLdb()
 
@@ -21,6 +32,60 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 SSL_CA_PATH = os.getenv("SSL_CA_PATH")
+# 非同期モード（AsyncEngine + asyncハンドラ）を有効にする
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+
+# コネクションプール設定（App Serviceインスタンスごとに調整可能）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+# チェックアウト毎の疎通確認（false にするとpool_recycleのみで古い接続を破棄）
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# 読み取りレプリカの接続URL（カンマ区切り。未設定なら読み取りもプライマリで行う）
+DB_READ_REPLICA_URLS = [url.strip() for url in os.getenv("DB_READ_REPLICA_URLS", "").split(",") if url.strip()]
+
+
+def pool_args(url: str, async_mode: bool = False) -> dict:
+    """create_engine用のプール引数を組み立てる（インメモリSQLiteは対象外）"""
+    if ":memory:" in url:
+        return {}
+    return {
+        "poolclass": InstrumentedAsyncAdaptedQueuePool if async_mode else InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+def sync_engine_args(url: str) -> dict:
+    """create_engineの引数（プール設定とAzure MySQL用SSL設定）"""
+    # SQLAlchemy接続引数
+    engine_args = {
+        "echo": False,
+        **pool_args(url)
+    }
+
+    # Azure MySQL用SSL設定（SQLiteなどローカルDBでは不要）
+    if url.startswith("mysql"):
+        ssl_config = {
+            "ssl_disabled": False,
+            "ssl_verify_cert": False,  # 証明書検証を無効化
+            "ssl_verify_identity": False,  # ID検証を無効化
+        }
+
+        # SSL証明書ファイルが存在する場合は使用
+        if SSL_CA_PATH and os.path.exists(SSL_CA_PATH):
+            logger.info("🔒 Using SSL certificate file: %s", SSL_CA_PATH)
+            ssl_config["ssl_ca"] = SSL_CA_PATH
+            # ファイルがある場合でも検証は無効のまま（Azure MySQL用）
+        else:
+            logger.info("🔒 Using SSL without certificate file verification")
+
+        engine_args["connect_args"] = ssl_config
+    return engine_args
+
 
 # DATABASE_URLを構築
 if all([DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD]):
@@ -34,16 +99,19 @@ else:
 
 # ログ出力
 logger.info("🔧 Database configuration:")
-logger.info(f"  DB_HOST: {DB_HOST if DB_HOST else 'Not set'}")
-logger.info(f"  DB_PORT: {DB_PORT if DB_PORT else 'Not set'}")
-logger.info(f"  DB_NAME: {DB_NAME if DB_NAME else 'Not set'}")
-logger.info(f"  DB_USER: {DB_USER if DB_USER else 'Not set'}")
-logger.info(f"  DB_PASSWORD: {'***' if DB_PASSWORD else 'Not set'}")
-logger.info(f"  DATABASE_URL: {DATABASE_URL[:60] if DATABASE_URL else 'Not set'}...")
-logger.info(f"  SSL_CA_PATH: {SSL_CA_PATH if SSL_CA_PATH else 'Not set'}")
+logger.info("  DB_HOST: %s", DB_HOST if DB_HOST else 'Not set')
+logger.info("  DB_PORT: %s", DB_PORT if DB_PORT else 'Not set')
+logger.info("  DB_NAME: %s", DB_NAME if DB_NAME else 'Not set')
+logger.info("  DB_USER: %s", DB_USER if DB_USER else 'Not set')
+logger.info("  DB_PASSWORD: %s", '***' if DB_PASSWORD else 'Not set')
+logger.info("  DATABASE_URL: %s...", DATABASE_URL[:60] if DATABASE_URL else 'Not set')
+logger.info("  SSL_CA_PATH: %s", SSL_CA_PATH if SSL_CA_PATH else 'Not set')
+logger.info("  POOL: size=%s, max_overflow=%s, timeout=%s, recycle=%s, pre_ping=%s", DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING)
 
 # SQLAlchemyエンジン作成
 engine = None
+# 接続設定がなくインメモリSQLiteで動作している
+USING_FALLBACK_ENGINE = False
 
 try:
     if not DATABASE_URL:
@@ -51,60 +119,36 @@ try:
     
     logger.info("🔗 Creating database engine with Azure MySQL SSL support")
 
-    # SQLAlchemy接続引数
-    engine_args = {
-        "echo": False,
-        "pool_pre_ping": True,
-        "pool_recycle": 3600
-    }
-
-    # Azure MySQL用SSL設定
-    ssl_config = {
-        "ssl_disabled": False,
-        "ssl_verify_cert": False,  # 証明書検証を無効化
-        "ssl_verify_identity": False,  # ID検証を無効化
-    }
-
-    # SSL証明書ファイルが存在する場合は使用
-    if SSL_CA_PATH and os.path.exists(SSL_CA_PATH):
-        logger.info(f"🔒 Using SSL certificate file: {SSL_CA_PATH}")
-        ssl_config["ssl_ca"] = SSL_CA_PATH
-        # ファイルがある場合でも検証は無効のまま（Azure MySQL用）
-    else:
-        logger.info("🔒 Using SSL without certificate file verification")
-
-    engine_args["connect_args"] = ssl_config
+    engine_args = sync_engine_args(DATABASE_URL)
 
     # エンジン作成
     engine = create_engine(DATABASE_URL, **engine_args)
+    register_pool_events(engine)
+    instrument_engine(engine)
     logger.info("✅ Database engine created successfully")
 
-    # テスト接続
-    try:
-        logger.info("🧪 Testing database connection...")
-        from sqlalchemy import text
-        with engine.connect() as conn:
-            result = conn.execute(text("SELECT 1 AS test"))
-            logger.info("✅ Database connection test successful")
-    except Exception as conn_error:
-        logger.warning(f"⚠️ Database connection test failed: {conn_error}")
-        logger.warning("⚠️ Will retry during first request")
+    # 作成時には接続しない（最初の接続はウォームアップまたは最初のリクエスト時）
 
 except Exception as e:
-    logger.error(f"❌ Failed to create database engine: {e}")
-    logger.error(f"❌ DATABASE_URL: {DATABASE_URL}")
-    logger.error(f"❌ Error type: {type(e)}")
-    logger.error("❌ Creating dummy engine for debugging...")
+    logger.error("❌ Failed to create database engine: %s", e)
+    logger.error("❌ DATABASE_URL: %s", DATABASE_URL)
+    logger.error("❌ Error type: %s", type(e))
+    logger.error("❌ Creating in-memory SQLite engine for debugging...")
     try:
-        engine = create_engine("sqlite:///:memory:", echo=False)
-        logger.warning("⚠️ Using in-memory SQLite for debugging")
-    except:
+        # 全スレッドで同じ接続（=同じインメモリDB）を使い、スキーマを作成しておく
+        engine = create_engine(
+            "sqlite:///:memory:", echo=False,
+            connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        Base.metadata.create_all(engine)
+        USING_FALLBACK_ENGINE = True
+        logger.warning("⚠️ Using in-memory SQLite for debugging (empty schema created)")
+    except Exception:
         logger.error("❌ Failed to create any database engine")
         engine = None
 
 # セッション設定
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
 
 # DBセッション生成関数
 def get_db():
@@ -113,9 +157,111 @@ def get_db():
     try:
         yield db
     except Exception as e:
-        logger.error(f"❌ Database session error: {e}")
+        logger.error("❌ Database session error: %s", e)
         db.rollback()
         raise
     finally:
         logger.debug("📡 Closing database session")
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# 非同期ドライバ用URLへの変換（pymysql -> aiomysql, sqlite -> aiosqlite）
+def to_async_url(url: str) -> str:
+    if url.startswith("mysql+pymysql://"):
+        return "mysql+aiomysql://" + url[len("mysql+pymysql://"):]
+    if url.startswith("mysql://"):
+        return "mysql+aiomysql://" + url[len("mysql://"):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+def async_engine_args_for(async_url: str) -> dict:
+    """create_async_engineの引数（プール設定とaiomysql用SSL設定）"""
+    async_engine_args = {
+        "echo": False,
+        **pool_args(async_url, async_mode=True)
+    }
+    if async_url.startswith("mysql+aiomysql://"):
+        # aiomysqlはSSLContextを受け取る（同期側と同じく検証は無効）
+        ssl_context = ssl.create_default_context(
+            cafile=SSL_CA_PATH if SSL_CA_PATH and os.path.exists(SSL_CA_PATH) else None
+        )
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+        async_engine_args["connect_args"] = {"ssl": ssl_context}
+    return async_engine_args
+
+# 非同期エンジン作成（DB_ASYNC=true の場合のみ）
+async_engine = None
+AsyncSessionLocal = None
+
+if DB_ASYNC:
+    try:
+        async_url = to_async_url(DATABASE_URL) if DATABASE_URL else "sqlite+aiosqlite:///:memory:"
+        async_engine_args = async_engine_args_for(async_url)
+        async_engine = create_async_engine(async_url, **async_engine_args)
+        register_pool_events(async_engine)
+        instrument_engine(async_engine)
+        AsyncSessionLocal = async_sessionmaker(
+            async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+        )
+        logger.info("✅ Async database engine created successfully")
+    except Exception as e:
+        logger.error("❌ Failed to create async database engine: %s", e)
+        async_engine = None
+
+# 読み取りレプリカのエンジン（DB_READ_REPLICA_URLS。プライマリと同じプール設定で作成し、接続は初回使用時）
+read_engines = []
+async_read_engines = []
+
+if DB_READ_REPLICA_URLS and not USING_FALLBACK_ENGINE:
+    for replica_url in DB_READ_REPLICA_URLS:
+        try:
+            read_engine = create_engine(replica_url, **sync_engine_args(replica_url))
+            async_read_engine = None
+            if DB_ASYNC:
+                async_replica_url = to_async_url(replica_url)
+                async_read_engine = create_async_engine(async_replica_url, **async_engine_args_for(async_replica_url))
+        except Exception as e:
+            logger.error("❌ Failed to create read replica engine %s...: %s", replica_url[:60], e)
+            continue
+        for created in (read_engine, async_read_engine):
+            if created is not None:
+                register_pool_events(created)
+                instrument_engine(created)
+        read_engines.append(read_engine)
+        async_read_engines.append(async_read_engine)
+    logger.info("✅ Read replica engines created: %s", len(read_engines))
+
+async def create_async_fallback_schema():
+    """非同期エンジンもインメモリSQLiteの場合は、そちらにもスキーマを作成する（起動時に呼び出す）"""
+    if USING_FALLBACK_ENGINE and async_engine is not None:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+def dispose_engines():
+    """fork後の子プロセスで呼び出し、親プロセスから引き継いだ接続を使わないようにする
+
+    close=False で親の接続を閉じずに手放し、子プロセスでは新しいプールから接続する。
+    """
+    if engine is not None:
+        engine.dispose(close=False)
+    if async_engine is not None:
+        async_engine.sync_engine.dispose(close=False)
+    for read_engine in read_engines:
+        read_engine.dispose(close=False)
+    for async_read_engine in async_read_engines:
+        if async_read_engine is not None:
+            async_read_engine.sync_engine.dispose(close=False)
+    logger.info("🔁 Database pools reset after fork (pid=%s)", os.getpid())
+
+# 非同期DBセッション生成関数
+async def get_async_db():
+    logger.debug("📡 Creating async database session")
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception as e:
+            logger.error("❌ Async database session error: %s", e)
+            await db.rollback()
+            raise
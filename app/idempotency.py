@@ -0,0 +1,71 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, delete
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# 冪等性キーの保持期間（時間）と期限切れキーの削除間隔（秒）
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+IDEMPOTENCY_SWEEP_INTERVAL = float(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL", "600"))
+IDEMPOTENCY_CACHE_MAX_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_MAX_SIZE", "10000"))
+
+# キー -> TransactionResponseのdict（DBより前に参照するLRU）
+idempotency_cache = LRUCache(IDEMPOTENCY_KEY_TTL_HOURS * 3600, IDEMPOTENCY_CACHE_MAX_SIZE)
+
+
+def lookup_response(db: Session, key: str) -> Optional[dict]:
+    """保存済みのレスポンスを返す（LRU -> DBの順に参照）"""
+    response = idempotency_cache.get(key)
+    if response is not None:
+        return response
+    stored = db.execute(
+        select(models.PurchaseIdempotency.RESPONSE)
+        .where(models.PurchaseIdempotency.IDEMPOTENCY_KEY == key)
+    ).scalar()
+    if stored is None:
+        return None
+    response = json.loads(stored)
+    idempotency_cache.set(key, response)
+    return response
+
+
+def idempotency_row(key: str, trd_id: int, response: dict) -> dict:
+    return {
+        "IDEMPOTENCY_KEY": key,
+        "TRD_ID": trd_id,
+        "RESPONSE": json.dumps(response, ensure_ascii=False)
+    }
+
+
+def sweep_expired(db: Session) -> int:
+    """保持期間を過ぎたキーを削除する"""
+    cutoff = datetime.now() - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+    result = db.execute(
+        delete(models.PurchaseIdempotency).where(models.PurchaseIdempotency.CREATED_AT < cutoff)
+    )
+    db.commit()
+    return result.rowcount
+
+
+async def sweep_periodically(session_factory):
+    """バックグラウンドで期限切れキーを定期削除する"""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_SWEEP_INTERVAL)
+        try:
+            def _sweep():
+                with session_factory() as db:
+                    return sweep_expired(db)
+            deleted = await run_in_threadpool(_sweep)
+            if deleted:
+                logger.info("🧹 Expired idempotency keys removed: %s", deleted)
+        except Exception as e:
+            logger.warning("⚠️ Idempotency key sweep failed: %s", e)
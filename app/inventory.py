@@ -0,0 +1,285 @@
+"""売れ筋商品の在庫スロット（在庫カウンタの分割）
+
+売れ筋の商品は在庫を STOCK_SLOT_COUNT 個のスロット（product_stock_slots の行）に分け、
+購入時はランダムに選んだスロットを条件付きUPDATEで減らす。同じ商品の同時購入が
+product_master の1行の行ロックで直列化されなくなる。
+
+- 販売可能数 = product_master.STOCK + 全スロットのQTY（読み取りは主キー範囲のSUM）
+- 定期的なコンパクションで、直近 STOCK_HOT_WINDOW 秒の売れ筋上位 STOCK_HOT_PRODUCTS 件はスロットへ均等に再配分し、
+  それ以外（売れ筋から外れた・在庫が少ない）はスロットを STOCK に戻す
+- ロックは常に商品行→スロットの順に取る（購入時の全スロットからの引当・コンパクションとも）
+
+    # 全スロットを STOCK に戻す（メンテナンス前など）
+    python -m app.inventory --fold-all
+"""
+import os
+import random
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Set, Tuple
+from sqlalchemy import select, update, delete, insert, func, bindparam
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# 売れ筋商品の在庫を分割するスロット数（0で無効: 従来どおり product_master.STOCK のみ）
+STOCK_SLOT_COUNT = int(os.getenv("STOCK_SLOT_COUNT", "0"))
+# スロットに分割する商品数（直近の販売数量の上位）
+STOCK_HOT_PRODUCTS = int(os.getenv("STOCK_HOT_PRODUCTS", "20"))
+# 売れ筋の判定に使う直近の販売期間（秒）
+STOCK_HOT_WINDOW = float(os.getenv("STOCK_HOT_WINDOW", "300"))
+# 1スロットあたりの最小在庫（これ未満になる商品は分割せず STOCK で管理する）
+STOCK_SLOT_MIN_QTY = int(os.getenv("STOCK_SLOT_MIN_QTY", "10"))
+# コンパクション（スロットの再配分・STOCKへの集約）の間隔（秒）
+STOCK_COMPACT_INTERVAL = float(os.getenv("STOCK_COMPACT_INTERVAL", "10"))
+
+product_table = models.Product.__table__
+slot_table = models.ProductStockSlot.__table__
+
+
+def available_stock():
+    """販売可能数の式（STOCK + スロットの合計）。分割無効時は STOCK のみ"""
+    if STOCK_SLOT_COUNT <= 0:
+        return models.Product.STOCK
+    slot_total = (
+        select(func.coalesce(func.sum(models.ProductStockSlot.QTY), 0))
+        .where(models.ProductStockSlot.PRD_ID == models.Product.PRD_ID)
+        .scalar_subquery()
+    )
+    return models.Product.STOCK + slot_total
+
+
+def load_products(db: Session, codes: Iterable[str]) -> Tuple[Dict[str, models.Product], Dict[str, int]]:
+    """購入対象の商品と販売可能数を取得する
+
+    分割無効時は従来どおり商品行を FOR UPDATE でロックする。
+    有効時はロックせずに読み、在庫の確保は reserve_stock の条件付きUPDATEで行う。
+    """
+    codes = set(codes)
+    if STOCK_SLOT_COUNT <= 0:
+        products = {
+            product.CODE: product
+            for product in db.query(models.Product).filter(models.Product.CODE.in_(codes)).with_for_update().all()
+        }
+        return products, {code: product.STOCK for code, product in products.items()}
+    rows = db.query(models.Product, available_stock()).filter(models.Product.CODE.in_(codes)).all()
+    return {product.CODE: product for product, _ in rows}, {product.CODE: stock for product, stock in rows}
+
+
+def _slotted_ids(connection, prd_ids: Iterable[int]) -> Set[int]:
+    return set(connection.execute(
+        select(slot_table.c.PRD_ID).where(slot_table.c.PRD_ID.in_(list(prd_ids))).distinct()
+    ).scalars())
+
+
+def _take_from_one_slot(connection, prd_id: int, qty: int) -> bool:
+    """qtyを1スロットで賄えるスロットをランダムな順にロックして減らす
+
+    候補はロックせずに読んだ時点で足りているスロットだけにし、1行ずつ FOR UPDATE SKIP LOCKED で
+    ロックする（他の購入がロック中のスロットは待たずに飛ばす）。条件付きUPDATEで試すと、
+    InnoDB（REPEATABLE READ）では条件に合わなかったスロットの行ロックも残り、
+    _take_across_slots が後から商品行をロックしてコンパクションとロック順が逆になる。
+    ロックしたスロットは足りていることを確かめてから減らす。
+    """
+    candidates = list(connection.execute(
+        select(slot_table.c.SLOT_NO).where(slot_table.c.PRD_ID == prd_id, slot_table.c.QTY >= qty)
+    ).scalars())
+    random.shuffle(candidates)
+    lock = (
+        select(slot_table.c.QTY)
+        .where(slot_table.c.PRD_ID == prd_id, slot_table.c.SLOT_NO == bindparam("b_slot"))
+        .with_for_update(skip_locked=True)
+    )
+    take = (
+        update(slot_table)
+        .where(slot_table.c.PRD_ID == prd_id, slot_table.c.SLOT_NO == bindparam("b_slot"))
+        .values(QTY=slot_table.c.QTY - qty)
+    )
+    for slot_no in candidates:
+        slot_qty = connection.execute(lock, {"b_slot": slot_no}).scalar()
+        # None: 他の購入がロック中。足りない: 未ロックで読んだ後に他の購入で減った
+        if slot_qty is not None and slot_qty >= qty:
+            connection.execute(take, {"b_slot": slot_no})
+            return True
+    return False
+
+
+def _take_across_slots(connection, prd_id: int, qty: int) -> bool:
+    """1スロットで足りない場合: 商品行→全スロットの順にロックして複数スロットと STOCK から減らす"""
+    connection.execute(
+        select(product_table.c.PRD_ID).where(product_table.c.PRD_ID == prd_id).with_for_update()
+    )
+    slots = connection.execute(
+        select(slot_table.c.SLOT_NO, slot_table.c.QTY)
+        .where(slot_table.c.PRD_ID == prd_id)
+        .order_by(slot_table.c.SLOT_NO)
+        .with_for_update()
+    ).all()
+    remaining = qty
+    taken = []
+    for slot_no, slot_qty in slots:
+        if remaining <= 0:
+            break
+        take = min(slot_qty, remaining)
+        if take > 0:
+            taken.append({"b_slot": slot_no, "b_qty": take})
+            remaining -= take
+    if remaining > 0:
+        result = connection.execute(
+            update(product_table)
+            .where(product_table.c.PRD_ID == prd_id, product_table.c.STOCK >= remaining)
+            .values(STOCK=product_table.c.STOCK - remaining)
+        )
+        if not result.rowcount:
+            return False
+    if taken:
+        connection.execute(
+            update(slot_table)
+            .where(slot_table.c.PRD_ID == prd_id, slot_table.c.SLOT_NO == bindparam("b_slot"))
+            .values(QTY=slot_table.c.QTY - bindparam("b_qty")),
+            taken
+        )
+    return True
+
+
+def reserve_stock(connection, qty_by_prd_id: Dict[int, int]) -> List[int]:
+    """在庫を減らし、足りなかった商品IDを返す（スロット分割が有効な場合の decrement_stock）
+
+    スロットに分割された商品は1スロット、足りなければ全スロットと STOCK から減らす。
+    分割されていない商品は STOCK を条件付きUPDATEで減らし、足りなければ
+    （直前のコンパクションで分割された場合に備えて）全スロットと合わせて減らす。
+    """
+    slotted = _slotted_ids(connection, qty_by_prd_id)
+    decrement = (
+        update(product_table)
+        .where(product_table.c.PRD_ID == bindparam("b_prd_id"), product_table.c.STOCK >= bindparam("b_qty"))
+        .values(STOCK=product_table.c.STOCK - bindparam("b_qty"))
+    )
+    short = []
+    # ロック順を揃えてデッドロックを避ける
+    for prd_id in sorted(qty_by_prd_id):
+        qty = qty_by_prd_id[prd_id]
+        if prd_id in slotted:
+            taken = _take_from_one_slot(connection, prd_id, qty)
+        else:
+            taken = connection.execute(decrement, {"b_prd_id": prd_id, "b_qty": qty}).rowcount > 0
+        if not (taken or _take_across_slots(connection, prd_id, qty)):
+            short.append(prd_id)
+    return short
+
+
+def restore_stock(connection, qty_by_prd_id: Dict[int, int]):
+    """確保した在庫を STOCK に戻す（確保をコミットした後の処理が失敗した場合）"""
+    if qty_by_prd_id:
+        connection.execute(
+            update(product_table)
+            .where(product_table.c.PRD_ID == bindparam("b_prd_id"))
+            .values(STOCK=product_table.c.STOCK + bindparam("b_qty")),
+            [{"b_prd_id": prd_id, "b_qty": qty} for prd_id, qty in qty_by_prd_id.items()]
+        )
+
+
+# --- コンパクション ---
+
+def hot_product_ids(db: Session, limit: int = STOCK_HOT_PRODUCTS, window: float = STOCK_HOT_WINDOW) -> List[int]:
+    """直近window秒の販売数量上位の商品
+
+    購入時に追記される取引明細から集計する（売れ筋の判定のために購入時の書き込みを増やさない）。
+    全ワーカーが同じ結果を得るため、ワーカー間でスロットの分割・集約が食い違わない。
+    """
+    if limit <= 0:
+        return []
+    T, D = models.Transaction, models.TransactionDetail
+    now = datetime.now()
+    return list(db.execute(
+        select(D.PRD_ID)
+        .join(T, T.TRD_ID == D.TRD_ID)
+        # 上限も指定して取引日時のインデックスで範囲を絞らせる
+        .where(T.DATETIME >= now - timedelta(seconds=window), T.DATETIME <= now)
+        .group_by(D.PRD_ID)
+        .order_by(func.sum(D.QTY).desc(), D.PRD_ID)
+        .limit(limit)
+    ).scalars())
+
+
+def rebalance(db: Session, prd_id: int, slotted: bool) -> int:
+    """1商品の在庫を STOCK とスロットの合計から配分し直してコミットする（販売可能数は変わらない）
+
+    slotted=True なら合計をスロットへ均等に分け（端数は STOCK）、False なら全て STOCK に戻す。
+    戻り値は販売可能数。
+    """
+    # 購入時（_take_across_slots）と同じく商品行→スロットの順にロックする
+    stock = db.execute(
+        select(product_table.c.STOCK).where(product_table.c.PRD_ID == prd_id).with_for_update()
+    ).scalar()
+    slot_qty = db.execute(
+        select(slot_table.c.QTY).where(slot_table.c.PRD_ID == prd_id).with_for_update()
+    ).scalars().all()
+    if stock is None:
+        db.execute(delete(slot_table).where(slot_table.c.PRD_ID == prd_id))
+        db.commit()
+        return 0
+    total = stock + sum(slot_qty)
+    per_slot = total // STOCK_SLOT_COUNT if slotted and STOCK_SLOT_COUNT > 0 else 0
+    if per_slot < STOCK_SLOT_MIN_QTY:
+        per_slot = 0
+
+    db.execute(delete(slot_table).where(slot_table.c.PRD_ID == prd_id))
+    if per_slot:
+        db.execute(insert(slot_table), [
+            {"PRD_ID": prd_id, "SLOT_NO": slot_no, "QTY": per_slot} for slot_no in range(STOCK_SLOT_COUNT)
+        ])
+    db.execute(
+        update(product_table).where(product_table.c.PRD_ID == prd_id)
+        .values(STOCK=total - per_slot * STOCK_SLOT_COUNT)
+    )
+    db.commit()
+    return total
+
+
+def compact(db: Session, hot_ids: Iterable[int] = ()) -> dict:
+    """売れ筋商品をスロットへ再配分し、それ以外のスロットを STOCK に戻す（商品毎にコミット）"""
+    hot = set(hot_ids)
+    current = set(db.execute(select(slot_table.c.PRD_ID).distinct()).scalars())
+    db.rollback()
+    for prd_id in sorted(hot | current):
+        rebalance(db, prd_id, prd_id in hot)
+    slotted = set(db.execute(select(slot_table.c.PRD_ID).distinct()).scalars())
+    db.rollback()
+    return {"slotted": len(slotted), "folded": len(current - slotted)}
+
+
+async def compact_periodically(session_factory):
+    """STOCK_COMPACT_INTERVAL 秒ごとにコンパクションを行う（ワーカー毎に実行しても行ロックで直列化される）"""
+    def _compact():
+        with session_factory() as db:
+            return compact(db, hot_product_ids(db))
+
+    while True:
+        await asyncio.sleep(STOCK_COMPACT_INTERVAL)
+        try:
+            result = await run_in_threadpool(_compact)
+            logger.debug("📦 Stock slots compacted: %s", result)
+        except Exception as e:
+            logger.warning("⚠️ Stock slot compaction failed: %s", e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fold-all", action="store_true", help="全スロットを STOCK に戻す")
+    args = parser.parse_args()
+
+    from .logging_config import setup_logging
+    from .database import SessionLocal
+    setup_logging()
+    with SessionLocal() as db:
+        print(compact(db) if args.fold_all else compact(db, hot_product_ids(db)))
+
+
+if __name__ == "__main__":
+    main()
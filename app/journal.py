@@ -0,0 +1,434 @@
+"""購入のライトビハインド・ジャーナル
+
+PURCHASE_JOURNAL_ENABLED=true の場合、購入登録は在庫の確保（条件付きUPDATE）と冪等性キーの登録だけを
+同期的にコミットし、取引（ヘッダ・明細）をローカルの追記専用ファイルに書いてfsyncした時点で応答する。
+バックグラウンドのライターが PURCHASE_JOURNAL_BATCH_SIZE 件ずつ1トランザクションでDBへ書き込み、売上集計にも加算する。
+
+- TRD_ID は id_blocks から TRD_ID_BLOCK_SIZE 件ずつ確保したブロックから採番する
+- fsync は PURCHASE_JOURNAL_FSYNC_INTERVAL 秒の間に追記された分をまとめて1回行う
+- ジャーナルはプロセス毎のファイル（flockで使用中を示す）。起動時に、終了したプロセスが残したファイルを
+  DBへ書き込んでから削除する（書き込み済みのTRD_IDは飛ばす）
+- 冪等性キーは在庫の確保と同じトランザクションでレスポンスごと登録する（全プロセスで同じキーを二重に処理しない）。
+  確保のコミット後、fsync前にプロセスが落ちた取引は、起動時にキーに保存したレスポンスから書き込む
+"""
+import os
+import json
+import time
+import fcntl
+import socket
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from sqlalchemy import select, insert, update, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .reporting import record_sales
+from .idempotency import idempotency_row
+
+logger = logging.getLogger(__name__)
+
+PURCHASE_JOURNAL_ENABLED = os.getenv("PURCHASE_JOURNAL_ENABLED", "false").lower() == "true"
+# ジャーナルファイルの置き場所（ローカルディスク）
+PURCHASE_JOURNAL_DIR = os.getenv("PURCHASE_JOURNAL_DIR", "journal")
+# fsyncをまとめる待ち時間（秒）
+PURCHASE_JOURNAL_FSYNC_INTERVAL = float(os.getenv("PURCHASE_JOURNAL_FSYNC_INTERVAL", "0.002"))
+# ライターが1トランザクションで書き込む件数と、書き込みの間隔（秒）
+PURCHASE_JOURNAL_BATCH_SIZE = int(os.getenv("PURCHASE_JOURNAL_BATCH_SIZE", "500"))
+PURCHASE_JOURNAL_WRITE_INTERVAL = float(os.getenv("PURCHASE_JOURNAL_WRITE_INTERVAL", "0.2"))
+# 1ファイルあたりの件数（超えたら次のファイルへ。DBへ書き込み済みのファイルは削除）
+PURCHASE_JOURNAL_SEGMENT_RECORDS = int(os.getenv("PURCHASE_JOURNAL_SEGMENT_RECORDS", "10000"))
+# 冪等性キーだけが登録され取引がない購入を、キーのレスポンスから書き込むまでの経過時間（秒）
+PURCHASE_JOURNAL_ORPHAN_AGE = float(os.getenv("PURCHASE_JOURNAL_ORPHAN_AGE", "300"))
+# 一度に確保するTRD_IDの件数
+TRD_ID_BLOCK_SIZE = int(os.getenv("TRD_ID_BLOCK_SIZE", "1000"))
+
+TRD_ID_BLOCK_NAME = "transactions"
+HEADER_FIELDS = ("TRD_ID", "DATETIME", "EMP_CD", "STORE_CD", "POS_NO", "TOTAL_AMT", "TTL_AMT_EX_TAX")
+
+
+# --- TRD_IDのブロック採番 ---
+
+def allocate_block(db: Session, size: int) -> Tuple[int, int]:
+    """TRD_IDを size 件確保して [start, end) を返す（既存の取引の最大TRD_IDより後から）"""
+    while True:
+        next_id = db.execute(
+            select(models.IdBlock.NEXT_ID).where(models.IdBlock.NAME == TRD_ID_BLOCK_NAME).with_for_update()
+        ).scalar()
+        floor = (db.execute(select(func.max(models.Transaction.TRD_ID))).scalar() or 0) + 1
+        start = max(next_id or 1, floor)
+        try:
+            if next_id is None:
+                db.execute(insert(models.IdBlock), [{"NAME": TRD_ID_BLOCK_NAME, "NEXT_ID": start + size}])
+            else:
+                db.execute(
+                    update(models.IdBlock).where(models.IdBlock.NAME == TRD_ID_BLOCK_NAME).values(NEXT_ID=start + size)
+                )
+            db.commit()
+            return start, start + size
+        except IntegrityError:
+            # 他のプロセスが同時に最初の行を作成した
+            db.rollback()
+
+
+class TrdIdAllocator:
+    """確保済みブロックからTRD_IDを払い出す（使い切ったら次のブロックを確保）
+
+    ブロックの確保はリクエストのセッションで行い、その時点までのトランザクションをコミットする。
+    非同期モードではイベントループのスレッドで実行されるため、DBアクセス中はロックを持たない。
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks: Deque[List[int]] = deque()  # [次のID, 終端（含まない）]
+
+    def _take(self, count: int) -> List[int]:
+        ids = []
+        with self._lock:
+            while self._blocks and len(ids) < count:
+                block = self._blocks[0]
+                taken = min(count - len(ids), block[1] - block[0])
+                ids.extend(range(block[0], block[0] + taken))
+                block[0] += taken
+                if block[0] >= block[1]:
+                    self._blocks.popleft()
+        return ids
+
+    def take(self, db: Session, count: int) -> List[int]:
+        ids = self._take(count)
+        while len(ids) < count:
+            start, end = allocate_block(db, max(self.block_size, count - len(ids)))
+            logger.info("🔢 TRD_ID block allocated: %s..%s", start, end - 1)
+            with self._lock:
+                self._blocks.append([start, end])
+            ids.extend(self._take(count - len(ids)))
+        return ids
+
+    def next_id(self, db: Session) -> int:
+        return self.take(db, 1)[0]
+
+
+# --- ジャーナルファイル ---
+
+class _Segment:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "ab")
+        # 使用中を示す（終了したプロセスのファイルだけが起動時の再生対象になる）
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.records = 0
+        self.written = 0
+        self.closed = False
+
+
+class PurchaseJournal:
+    """追記専用のジャーナル（fsyncはバックグラウンドのスレッドがまとめて行う）"""
+
+    def __init__(self, directory: str, fsync_interval: float, segment_records: int):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.segment_records = segment_records
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._segments: List[_Segment] = []
+        self._pending: Deque[Tuple[_Segment, dict]] = deque()
+        self._seq = 0
+        self._synced_seq = 0
+        self._syncing: Optional[_Segment] = None
+        self._error: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+        self._prefix = f"purchases-{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
+        self.appended = 0
+        self.written = 0
+        self.fsyncs = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._thread is not None
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._rotate()
+        self._closing = False
+        self._thread = threading.Thread(target=self._fsync_loop, name="purchase-journal-fsync", daemon=True)
+        self._thread.start()
+        logger.info("📒 Purchase journal opened: %s", self._segments[-1].path)
+
+    def _rotate(self):
+        """新しいファイルへ切り替える（ロック内で呼ぶ）。古いファイルはここでfsyncしておく"""
+        if self._segments:
+            current = self._segments[-1]
+            current.file.flush()
+            os.fsync(current.file.fileno())
+            current.closed = True
+        path = os.path.join(self.directory, f"{self._prefix}-{len(self._segments):06d}.jsonl")
+        self._segments.append(_Segment(path))
+
+    def append(self, record: dict) -> int:
+        """1件追記して連番を返す（wait_durable(連番) でfsync完了を待つ）"""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._error is not None:
+                raise RuntimeError(f"Purchase journal is unavailable: {self._error}")
+            segment = self._segments[-1]
+            segment.file.write(line)
+            segment.records += 1
+            self._seq += 1
+            self._pending.append((segment, record))
+            self.appended += 1
+            if segment.records >= self.segment_records:
+                self._rotate()
+            self._synced.notify_all()
+            return self._seq
+
+    def wait_durable(self, seq: int):
+        with self._lock:
+            while self._synced_seq < seq:
+                if self._error is not None:
+                    raise RuntimeError(f"Purchase journal fsync failed: {self._error}")
+                self._synced.wait()
+
+    def _fsync_loop(self):
+        while True:
+            with self._lock:
+                while self._synced_seq >= self._seq and not self._closing:
+                    self._synced.wait()
+                if self._synced_seq >= self._seq and self._closing:
+                    return
+            # この間に追記された分もまとめて1回のfsyncにする
+            time.sleep(self.fsync_interval)
+            try:
+                with self._lock:
+                    seq = self._seq
+                    segment = self._syncing = self._segments[-1]
+                    segment.file.flush()
+                os.fsync(segment.file.fileno())
+                with self._lock:
+                    self._syncing = None
+                    self._synced_seq = max(self._synced_seq, seq)
+                    self.fsyncs += 1
+                    self._synced.notify_all()
+            except Exception as e:
+                logger.error("❌ Purchase journal fsync failed: %s", e)
+                with self._lock:
+                    self._error = e
+                    self._synced.notify_all()
+                return
+
+    def peek(self, limit: int) -> List[dict]:
+        """DBへ未書き込みのレコード（古い順）"""
+        with self._lock:
+            return [record for _, record in list(self._pending)[:limit]]
+
+    def mark_written(self, count: int):
+        """先頭からcount件をDBへ書き込み済みにし、全件書き込み済みで切り替え済みのファイルを削除する"""
+        with self._lock:
+            for _ in range(count):
+                segment, record = self._pending.popleft()
+                segment.written += 1
+            self.written += count
+            for segment in list(self._segments):
+                if segment.closed and segment.written >= segment.records and segment is not self._syncing:
+                    segment.file.close()
+                    os.unlink(segment.path)
+                    self._segments.remove(segment)
+
+    def close(self):
+        """fsyncスレッドを止めてファイルを閉じる（DBへ未書き込みのレコードがあるファイルは残す）"""
+        if self._thread is None:
+            return
+        with self._lock:
+            self._closing = True
+            self._synced.notify_all()
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            for segment in self._segments:
+                segment.file.flush()
+                os.fsync(segment.file.fileno())
+                segment.file.close()
+                if segment.written >= segment.records:
+                    os.unlink(segment.path)
+            self._segments = []
+
+    def own_paths(self) -> List[str]:
+        with self._lock:
+            return [segment.path for segment in self._segments]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": PURCHASE_JOURNAL_ENABLED,
+                "appended": self.appended,
+                "written": self.written,
+                "pending": len(self._pending),
+                "unsynced": self._seq - self._synced_seq,
+                "fsyncs": self.fsyncs,
+                "segments": len(self._segments),
+                "error": str(self._error) if self._error else None,
+            }
+
+
+# --- DBへの書き込み ---
+
+def write_sales(db: Session, records: List[dict]) -> int:
+    """ジャーナルのレコードを1トランザクションでDBへ書き込む（書き込み済みのTRD_IDは飛ばす）"""
+    responses = {record["response"]["TRD_ID"]: record for record in records}
+    existing = set(db.execute(
+        select(models.Transaction.TRD_ID).where(models.Transaction.TRD_ID.in_(list(responses)))
+    ).scalars())
+    records = [record for trd_id, record in responses.items() if trd_id not in existing]
+    if not records:
+        db.rollback()
+        return 0
+
+    headers, details, idempotency_rows = [], [], []
+    for record in records:
+        response = record["response"]
+        header = {field: response[field] for field in HEADER_FIELDS}
+        header["DATETIME"] = datetime.fromisoformat(header["DATETIME"])
+        headers.append(header)
+        details.extend(dict(detail, TRD_ID=response["TRD_ID"]) for detail in response["details"])
+        if record.get("idempotency_key"):
+            idempotency_rows.append(idempotency_row(record["idempotency_key"], response["TRD_ID"], response))
+
+    if idempotency_rows:
+        # キーは在庫の確保時に登録済み（それ以前のジャーナルのレコードだけ、ここで登録する）
+        stored = dict(db.execute(
+            select(models.PurchaseIdempotency.IDEMPOTENCY_KEY, models.PurchaseIdempotency.TRD_ID)
+            .where(models.PurchaseIdempotency.IDEMPOTENCY_KEY.in_([row["IDEMPOTENCY_KEY"] for row in idempotency_rows]))
+        ).all())
+        for row in idempotency_rows:
+            if stored.get(row["IDEMPOTENCY_KEY"], row["TRD_ID"]) != row["TRD_ID"]:
+                logger.warning("⚠️ Duplicate idempotency key in journal: %s (TRD_ID=%s)", row["IDEMPOTENCY_KEY"], row["TRD_ID"])
+        idempotency_rows = [row for row in idempotency_rows if row["IDEMPOTENCY_KEY"] not in stored]
+
+    connection = db.connection()
+    connection.execute(insert(models.Transaction.__table__), headers)
+    connection.execute(insert(models.TransactionDetail.__table__), details)
+    if idempotency_rows:
+        connection.execute(insert(models.PurchaseIdempotency.__table__), idempotency_rows)
+    record_sales(connection, [models.Transaction(**header) for header in headers], details)
+    db.commit()
+    return len(records)
+
+
+def read_segment(path: str) -> List[dict]:
+    """ジャーナルファイルを読む（書き込み途中で終わった最後の行は捨てる）"""
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning("⚠️ Skipping truncated journal line in %s", path)
+    return records
+
+
+def orphaned_sales(db: Session, older_than: float = PURCHASE_JOURNAL_ORPHAN_AGE) -> List[dict]:
+    """冪等性キーだけが登録され、取引が書き込まれていない購入（確保のコミット後、fsync前に落ちたもの）
+
+    動作中のプロセスのジャーナルに残っている購入と区別するため、older_than 秒より前のキーだけを返す。
+    """
+    K, T = models.PurchaseIdempotency, models.Transaction
+    rows = db.execute(
+        select(K.IDEMPOTENCY_KEY, K.RESPONSE)
+        .outerjoin(T, T.TRD_ID == K.TRD_ID)
+        .where(T.TRD_ID.is_(None), K.CREATED_AT < datetime.now() - timedelta(seconds=older_than))
+    ).all()
+    db.rollback()
+    return [{"idempotency_key": key, "response": json.loads(response)} for key, response in rows]
+
+
+def recover(session_factory, journal: PurchaseJournal, batch_size: int = PURCHASE_JOURNAL_BATCH_SIZE) -> int:
+    """終了したプロセスが残したジャーナルと、キーだけが残った購入をDBへ書き込む（ジャーナルのファイルは削除する）"""
+    recovered = 0
+    if os.path.isdir(journal.directory):
+        recovered += _replay_segments(session_factory, journal, batch_size)
+    with session_factory() as db:
+        orphans = orphaned_sales(db)
+    for start in range(0, len(orphans), batch_size):
+        with session_factory() as db:
+            written = write_sales(db, orphans[start:start + batch_size])
+        recovered += written
+        logger.warning("♻️ Purchases restored from idempotency keys: %s", written)
+    return recovered
+
+
+def _replay_segments(session_factory, journal: PurchaseJournal, batch_size: int) -> int:
+    own = set(journal.own_paths())
+    recovered = 0
+    for name in sorted(os.listdir(journal.directory)):
+        path = os.path.join(journal.directory, name)
+        if not name.endswith(".jsonl") or path in own:
+            continue
+        with open(path, "rb") as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue  # 動作中のプロセスのファイル
+            records = read_segment(path)
+            for start in range(0, len(records), batch_size):
+                with session_factory() as db:
+                    recovered += write_sales(db, records[start:start + batch_size])
+            os.unlink(path)
+        logger.info("♻️ Journal replayed: %s (%s records)", path, len(records))
+    return recovered
+
+
+def _write_or_reject(session_factory, records: List[dict], rejected_path: str):
+    """1件ずつ書き込み、制約違反になったレコードは rejected.jsonl へ退避する（後続の書き込みを止めない）"""
+    for record in records:
+        try:
+            with session_factory() as db:
+                write_sales(db, [record])
+        except IntegrityError as e:
+            logger.error("❌ Journaled purchase rejected by DB (TRD_ID=%s): %s", record["response"]["TRD_ID"], e)
+            with open(rejected_path, "ab") as f:
+                f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def drain(session_factory, journal: PurchaseJournal, batch_size: int = PURCHASE_JOURNAL_BATCH_SIZE) -> int:
+    """未書き込みのレコードを batch_size 件ずつグループコミットする"""
+    written = 0
+    while True:
+        records = journal.peek(batch_size)
+        if not records:
+            return written
+        try:
+            with session_factory() as db:
+                write_sales(db, records)
+        except IntegrityError:
+            _write_or_reject(session_factory, records, os.path.join(journal.directory, "rejected.jsonl"))
+        journal.mark_written(len(records))
+        written += len(records)
+
+
+async def write_behind_periodically(session_factory, journal: PurchaseJournal):
+    """起動時に残っているジャーナルを再生し、以降は PURCHASE_JOURNAL_WRITE_INTERVAL 秒ごとにDBへ書き込む"""
+    recovered = False
+    while True:
+        try:
+            if not recovered:
+                count = await run_in_threadpool(recover, session_factory, journal)
+                recovered = True
+                if count:
+                    logger.info("♻️ Recovered %s journaled purchases", count)
+            await run_in_threadpool(drain, session_factory, journal)
+        except Exception as e:
+            logger.warning("⚠️ Journal write-behind failed (will retry): %s", e)
+        await asyncio.sleep(PURCHASE_JOURNAL_WRITE_INTERVAL)
+
+
+purchase_journal = PurchaseJournal(PURCHASE_JOURNAL_DIR, PURCHASE_JOURNAL_FSYNC_INTERVAL, PURCHASE_JOURNAL_SEGMENT_RECORDS)
+trd_ids = TrdIdAllocator(TRD_ID_BLOCK_SIZE)
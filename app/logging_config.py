@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# ログ設定（環境変数で切り替え）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# リクエスト処理中のログ（app.main等）のレベル。WARNINGにするとINFOログが出なくなる
+LOG_HOT_PATH_LEVEL = os.getenv("LOG_HOT_PATH_LEVEL", LOG_LEVEL).upper()
+# text: 従来形式 / json: 1行1JSONの構造化ログ
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# ルート毎のINFO以下ログのサンプリング率（例: "/products=0.01,/purchase=1"）
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+HOT_PATH_LOGGERS = ("app.main", "app.database", "app.async_routes")
+# uvicorn/gunicornのワーカーが独自のStreamHandler（propagate=False）を付けるロガー
+SERVER_LOGGERS = ("uvicorn", "uvicorn.access", "uvicorn.error")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 現在のリクエストのログを出力するかどうか（Noneはリクエスト外）
+log_sampled: contextvars.ContextVar[Optional[bool]] = contextvars.ContextVar("log_sampled", default=None)
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_text:
+            payload["exc_info"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """サンプリング対象外のリクエストではWARNING未満のログを捨てる"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        return log_sampled.get() is not False
+
+
+class _MessageQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 文字列化はリスナースレッドに任せ、引数の評価だけ済ませておく
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_text = None if not record.exc_info else logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    rates: Dict[str, float] = {}
+    for entry in value.split(","):
+        if "=" not in entry:
+            continue
+        prefix, rate = entry.split("=", 1)
+        rates[prefix.strip()] = float(rate)
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+def sample_rate_for(path: str) -> float:
+    """最長一致するプレフィックスのサンプリング率を返す"""
+    best_prefix = ""
+    rate = 1.0
+    for prefix, prefix_rate in SAMPLE_RATES.items():
+        if path.startswith(prefix) and len(prefix) > len(best_prefix):
+            best_prefix = prefix
+            rate = prefix_rate
+    return rate
+
+
+class LogSamplingMiddleware:
+    """リクエスト開始時にログのサンプリング可否を決定するASGIミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not SAMPLE_RATES:
+            await self.app(scope, receive, send)
+            return
+        rate = sample_rate_for(scope["path"])
+        token = log_sampled.set(rate >= 1.0 or random.random() < rate)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            log_sampled.reset(token)
+
+
+def route_server_loggers():
+    """uvicornのアクセスログ・エラーログのハンドラを外し、ルートのキュー経由で出力させる
+
+    uvicornのLOGGING_CONFIGやUvicornWorkerはこれらのロガーに直接StreamHandlerを付けるため、
+    そのままでは1リクエスト毎のアクセスログがイベントループ上で同期的に書き込まれる。
+    """
+    for name in SERVER_LOGGERS:
+        server_logger = logging.getLogger(name)
+        for handler in list(server_logger.handlers):
+            server_logger.removeHandler(handler)
+        server_logger.propagate = True
+
+
+def setup_logging():
+    """QueueHandler/QueueListenerによる非同期ログ出力を設定する（出力先はstdoutのみ）"""
+    global _listener
+    # uvicornはアプリのimport前にログ設定を適用するため、設定済みでも付け直されたハンドラを外す
+    route_server_loggers()
+    if _listener is not None:
+        return
+
+    sink = logging.StreamHandler(sys.stdout)
+    sink.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = _MessageQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    for name in HOT_PATH_LOGGERS:
+        logging.getLogger(name).setLevel(LOG_HOT_PATH_LEVEL)
+
+    _listener = QueueListener(log_queue, sink, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def restart_after_fork():
+    """fork後の子プロセスでQueueListenerのスレッドを起動し直す（スレッドはforkで引き継がれない）"""
+    global _listener
+    if _listener is None:
+        return
+    # UvicornWorkerはfork前（マスター）でgunicornのハンドラをuvicornのロガーに付ける
+    route_server_loggers()
+    _listener = QueueListener(_listener.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
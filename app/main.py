@@ -1,24 +1,68 @@
 import logging
 import sys
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import text, insert, delete, bindparam, select
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional
+from datetime import date, datetime
 import os
+import asyncio
+import json
+from starlette.concurrency import run_in_threadpool
 
+from .startup import (
+    startup_state,
+    warmup_until_ready,
+    DB_LAZY_INIT,
+    WARMUP_TIMEOUT,
+)
 from . import models, schemas
-from .database import get_db
-
-# Azure App Service用のログ設定
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.StreamHandler(sys.stderr)
-    ]
+from .database import get_db, SessionLocal, DB_ASYNC
+from .replicas import get_read_db, read_router, ReadYourWritesMiddleware, READ_YOUR_WRITES_HEADER
+from .pool_metrics import pool_status, prometheus_lines
+from .metrics import (
+    MetricsMiddleware,
+    render_prometheus,
+    flush_periodically as flush_metrics_periodically,
+    METRICS_DIR,
+)
+from .logging_config import setup_logging, LogSamplingMiddleware
+from .catalog import (
+    PRODUCT_FIELDS,
+    PRODUCTS_STREAM_BATCH_SIZE,
+    ProductListParams,
+    build_products_query,
+    watch_catalog_changes,
+    prune_changes_periodically,
+    CATALOG_WATCH_INTERVAL,
+    CATALOG_CHANGES_PRUNE_INTERVAL,
+    next_after_id,
+    ndjson_lines,
+    catalog_version,
+    catalog_etag,
+    products_etag,
+    catalog_body,
+    changed_since,
+    oldest_change_id,
+    record_catalog_changes,
 )
+from .tax import tax_table
+from .inventory import STOCK_SLOT_COUNT, load_products, reserve_stock, restore_stock, compact_periodically as compact_stock_periodically
+from .journal import PURCHASE_JOURNAL_ENABLED, purchase_journal, trd_ids, write_behind_periodically, drain as drain_journal
+from .reporting import (
+    defer_sales, daily_sales, top_products, REPORT_MAX_DAYS,
+    REPORT_ROLLUPS_ENABLED, REPORT_ROLLUP_FLUSH_INTERVAL, flush_rollups_periodically, flush_pending as flush_pending_rollups
+)
+from .responses import FastJSONResponse, fast_response, CompressionMiddleware
+from .profiling import profiler, ProfilingMiddleware, require_profiling_token
+from .idempotency import idempotency_cache, lookup_response, idempotency_row, sweep_periodically
+from .cache import product_cache, missing_product_cache, product_lookups, receipt_cache, PRODUCT_CACHE_ENABLED
+
+# Azure App Service用のログ設定（キュー経由でstdoutへ出力）
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
@@ -35,38 +79,112 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    # 書き込み後の読み取りをプライマリへ向けるため、フロントエンドが読んで送り返す
+    expose_headers=[READ_YOUR_WRITES_HEADER],
 )
 
 logger.info("✅ CORS middleware configured for frontend domain")
 
+# レスポンス圧縮（gzip/brotli）と商品の読み取りのCache-Control（計測より内側: 計測は圧縮後のサイズ）
+app.add_middleware(CompressionMiddleware)
+# サンプリングプロファイラ（有効時・X-Profileヘッダ付きのリクエストのみ。計測より内側でSQL時間を参照する）
+app.add_middleware(ProfilingMiddleware)
+# ルート毎のレイテンシ・DB時間の計測（/metrics で出力）
+app.add_middleware(MetricsMiddleware)
+# ルート毎のログサンプリング（LOG_SAMPLE_RATES）
+app.add_middleware(LogSamplingMiddleware)
+# 書き込んだクライアントの読み取りを一定期間プライマリへ（読み取りレプリカ使用時）
+app.add_middleware(ReadYourWritesMiddleware)
+
 # 設定値
-TAX_RATE = 0.10  # 10%
 DEFAULT_STORE_CD = "30"         # デフォルト店舗コード（仕様に合わせて修正）
 DEFAULT_POS_NO = "90"           # デフォルトPOS番号（仕様に合わせて修正）
 DEFAULT_TAX_CD = "10"           # デフォルト税区分（10%）
 DEFAULT_EMP_CD = "9999999999"   # デフォルト従業員コード
+# 一括登録で1トランザクションにまとめる売上件数
+PURCHASE_BATCH_CHUNK_SIZE = int(os.getenv("PURCHASE_BATCH_CHUNK_SIZE", "500"))
 
 @app.on_event("startup")
 async def startup_event():
     logger.info("🚀 POS API is starting up...")
     logger.info("📋 Application configuration:")
-    logger.info(f"  TAX_RATE: {TAX_RATE}")
-    logger.info(f"  DEFAULT_STORE_CD: {DEFAULT_STORE_CD} (fixed per specification)")
-    logger.info(f"  DEFAULT_POS_NO: {DEFAULT_POS_NO} (fixed per specification)")
-    logger.info(f"  DEFAULT_EMP_CD: {DEFAULT_EMP_CD}")
+    logger.info("  DEFAULT_TAX_CD: %s", DEFAULT_TAX_CD)
+    logger.info("  DEFAULT_STORE_CD: %s (fixed per specification)", DEFAULT_STORE_CD)
+    logger.info("  DEFAULT_POS_NO: %s (fixed per specification)", DEFAULT_POS_NO)
+    logger.info("  DEFAULT_EMP_CD: %s", DEFAULT_EMP_CD)
     
-    # データベース接続テスト
+    import app.database as db_module
+    startup_state.mark("startup")
+    await db_module.create_async_fallback_schema()
+
+    # DBへの接続確認はここでは行わず、ウォームアップ（接続・キャッシュの事前読み込み）を並行実行する
+    warmup_task = asyncio.create_task(warmup_until_ready(
+        SessionLocal, db_module.engine, db_module.async_engine, prime_product_cache, tax_table.refresh
+    ))
+    # 期限切れの冪等性キーを定期削除
+    sweep_task = asyncio.create_task(sweep_periodically(SessionLocal))
+    app.state.background_tasks = [warmup_task, sweep_task]
+    # 他のワーカー・インスタンスでの在庫変更を商品キャッシュへ反映
+    if PRODUCT_CACHE_ENABLED and CATALOG_WATCH_INTERVAL > 0:
+        app.state.background_tasks.append(asyncio.create_task(watch_catalog_changes(SessionLocal, product_cache, missing_product_cache)))
+    # コミット済みの購入の売上集計をまとめて書き込む
+    if REPORT_ROLLUPS_ENABLED and REPORT_ROLLUP_FLUSH_INTERVAL > 0:
+        app.state.background_tasks.append(asyncio.create_task(flush_rollups_periodically(SessionLocal)))
+    # 保持期間を過ぎたカタログ変更履歴を定期削除
+    if CATALOG_CHANGES_PRUNE_INTERVAL > 0:
+        app.state.background_tasks.append(asyncio.create_task(prune_changes_periodically(SessionLocal)))
+    # 売れ筋商品の在庫スロットを再配分
+    if STOCK_SLOT_COUNT > 0:
+        app.state.background_tasks.append(asyncio.create_task(compact_stock_periodically(SessionLocal)))
+    # ジャーナルに追記された購入をDBへまとめて書き込む（残っているジャーナルの再生を含む）
+    if PURCHASE_JOURNAL_ENABLED:
+        purchase_journal.open()
+        app.state.background_tasks.append(asyncio.create_task(write_behind_periodically(SessionLocal, purchase_journal)))
+    # マルチワーカー時は計測値を共有ディレクトリへ書き出す
+    if METRICS_DIR:
+        app.state.background_tasks.append(asyncio.create_task(flush_metrics_periodically()))
+
+    if not DB_LAZY_INIT:
+        await asyncio.wait({warmup_task}, timeout=WARMUP_TIMEOUT)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # ジャーナルの未書き込み分をDBへ書き込んでから閉じる（失敗しても次回起動時に再生される）
+    if PURCHASE_JOURNAL_ENABLED and purchase_journal.is_open:
+        try:
+            await run_in_threadpool(drain_journal, SessionLocal, purchase_journal)
+        except Exception as e:
+            logger.warning("⚠️ Journal drain on shutdown failed: %s", e)
+        purchase_journal.close()
+    # 後回しにした売上集計の加算を書き込む
     try:
-        logger.info("🔍 Testing database connection...")
-        # より安全なインポート
-        import app.database as db_module
-        with db_module.engine.connect() as conn:
-            result = conn.execute(text("SELECT 1 as test")).fetchone()
-            logger.info("✅ Database connection successful")
-    except ImportError as e:
-        logger.error(f"❌ Database module import failed: {e}")
+        await run_in_threadpool(flush_pending_rollups, SessionLocal)
     except Exception as e:
-        logger.error(f"❌ Database connection failed: {e}")
+        logger.warning("⚠️ Rollup flush on shutdown failed: %s", e)
+
+def prime_product_cache(db: Session, limit: int):
+    """商品キャッシュを先頭からlimit件読み込んでおく"""
+    if not PRODUCT_CACHE_ENABLED:
+        return
+    for row in db.execute(build_products_query(limit=limit)).mappings():
+        product_cache.set(row["CODE"], schemas.Product.model_validate(dict(row)).model_dump())
+
+@app.get("/health/live")
+def liveness():
+    """ライブネス: プロセスが応答できるか（DBには触れない）"""
+    return {"status": "alive"}
+
+@app.get("/ping")
+def ping():
+    """ライブネスの別名（互換用）"""
+    return liveness()
+
+@app.get("/health/ready")
+def readiness(response: Response):
+    """レディネス: ウォームアップが完了し、トラフィックを受けられるか"""
+    if not startup_state.ready:
+        response.status_code = 503
+    return {"status": "ready" if startup_state.ready else "warming_up", **startup_state.snapshot()}
 
 @app.get("/")
 def root():
@@ -80,237 +198,762 @@ def root():
             "product": "/product/{code}",
             "products_search": "/products/{code}",
             "purchase": "/purchase",
-            "transactions": "/transactions/{id}"
+            "transactions": "/transactions/{id}",
+            "catalog_sync": "/catalog/sync",
+            "purchases_batch": "/purchases/batch",
+            "daily_sales": "/reports/daily-sales",
+            "top_products": "/reports/top-products",
+            "liveness": "/health/live",
+            "readiness": "/health/ready"
         }
     }
 
+def stream_products(stmt, bind):
+    """サーバーサイドカーソルから読み出した行をNDJSONで逐次出力する"""
+    # 依存関係のセッションはレスポンス送信前に閉じられるため、同じ接続先の専用セッションを使う
+    with SessionLocal(bind=bind) as session:
+        result = session.execute(
+            stmt.execution_options(stream_results=True, yield_per=PRODUCTS_STREAM_BATCH_SIZE)
+        )
+        yield from ndjson_lines(result.mappings())
+
 @app.get("/products", response_model=List[schemas.Product])
-def get_all_products(db: Session = Depends(get_db)):
+def get_all_products(
+    response: Response,
+    params: ProductListParams = Depends(),
+    db: Session = Depends(get_read_db),
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    try:
+        logger.info("📦 Fetching products (after_id=%s, limit=%s)", params.after_id, params.limit)
+        stmt = params.query()
+
+        if params.format == "ndjson":
+            return StreamingResponse(stream_products(stmt, db.get_bind()), media_type="application/x-ndjson")
+
+        if params.full_catalog:
+            # 全件はカタログのバージョンが変わるまで圧縮済みのボディを使い回す
+            version = catalog_version(db)
+            etag = products_etag(version)
+            if if_none_match == etag:
+                return Response(status_code=304, headers={"ETag": etag})
+            return catalog_body.response(
+                version, lambda: [dict(row) for row in db.execute(stmt).mappings()], accept_encoding, {"ETag": etag}
+            )
+
+        products = [dict(row) for row in db.execute(stmt).mappings()]
+        logger.info("✅ Found %s products", len(products))
+
+        next_id = next_after_id(products, params.limit)
+        headers = {"X-Next-After-Id": str(next_id)} if next_id is not None else {}
+
+        if params.columns != PRODUCT_FIELDS:
+            # 射影時はresponse_modelの検証を通さずに返す
+            return FastJSONResponse(products, headers=headers)
+        response.headers.update(headers)
+        return fast_response(products, headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("❌ Error fetching products: %s", e)
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+@app.get("/catalog/sync", response_model=schemas.CatalogSyncResponse)
+def sync_catalog(
+    response: Response,
+    since: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db)
+):
+    """カタログ差分同期（ETag一致なら304、sinceトークン指定で差分のみ返す）"""
     try:
-        logger.info("📦 Fetching all products")
-        products = db.query(models.Product).all()
-        logger.info(f"✅ Found {len(products)} products")
-        return products
+        version = catalog_version(db)
+        etag = catalog_etag(version)
+        if if_none_match == etag or since == version:
+            return Response(status_code=304, headers={"ETag": etag})
+        if since is not None and (since > version or since < oldest_change_id(db) - 1):
+            # サーバー側より新しいトークン（DB再作成など）や、削除済みの履歴より古いトークンは全件再同期させる
+            since = None
+
+        if since is None:
+            products = [dict(row) for row in db.execute(build_products_query()).mappings()]
+            deleted = []
+        else:
+            products, deleted = changed_since(db, since, version)
+
+        logger.info("🔄 Catalog sync: since=%s, token=%s, products=%s, deleted=%s", since, version, len(products), len(deleted))
+        response.headers["ETag"] = etag
+        return fast_response(
+            {"token": version, "full": since is None, "products": products, "deleted": deleted},
+            {"ETag": etag}
+        )
     except Exception as e:
-        logger.error(f"❌ Error fetching products: {e}")
+        logger.error("❌ Error syncing catalog: %s", e)
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+def cached_product(code: str) -> Optional[dict]:
+    """キャッシュ済みの商品（存在しないことがキャッシュされていれば404）"""
+    if not PRODUCT_CACHE_ENABLED:
+        return None
+    cached = product_cache.get(code)
+    if cached is None and missing_product_cache.enabled and missing_product_cache.get(code):
+        raise HTTPException(status_code=404, detail="Product not found")
+    return cached
+
+def load_product(code: str, db: Session) -> Optional[dict]:
+    """商品をDBから取得してキャッシュする（存在しない場合はNoneをネガティブキャッシュ）"""
+    product = db.execute(build_products_query().where(models.Product.CODE == code)).mappings().first()
+    if product is None:
+        if PRODUCT_CACHE_ENABLED and missing_product_cache.enabled:
+            missing_product_cache.set(code, True)
+        return None
+    result = schemas.Product.model_validate(dict(product)).model_dump()
+    if PRODUCT_CACHE_ENABLED:
+        product_cache.set(code, result)
+    return result
+
+def product_response(code: str, result: Optional[dict]):
+    if result is None:
+        logger.warning("⚠️ Product not found: %s", code)
+        raise HTTPException(status_code=404, detail="Product not found")
+    logger.info("✅ Found product: %s", result["NAME"])
+    return fast_response(result)
+
 @app.get("/products/{code}", response_model=schemas.Product)
-def get_product(code: str, db: Session = Depends(get_db)):
+def get_product(code: str, db: Session = Depends(get_read_db)):
     try:
-        logger.info(f"🔍 Searching for product with code: {code}")
-        product = db.query(models.Product).filter(models.Product.CODE == code).first()
-        if product is None:
-            logger.warning(f"⚠️ Product not found: {code}")
-            raise HTTPException(status_code=404, detail="Product not found")
-        logger.info(f"✅ Found product: {product.NAME}")
-        return product
+        logger.info("🔍 Searching for product with code: %s", code)
+        cached = cached_product(code)
+        if cached is not None:
+            return fast_response(cached)
+        # 同じコードの検索が実行中なら、そのクエリの結果を待って使う
+        return product_response(code, product_lookups.do(code, lambda: load_product(code, db)))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Error fetching product {code}: {e}")
+        logger.error("❌ Error fetching product %s: %s", code, e)
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 @app.get("/product/{code}", response_model=schemas.Product)
-def get_product_singular(code: str, db: Session = Depends(get_db)):
+def get_product_singular(code: str, db: Session = Depends(get_read_db)):
     """フロントエンド互換性のための単数形エンドポイント"""
     return get_product(code, db)
 
+def build_receipt(transaction_id: int, lines: list, basket) -> dict:
+    """明細 (商品名, 単価, 数量) と税計算結果からレシートのdictを組み立てる"""
+    return {
+        "transaction_id": transaction_id,
+        "items": [
+            {
+                "name": name,
+                "unit_price": unit_price,
+                "quantity": quantity,
+                "tax_rate": float(line.tax_rate),
+                "tax_amount": line.tax_amount,
+                "price_incl_tax": line.price_incl_tax
+            }
+            for (name, unit_price, quantity), line in zip(lines, basket.lines)
+        ],
+        "total_excl_tax": basket.total_excl_tax,
+        "total_tax": basket.total_tax,
+        "total_incl_tax": basket.total_incl_tax
+    }
+
 @app.get("/transactions/{transaction_id}", response_model=schemas.TransactionDetailWithTotals)
-def get_transaction_details(transaction_id: int, db: Session = Depends(get_db)):
+def get_transaction_details(transaction_id: int, db: Session = Depends(get_read_db)):
     try:
-        logger.info(f"🔍 Fetching transaction details for ID: {transaction_id}")
-        
-        # トランザクション存在チェック
-        transaction = db.query(models.Transaction).filter(models.Transaction.TRD_ID == transaction_id).first()
+        logger.info("🔍 Fetching transaction details for ID: %s", transaction_id)
+
+        # 確定済み取引は変わらないため、キャッシュがあればDBを参照しない
+        if receipt_cache.enabled:
+            cached = receipt_cache.get(transaction_id)
+            if cached is not None:
+                return fast_response(cached)
+
+        # ヘッダと明細を1クエリ（JOIN）で取得
+        transaction = db.execute(
+            select(models.Transaction)
+            .options(joinedload(models.Transaction.details))
+            .where(models.Transaction.TRD_ID == transaction_id)
+        ).unique().scalar_one_or_none()
         if not transaction:
-            logger.warning(f"⚠️ Transaction not found: {transaction_id}")
+            logger.warning("⚠️ Transaction not found: %s", transaction_id)
             raise HTTPException(status_code=404, detail="Transaction not found")
-        
-        # 明細データを税率マスタと結合して取得
-        details_with_tax = db.query(
-            models.TransactionDetail,
-            models.TaxMaster.TAX_RATE
-        ).join(
-            models.TaxMaster, 
-            models.TransactionDetail.TAX_CD == models.TaxMaster.TAX_CD
-        ).filter(
-            models.TransactionDetail.TRD_ID == transaction_id
-        ).all()
-        
+
         # 明細データが存在するかチェック
-        if not details_with_tax:
-            logger.warning(f"⚠️ Transaction details not found: {transaction_id}")
+        details = sorted(transaction.details, key=lambda detail: detail.DTL_ID)
+        if not details:
+            logger.warning("⚠️ Transaction details not found: %s", transaction_id)
             raise HTTPException(status_code=404, detail="Transaction details not found")
-        
-        items = []
-        total_excl_tax = 0
-        total_tax = 0
-        
-        for detail, tax_rate in details_with_tax:
-            # 各商品の計算
-            unit_price = detail.PRD_PRICE
-            quantity = detail.QTY
-            subtotal_excl_tax = unit_price * quantity
-            
-            # 税額計算（小数点以下切り捨て）
-            tax_amount = int(subtotal_excl_tax * (float(tax_rate) / 100))
-            price_incl_tax = subtotal_excl_tax + tax_amount
-            
-            items.append(schemas.TransactionItemDetail(
-                name=detail.PRD_NAME,
-                unit_price=unit_price,
-                quantity=quantity,
-                tax_rate=float(tax_rate),
-                tax_amount=tax_amount,
-                price_incl_tax=price_incl_tax
-            ))
-            
-            total_excl_tax += subtotal_excl_tax
-            total_tax += tax_amount
-        
-        total_incl_tax = total_excl_tax + total_tax
-        
-        logger.info(f"✅ Transaction details fetched: {len(items)} items, total: {total_incl_tax}")
-        
-        return schemas.TransactionDetailWithTotals(
-            transaction_id=transaction_id,
-            items=items,
-            total_excl_tax=total_excl_tax,
-            total_tax=total_tax,
-            total_incl_tax=total_incl_tax
+
+        # 税率はメモリ上の税率テーブルを使用
+        basket = tax_table.compute(
+            ((detail.PRD_PRICE, detail.QTY, detail.TAX_CD) for detail in details), db
         )
+        receipt = build_receipt(
+            transaction_id,
+            [(detail.PRD_NAME, detail.PRD_PRICE, detail.QTY) for detail in details],
+            basket
+        )
+
+        logger.info("✅ Transaction details fetched: %s items, total: %s", len(details), receipt["total_incl_tax"])
+
+        if receipt_cache.enabled:
+            receipt_cache.set(transaction_id, receipt)
+        return fast_response(receipt)
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Error fetching transaction details {transaction_id}: {e}")
+        logger.error("❌ Error fetching transaction details %s: %s", transaction_id, e)
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+def decrement_stock(db: Session, qty_by_prd_id: dict):
+    """在庫を条件付きUPDATE（WHERE STOCK >= qty）でまとめて減らす
+
+    いずれかの商品で在庫が不足していた場合は400を送出する。
+    """
+    if not qty_by_prd_id:
+        return
+    if STOCK_SLOT_COUNT > 0:
+        # 売れ筋商品はスロット単位で減らす（商品行のロック待ちを避ける）
+        short = reserve_stock(db.connection(), qty_by_prd_id)
+        if short:
+            logger.warning("⚠️ Stock reservation failed for products: %s", short)
+            raise HTTPException(status_code=400, detail="Insufficient stock")
+        return
+    product_table = models.Product.__table__
+    stmt = (
+        product_table.update()
+        .where(product_table.c.PRD_ID == bindparam("b_prd_id"))
+        .where(product_table.c.STOCK >= bindparam("b_qty"))
+        .values(STOCK=product_table.c.STOCK - bindparam("b_qty"))
+    )
+    result = db.connection().execute(
+        stmt,
+        [{"b_prd_id": prd_id, "b_qty": qty} for prd_id, qty in qty_by_prd_id.items()]
+    )
+    if result.rowcount != len(qty_by_prd_id):
+        logger.warning("⚠️ Conditional stock update matched %s/%s rows", result.rowcount, len(qty_by_prd_id))
+        raise HTTPException(status_code=400, detail="Insufficient stock")
+
+TRANSACTION_DETAIL_FIELDS = tuple(schemas.TransactionDetailResponse.model_fields)
+
+def transaction_response(header: models.Transaction, details: List[dict]) -> dict:
+    """TransactionResponseと同じ形のJSON互換dictを組み立てる（モデルの生成・検証を省略）"""
+    return {
+        "TRD_ID": header.TRD_ID,
+        "DATETIME": header.DATETIME.isoformat(),
+        "EMP_CD": header.EMP_CD,
+        "STORE_CD": header.STORE_CD,
+        "POS_NO": header.POS_NO,
+        "TOTAL_AMT": header.TOTAL_AMT,
+        "TTL_AMT_EX_TAX": header.TTL_AMT_EX_TAX,
+        "details": [{field: detail[field] for field in TRANSACTION_DETAIL_FIELDS} for detail in details]
+    }
+
+def resolve_emp_cd(emp_cd: Optional[str]) -> str:
+    """emp_cdの処理を強化（空文字、None、空白文字列をすべてデフォルト値に設定）"""
+    if not emp_cd or emp_cd.strip() == "":
+        logger.info("⚙️ Empty emp_cd detected, using default: %s", DEFAULT_EMP_CD)
+        return DEFAULT_EMP_CD
+    return emp_cd
+
+def transaction_detail_rows(trd_id: Optional[int], purchase_items: list) -> List[dict]:
+    """購入アイテムから transaction_details の行を作る（DTL_IDは1始まりの連番）"""
+    return [
+        {
+            "TRD_ID": trd_id,
+            "DTL_ID": idx + 1,  # 連番
+            "PRD_ID": item_data["product"].PRD_ID,
+            "PRD_CODE": item_data["product"].CODE,
+            "PRD_NAME": item_data["product"].NAME,
+            "PRD_PRICE": item_data["product"].PRICE,
+            "QTY": item_data["qty"],
+            "TAX_CD": DEFAULT_TAX_CD
+        }
+        for idx, item_data in enumerate(purchase_items)
+    ]
+
+def journal_purchase(db: Session, header: models.Transaction, purchase_items: list, qty_by_prd_id: dict, basket, idempotency_key: Optional[str]):
+    """在庫の確保と冪等性キーだけをコミットし、取引はジャーナルへ追記する（DBへの書き込みはバックグラウンドのライター）
+
+    戻り値: (レスポンスのdict, ジャーナルの連番)。呼び出し側は連番のfsync完了を待ってから応答する。
+    同じキーの購入が他のプロセスで先にコミットされていた場合は、保存済みのレスポンスと None を返す。
+    """
+    # 商品の値は採番（ブロック確保時はコミットされる）の前に取り出しておく
+    transaction_details = transaction_detail_rows(None, purchase_items)
+    codes = {item_data["product"].PRD_ID: item_data["product"].CODE for item_data in purchase_items}
+    header.TRD_ID = trd_ids.next_id(db)
+    for detail in transaction_details:
+        detail["TRD_ID"] = header.TRD_ID
+    response = transaction_response(header, transaction_details)
+    decrement_stock(db, qty_by_prd_id)
+    record_catalog_changes(db.connection(), [
+        {"PRD_ID": prd_id, "CODE": code, "OP": "U"} for prd_id, code in codes.items()
+    ])
+    # 冪等性キーを確保と同じトランザクションで登録する（全プロセスで同じキーを二重に処理しない）
+    try:
+        if idempotency_key:
+            db.execute(insert(models.PurchaseIdempotency), [
+                idempotency_row(idempotency_key, header.TRD_ID, response)
+            ])
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        stored = lookup_response(db, idempotency_key) if idempotency_key else None
+        if stored is None:
+            raise
+        logger.info("🔁 Concurrent retry resolved by idempotency key: %s", idempotency_key)
+        return stored, None
+    try:
+        seq = purchase_journal.append({"idempotency_key": idempotency_key, "response": response})
+    except Exception:
+        # ジャーナルに書けなかった売上の在庫は戻し、キーも消して再送を受け付ける
+        restore_stock(db.connection(), qty_by_prd_id)
+        if idempotency_key:
+            db.execute(delete(models.PurchaseIdempotency).where(models.PurchaseIdempotency.IDEMPOTENCY_KEY == idempotency_key))
+        db.commit()
+        raise
+    logger.info("📒 Purchase journaled: TRD_ID=%s", header.TRD_ID)
+
+    if idempotency_key:
+        idempotency_cache.set(idempotency_key, response)
+    product_cache.invalidate(*{detail["PRD_CODE"] for detail in transaction_details})
+    if receipt_cache.enabled:
+        receipt_cache.set(header.TRD_ID, build_receipt(
+            header.TRD_ID, [(detail["PRD_NAME"], detail["PRD_PRICE"], detail["QTY"]) for detail in transaction_details], basket
+        ))
+    return response, seq
+
 @app.post("/purchase", response_model=schemas.TransactionResponse)
-def create_purchase(purchase_data: schemas.PurchaseRequest, db: Session = Depends(get_db)):
+def create_purchase(
+    purchase_data: schemas.PurchaseRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=64),
+    db: Session = Depends(get_db)
+):
+    result, journal_seq = process_purchase(purchase_data, idempotency_key, db)
+    if journal_seq is not None:
+        # ジャーナルのfsync完了（売上の永続化）を待ってから応答する
+        purchase_journal.wait_durable(journal_seq)
+    return result
+
+def process_purchase(purchase_data: schemas.PurchaseRequest, idempotency_key: Optional[str], db: Session):
+    """購入登録の本体。戻り値: (レスポンス, ジャーナルの連番（ジャーナル無効時・再送時はNone）)"""
     try:
-        logger.info(f"💳 Processing purchase for emp_cd: {purchase_data.emp_cd}")
-        logger.info(f"📦 Items: {len(purchase_data.items)}")
+        logger.info("💳 Processing purchase for emp_cd: %s", purchase_data.emp_cd)
+        logger.info("📦 Items: %s", len(purchase_data.items))
+
+        # 再送（同じIdempotency-Key）の場合は保存済みのレスポンスを返し、在庫には触れない
+        if idempotency_key:
+            stored = lookup_response(db, idempotency_key)
+            if stored is not None:
+                logger.info("🔁 Returning stored response for idempotency key: %s", idempotency_key)
+                return fast_response(stored), None
         
-        # emp_cdの処理を強化（空文字、None、空白文字列をすべてデフォルト値に設定）
-        emp_cd = purchase_data.emp_cd
-        if not emp_cd or emp_cd.strip() == "":
-            emp_cd = DEFAULT_EMP_CD
-            logger.info(f"⚙️ Empty emp_cd detected, using default: {DEFAULT_EMP_CD}")
+        emp_cd = resolve_emp_cd(purchase_data.emp_cd)
         
         # STORE_CDとPOS_NOは仕様に従って強制的に固定値を使用
         store_cd = DEFAULT_STORE_CD  # 常に '30' を使用
         pos_no = DEFAULT_POS_NO      # 常に '90' を使用
         
-        logger.info(f"⚙️ Using fixed values: STORE_CD={store_cd}, POS_NO={pos_no}")
+        logger.info("⚙️ Using fixed values: STORE_CD=%s, POS_NO=%s", store_cd, pos_no)
         
-        # 商品情報取得と在庫チェック
+        # 商品情報取得と在庫チェック（全商品を1クエリで取得。スロット分割が無効なら行ロック）
+        products, available = load_products(db, {item.prd_code for item in purchase_data.items})
+
+        # 同一商品が複数行ある場合は合計数量で在庫チェックする
+        requested_qty = {}
+        for item in purchase_data.items:
+            requested_qty[item.prd_code] = requested_qty.get(item.prd_code, 0) + item.qty
+
         purchase_items = []
-        total_amount_ex_tax = 0
-        
+
         for item in purchase_data.items:
             # 数量バリデーション（Pydanticで1以上はチェック済み）
-            
-            # 商品コードで商品を検索
-            product = db.query(models.Product).filter(models.Product.CODE == item.prd_code).first()
+            product = products.get(item.prd_code)
             if not product:
-                logger.warning(f"⚠️ Product not found: {item.prd_code}")
+                logger.warning("⚠️ Product not found: %s", item.prd_code)
                 raise HTTPException(status_code=404, detail=f"Product not found: {item.prd_code}")
-            
+
             # 在庫チェック
-            if product.STOCK < item.qty:
-                logger.warning(f"⚠️ Insufficient stock for {product.NAME}: available={product.STOCK}, requested={item.qty}")
+            if available[item.prd_code] < requested_qty[item.prd_code]:
+                logger.warning("⚠️ Insufficient stock for %s: available=%s, requested=%s", product.NAME, available[item.prd_code], requested_qty[item.prd_code])
                 raise HTTPException(
-                    status_code=400, 
-                    detail=f"Insufficient stock for {product.NAME}. Available: {product.STOCK}, Requested: {item.qty}"
+                    status_code=400,
+                    detail=f"Insufficient stock for {product.NAME}. Available: {available[item.prd_code]}, Requested: {requested_qty[item.prd_code]}"
                 )
-            
+
             # 購入アイテム情報を保存
             purchase_items.append({
                 "product": product,
-                "qty": item.qty,
-                "subtotal": product.PRICE * item.qty
+                "qty": item.qty
             })
-            
-            total_amount_ex_tax += product.PRICE * item.qty
 
-        # 税込金額計算
-        tax_amount = int(total_amount_ex_tax * TAX_RATE)
-        total_amount = total_amount_ex_tax + tax_amount
+        # 税込金額計算（税率ごとに税抜合計へ端数処理）
+        basket = tax_table.compute(
+            ((item_data["product"].PRICE, item_data["qty"], DEFAULT_TAX_CD) for item_data in purchase_items), db
+        )
+        total_amount_ex_tax = basket.total_excl_tax
+        tax_amount = basket.total_tax
+        total_amount = basket.total_incl_tax
 
-        logger.info(f"💰 Calculated totals: excl_tax={total_amount_ex_tax}, tax={tax_amount}, incl_tax={total_amount}")
+        logger.info("💰 Calculated totals: excl_tax=%s, tax=%s, incl_tax=%s", total_amount_ex_tax, tax_amount, total_amount)
 
         # 1. transactionヘッダを作成（必須フィールドを確実に設定）
         db_transaction = models.Transaction(
+            DATETIME=datetime.now().replace(microsecond=0),  # DBのTIMESTAMP精度（秒）に合わせる
             EMP_CD=emp_cd,                    # デフォルト値が設定済み
             STORE_CD=store_cd,                # 仕様通り '30' 固定
             POS_NO=pos_no,                    # 仕様通り '90' 固定
             TOTAL_AMT=total_amount,           # 税込金額
             TTL_AMT_EX_TAX=total_amount_ex_tax  # 税抜金額を確実に保存
         )
+        qty_by_prd_id = {products[code].PRD_ID: qty for code, qty in requested_qty.items()}
+        if PURCHASE_JOURNAL_ENABLED:
+            response, seq = journal_purchase(db, db_transaction, purchase_items, qty_by_prd_id, basket, idempotency_key)
+            return fast_response(response), seq
+
         db.add(db_transaction)
         db.flush()  # TRD_IDを取得
 
-        logger.info(f"✅ Transaction created: TRD_ID={db_transaction.TRD_ID}, STORE_CD={db_transaction.STORE_CD}, POS_NO={db_transaction.POS_NO}")
-
-        # 2. transaction_details明細を作成
-        transaction_details = []
-        for idx, item_data in enumerate(purchase_items):
-            detail = models.TransactionDetail(
-                TRD_ID=db_transaction.TRD_ID,
-                DTL_ID=idx + 1,  # 連番
-                PRD_ID=item_data["product"].PRD_ID,
-                PRD_CODE=item_data["product"].CODE,
-                PRD_NAME=item_data["product"].NAME,
-                PRD_PRICE=item_data["product"].PRICE,
-                QTY=item_data["qty"],
-                TAX_CD=DEFAULT_TAX_CD
-            )
-            db.add(detail)
-            transaction_details.append(detail)
+        logger.info("✅ Transaction created: TRD_ID=%s, STORE_CD=%s, POS_NO=%s", db_transaction.TRD_ID, db_transaction.STORE_CD, db_transaction.POS_NO)
 
-        # 3. 在庫を減らす
-        for item_data in purchase_items:
-            old_stock = item_data["product"].STOCK
-            item_data["product"].STOCK -= item_data["qty"]
-            logger.info(f"📦 Stock updated for {item_data['product'].NAME}: {old_stock} -> {item_data['product'].STOCK}")
+        # 2. transaction_details明細を一括INSERT
+        transaction_details = transaction_detail_rows(db_transaction.TRD_ID, purchase_items)
+        db.execute(insert(models.TransactionDetail), transaction_details)
 
-        # コミット
-        db.commit()
-        db.refresh(db_transaction)
-
-        logger.info(f"✅ Purchase completed successfully: TRD_ID={db_transaction.TRD_ID}")
-
-        # レスポンス作成
-        return schemas.TransactionResponse(
-            TRD_ID=db_transaction.TRD_ID,
-            DATETIME=db_transaction.DATETIME,
-            EMP_CD=db_transaction.EMP_CD,
-            STORE_CD=db_transaction.STORE_CD,
-            POS_NO=db_transaction.POS_NO,
-            TOTAL_AMT=db_transaction.TOTAL_AMT,
-            TTL_AMT_EX_TAX=db_transaction.TTL_AMT_EX_TAX,
-            details=[
-                schemas.TransactionDetailResponse(
-                    DTL_ID=detail.DTL_ID,
-                    PRD_ID=detail.PRD_ID,
-                    PRD_CODE=detail.PRD_CODE,
-                    PRD_NAME=detail.PRD_NAME,
-                    PRD_PRICE=detail.PRD_PRICE,
-                    QTY=detail.QTY,
-                    TAX_CD=detail.TAX_CD
-                ) for detail in transaction_details
-            ]
-        )
+        # 3. 在庫を条件付きUPDATEで減らす（STOCK >= qty の行のみ更新）
+        decrement_stock(db, qty_by_prd_id)
+        record_catalog_changes(db.connection(), [
+            {"PRD_ID": products[code].PRD_ID, "CODE": code, "OP": "U"} for code in requested_qty
+        ])
+        logger.info("📦 Stock updated for %s products", len(requested_qty))
+
+        # 4. 売上集計（日別・レジ別・商品別）への加算はコミット後に回す
+        defer_sales(db, [db_transaction], transaction_details)
+
+        # レスポンス作成（DATETIMEは秒単位で確定済みのため、コミット後の再読込は不要）
+        response = transaction_response(db_transaction, transaction_details)
+
+        # 冪等性キーとレスポンスを同じトランザクションで保存してコミット
+        # （キーの重複はINSERT時点で検出されるため、INSERTもtry内で行う）
+        try:
+            if idempotency_key:
+                db.execute(insert(models.PurchaseIdempotency), [
+                    idempotency_row(idempotency_key, response["TRD_ID"], response)
+                ])
+            db.commit()
+        except IntegrityError:
+            # 同じキーの並行リクエストが先にコミットした場合は、その結果を返す
+            db.rollback()
+            stored = lookup_response(db, idempotency_key) if idempotency_key else None
+            if stored is None:
+                raise
+            logger.info("🔁 Concurrent retry resolved by idempotency key: %s", idempotency_key)
+            return fast_response(stored), None
+
+        if idempotency_key:
+            idempotency_cache.set(idempotency_key, response)
+
+        # 在庫が変わった商品のキャッシュを破棄
+        product_cache.invalidate(*requested_qty.keys())
+
+        # レシートを事前に組み立ててキャッシュ（再印刷・照会時にDBを参照しない）
+        if receipt_cache.enabled:
+            receipt_cache.set(response["TRD_ID"], build_receipt(
+                response["TRD_ID"],
+                # コミット後の商品オブジェクトは失効しているため、明細dictから組み立てる
+                [(detail["PRD_NAME"], detail["PRD_PRICE"], detail["QTY"]) for detail in transaction_details],
+                basket
+            ))
+
+        logger.info("✅ Purchase completed successfully: TRD_ID=%s", response["TRD_ID"])
+        return fast_response(response), None
 
     except HTTPException:
         db.rollback()
         raise
     except Exception as e:
-        logger.error(f"❌ Purchase processing failed: {e}")
+        logger.error("❌ Purchase processing failed: %s", e)
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Purchase processing failed: {str(e)}")
 
+def apply_sales_chunk(db: Session, sales: list):
+    """複数の売上を1トランザクションで登録する（コミットは呼び出し側）
+
+    在庫不足・商品なしの売上はエラーとして扱い、残りの売上は登録する。
+    戻り値: (登録結果 {key: TransactionResponseのdict}, エラー {key: メッセージ}, レシート {TRD_ID: dict})
+    """
+    # ジャーナル有効時はTRD_IDを先に確保する（確保時にコミットするため、商品の取得より前に行う）
+    trd_id_block = trd_ids.take(db, len(sales))[::-1] if PURCHASE_JOURNAL_ENABLED else []
+    # チャンク内の全商品を1クエリで取得（スロット分割が無効なら行ロック）
+    products, stock = load_products(db, {item.prd_code for sale in sales for item in sale.items})
+    available = dict(stock)
+
+    errors = {}
+    accepted = []
+    for sale in sales:
+        requested_qty = {}
+        for item in sale.items:
+            requested_qty[item.prd_code] = requested_qty.get(item.prd_code, 0) + item.qty
+        missing = [code for code in requested_qty if code not in products]
+        if missing:
+            errors[sale.idempotency_key] = f"Product not found: {missing[0]}"
+            continue
+        short = [code for code, qty in requested_qty.items() if available[code] < qty]
+        if short:
+            product = products[short[0]]
+            errors[sale.idempotency_key] = (
+                f"Insufficient stock for {product.NAME}. Available: {available[short[0]]}, Requested: {requested_qty[short[0]]}"
+            )
+            continue
+        for code, qty in requested_qty.items():
+            available[code] -= qty
+        basket = tax_table.compute(
+            ((products[item.prd_code].PRICE, item.qty, DEFAULT_TAX_CD) for item in sale.items), db
+        )
+        header = models.Transaction(
+            DATETIME=datetime.now().replace(microsecond=0),
+            EMP_CD=resolve_emp_cd(sale.emp_cd),
+            STORE_CD=DEFAULT_STORE_CD,
+            POS_NO=DEFAULT_POS_NO,
+            TOTAL_AMT=basket.total_incl_tax,
+            TTL_AMT_EX_TAX=basket.total_excl_tax
+        )
+        if PURCHASE_JOURNAL_ENABLED:
+            # ジャーナルの取引とTRD_IDが重ならないよう、同じブロックから採番する
+            header.TRD_ID = trd_id_block.pop()
+        accepted.append((sale, header, basket))
+
+    created, receipts = {}, {}
+    if not accepted:
+        return created, errors, receipts
+
+    # ヘッダを登録してTRD_IDを採番
+    db.add_all([header for _, header, _ in accepted])
+    db.flush()
+
+    all_details = []
+    idempotency_rows = []
+    for sale, header, basket in accepted:
+        details = [
+            {
+                "TRD_ID": header.TRD_ID,
+                "DTL_ID": idx + 1,
+                "PRD_ID": products[item.prd_code].PRD_ID,
+                "PRD_CODE": item.prd_code,
+                "PRD_NAME": products[item.prd_code].NAME,
+                "PRD_PRICE": products[item.prd_code].PRICE,
+                "QTY": item.qty,
+                "TAX_CD": DEFAULT_TAX_CD
+            }
+            for idx, item in enumerate(sale.items)
+        ]
+        all_details.extend(details)
+        response = transaction_response(header, details)
+        created[sale.idempotency_key] = response
+        idempotency_rows.append(idempotency_row(sale.idempotency_key, header.TRD_ID, response))
+        receipts[header.TRD_ID] = build_receipt(
+            header.TRD_ID,
+            [(detail["PRD_NAME"], detail["PRD_PRICE"], detail["QTY"]) for detail in details],
+            basket
+        )
+
+    # 明細・冪等性キーを一括INSERT、在庫は商品毎に合算して条件付きUPDATE
+    db.execute(insert(models.TransactionDetail), all_details)
+    db.execute(insert(models.PurchaseIdempotency), idempotency_rows)
+    sold = {
+        code: stock[code] - remaining
+        for code, remaining in available.items()
+        if stock[code] != remaining
+    }
+    decrement_stock(db, {products[code].PRD_ID: qty for code, qty in sold.items()})
+    record_catalog_changes(db.connection(), [
+        {"PRD_ID": products[code].PRD_ID, "CODE": code, "OP": "U"} for code in sold
+    ])
+    defer_sales(db, [header for _, header, _ in accepted], all_details)
+    return created, errors, receipts
+
+@app.post("/purchases/batch", response_model=schemas.BatchPurchaseResponse)
+def create_purchases_batch(batch: schemas.BatchPurchaseRequest, db: Session = Depends(get_db)):
+    """オフライン端末に溜まった売上の一括登録（idempotency_keyで重複登録を防止）"""
+    logger.info("📥 Processing purchase batch: %s sales", len(batch.sales))
+
+    # 登録済みのキーを1クエリで確認
+    keys = {sale.idempotency_key for sale in batch.sales}
+    existing = {
+        key: json.loads(response)
+        for key, response in db.execute(
+            select(models.PurchaseIdempotency.IDEMPOTENCY_KEY, models.PurchaseIdempotency.RESPONSE)
+            .where(models.PurchaseIdempotency.IDEMPOTENCY_KEY.in_(keys))
+        )
+    }
+    db.rollback()  # 読み取りトランザクションを終了
+
+    pending = []
+    seen = set(existing)
+    for sale in batch.sales:
+        if sale.idempotency_key not in seen:
+            seen.add(sale.idempotency_key)
+            pending.append(sale)
+
+    created, errors = {}, {}
+    for start in range(0, len(pending), PURCHASE_BATCH_CHUNK_SIZE):
+        chunk = pending[start:start + PURCHASE_BATCH_CHUNK_SIZE]
+        try:
+            chunk_created, chunk_errors, receipts = apply_sales_chunk(db, chunk)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error("❌ Purchase batch chunk failed: %s", e)
+            chunk_created, receipts = {}, {}
+            chunk_errors = {sale.idempotency_key: f"Purchase processing failed: {str(e)}" for sale in chunk}
+        created.update(chunk_created)
+        errors.update(chunk_errors)
+        for key, response in chunk_created.items():
+            idempotency_cache.set(key, response)
+
+        product_cache.invalidate(*{
+            detail["PRD_CODE"] for response in chunk_created.values() for detail in response["details"]
+        })
+        if receipt_cache.enabled:
+            for trd_id, receipt in receipts.items():
+                receipt_cache.set(trd_id, receipt)
+
+    results = []
+    reported = set()
+    for sale in batch.sales:
+        key = sale.idempotency_key
+        if key in errors:
+            results.append({"idempotency_key": key, "status": "error", "error": errors[key]})
+        elif key in created and key not in reported:
+            results.append({"idempotency_key": key, "status": "created", "transaction": created[key]})
+        else:
+            results.append({
+                "idempotency_key": key,
+                "status": "duplicate",
+                "transaction": existing.get(key) or created.get(key)
+            })
+        reported.add(key)
+
+    logger.info("✅ Purchase batch completed: created=%s, errors=%s", len(created), len(errors))
+    return {
+        "created": len(created),
+        "duplicates": sum(1 for result in results if result["status"] == "duplicate"),
+        "errors": len(errors),
+        "results": results
+    }
+
+def report_period(date_from: Optional[date], date_to: Optional[date]):
+    """レポート期間の既定値（今日）と上限を適用する"""
+    date_to = date_to or date.today()
+    date_from = date_from or date_to
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must be on or before date_to")
+    if (date_to - date_from).days >= REPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Report period must be within {REPORT_MAX_DAYS} days")
+    return date_from, date_to
+
+@app.get("/reports/daily-sales", response_model=List[schemas.DailySalesRow])
+def get_daily_sales(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    store_cd: Optional[str] = None,
+    pos_no: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """日別・店舗・レジ別の売上（集計テーブルから取得）"""
+    date_from, date_to = report_period(date_from, date_to)
+    return daily_sales(db, date_from, date_to, store_cd, pos_no)
+
+@app.get("/reports/top-products", response_model=List[schemas.TopProductRow])
+def get_top_products(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    store_cd: Optional[str] = None,
+    order_by: str = Query("qty", pattern="^(qty|revenue)$"),
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    """期間内の売れ筋商品（数量または税抜売上の降順、集計テーブルから取得）"""
+    date_from, date_to = report_period(date_from, date_to)
+    return top_products(db, date_from, date_to, store_cd, order_by, limit)
+
+@app.get("/cache/stats")
+def cache_stats():
+    """商品・レシートキャッシュのヒット/ミス統計と、商品検索の同時実行まとめの件数"""
+    return {
+        "product_cache": product_cache.stats(),
+        "missing_product_cache": missing_product_cache.stats(),
+        "product_lookups": product_lookups.stats(),
+        "receipt_cache": receipt_cache.stats(),
+        "catalog_body": catalog_body.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheusテキスト形式のメトリクス"""
+    import app.database as db_module
+    pool_lines = prometheus_lines({"sync": db_module.engine, "async": db_module.async_engine, **read_router.engines()})
+    return PlainTextResponse(render_prometheus(pool_lines + startup_state.prometheus_lines()), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/journal")
+def journal_metrics():
+    """購入ジャーナルの追記・DB書き込み済み・未書き込み件数とfsync回数"""
+    return purchase_journal.stats()
+
+@app.get("/metrics/pool")
+def pool_metrics():
+    """コネクションプールの使用状況（使用中・アイドル・取得待ち時間・接続失敗数）"""
+    import app.database as db_module
+    return {
+        "engine": pool_status(db_module.engine),
+        "async_engine": pool_status(db_module.async_engine) if db_module.DB_ASYNC else None,
+        "read_replicas": {name: pool_status(engine) for name, engine in read_router.engines().items()},
+        "read_routing": read_router.stats(),
+    }
+
+@app.get("/debug/profiling", dependencies=[Depends(require_profiling_token)])
+def profiling_status():
+    """プロファイラの設定とルート毎の採取状況"""
+    return profiler.stats()
+
+@app.post("/debug/profiling", dependencies=[Depends(require_profiling_token)])
+def configure_profiling(
+    enabled: Optional[bool] = None,
+    sample_rate: Optional[float] = Query(None, ge=0, le=1),
+    interval: Optional[float] = Query(None, ge=0.001, le=1),
+    reset: bool = False
+):
+    """プロファイラの有効/無効・採取割合・間隔の変更（reset=trueで集計を消す）。このワーカーのみに適用"""
+    profiler.configure(enabled, sample_rate, interval, reset)
+    return profiler.stats()
+
+@app.get("/debug/profiling/requests", dependencies=[Depends(require_profiling_token)])
+def profiled_requests(route: Optional[str] = None, request_id: Optional[int] = Query(None, alias="id")):
+    """直近の採取したリクエストの内訳（SQL・ORM・シリアライズ等の時間）"""
+    return [
+        breakdown for breakdown in profiler.requests
+        if route in (None, breakdown["route"]) and request_id in (None, breakdown["id"])
+    ]
+
+@app.get("/debug/profiling/speedscope", dependencies=[Depends(require_profiling_token)])
+def profiling_speedscope(route: Optional[str] = None):
+    """speedscope形式のプロファイル（https://www.speedscope.app で開く）"""
+    return FastJSONResponse(
+        profiler.speedscope(route),
+        headers={"Content-Disposition": 'attachment; filename="pos-api.speedscope.json"'}
+    )
+
+@app.get("/debug/profiling/folded", response_class=PlainTextResponse, dependencies=[Depends(require_profiling_token)])
+def profiling_folded(route: Optional[str] = None):
+    """折りたたみ形式のスタック（flamegraph.pl等でフレームグラフを生成）"""
+    return PlainTextResponse(
+        profiler.folded(route),
+        headers={"Content-Disposition": 'attachment; filename="pos-api.folded.txt"'}
+    )
+
 @app.get("/debug")
 def debug_info():
     """デバッグ情報エンドポイント"""
@@ -353,9 +996,14 @@ def debug_info():
         }
         
     except Exception as e:
-        logger.error(f"❌ Debug info collection failed: {e}")
+        logger.error("❌ Debug info collection failed: %s", e)
         return {
             "status": "debug_error",
             "error": str(e),
             "message": "Failed to collect debug information"
-        }
\ No newline at end of file
+        }
+
+# 非同期モード: DBを使うエンドポイントをasyncハンドラに差し替える
+if DB_ASYNC:
+    from .async_routes import install_async_routes
+    install_async_routes(app)
@@ -0,0 +1,244 @@
+import os
+import json
+import glob
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Prometheusテキスト形式で出力するリクエスト計測
+# （prometheus_clientに依存しない最小実装）
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# マルチワーカー時に各ワーカーの計測値を書き出す共有ディレクトリ（未設定ならプロセス内の値のみ出力）
+METRICS_DIR = os.getenv("METRICS_DIR")
+# 共有ディレクトリへの書き出し間隔（秒）
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # ラベル値 -> (バケット毎の件数, 合計, 件数)
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> List[list]:
+        """[ラベル値, バケット毎の件数, 合計, 件数] のリスト（JSONで書き出せる形）"""
+        with self._lock:
+            return [[list(labels), list(s[0]), s[1], s[2]] for labels, s in self._series.items()]
+
+    def render(self, items: Optional[List[list]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        if items is None:
+            items = self.snapshot()
+        for labels, counts, total, count in items:
+            base = ",".join(f'{k}="{v}"' for k, v in zip(self.labelnames, labels))
+            sep = "," if base else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "pos_http_request_duration_seconds", "HTTP request latency",
+    ("route", "method", "status"), LATENCY_BUCKETS
+)
+REQUEST_DB_TIME = Histogram(
+    "pos_http_request_db_seconds", "Time spent in the database per request",
+    ("route", "method"), LATENCY_BUCKETS
+)
+REQUEST_DB_QUERIES = Histogram(
+    "pos_http_request_db_queries", "Number of SQL statements per request",
+    ("route", "method"), QUERY_COUNT_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    "pos_http_response_size_bytes", "HTTP response body size",
+    ("route", "method"), SIZE_BUCKETS
+)
+HISTOGRAMS = [REQUEST_LATENCY, REQUEST_DB_TIME, REQUEST_DB_QUERIES, RESPONSE_SIZE]
+
+
+class RequestStats:
+    __slots__ = ("db_time", "db_queries")
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.db_queries = 0
+
+
+# リクエスト単位のDB計測（スレッドプール・greenletにもコンテキストが引き継がれる）
+current_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request_stats", default=None
+)
+
+
+def instrument_engine(engine):
+    """before/after_cursor_executeでSQL実行時間と件数を記録する"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times = conn.info.get("query_start_time")
+        if not start_times:
+            return
+        elapsed = time.perf_counter() - start_times.pop()
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.db_time += elapsed
+            stats.db_queries += 1
+
+
+_route_paths: Dict[object, str] = {}
+
+
+def route_label(scope) -> str:
+    """ルーティング後のscopeからルートのパス（/products/{code} 等）を返す"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    label = _route_paths.get(endpoint)
+    if label is None:
+        label = "unmatched"
+        for route in scope["app"].routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                label = route.path
+                break
+        _route_paths[endpoint] = label
+    return label
+
+
+class MetricsMiddleware:
+    """ルート毎のレイテンシ・DB時間・クエリ数・レスポンスサイズを記録するASGIミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        status_code = 500
+        response_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request_stats.reset(token)
+            route = route_label(scope)
+            method = scope["method"]
+            REQUEST_LATENCY.observe((route, method, str(status_code)), elapsed)
+            REQUEST_DB_TIME.observe((route, method), stats.db_time)
+            REQUEST_DB_QUERIES.observe((route, method), stats.db_queries)
+            RESPONSE_SIZE.observe((route, method), response_size)
+
+
+def write_worker_snapshot(directory: str = None) -> None:
+    """このワーカーの計測値を共有ディレクトリに書き出す（一時ファイル経由で置き換え）"""
+    directory = directory or METRICS_DIR
+    path = os.path.join(directory, f"worker-{os.getpid()}.json")
+    data = {histogram.name: histogram.snapshot() for histogram in HISTOGRAMS}
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def merged_snapshots(directory: str) -> Dict[str, List[list]]:
+    """全ワーカー（終了したワーカーを含む）の計測値をラベル毎に合算する"""
+    merged: Dict[str, Dict[Tuple[str, ...], list]] = {histogram.name: {} for histogram in HISTOGRAMS}
+    for path in glob.glob(os.path.join(directory, "worker-*.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, items in data.items():
+            series_by_labels = merged.get(name)
+            if series_by_labels is None:
+                continue
+            for labels, counts, total, count in items:
+                series = series_by_labels.get(tuple(labels))
+                if series is None:
+                    series_by_labels[tuple(labels)] = [labels, list(counts), total, count]
+                else:
+                    series[1] = [a + b for a, b in zip(series[1], counts)]
+                    series[2] += total
+                    series[3] += count
+    return {name: list(series.values()) for name, series in merged.items()}
+
+
+async def flush_periodically():
+    """共有ディレクトリへ定期的に書き出す（スクレイプを受けないワーカーの値も集計に含めるため）"""
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            await run_in_threadpool(write_worker_snapshot)
+        except OSError as e:
+            logger.warning("⚠️ Failed to write worker metrics: %s", e)
+
+
+def clear_worker_snapshots(directory: str) -> None:
+    """マスタープロセス起動時に前回の計測値を消す"""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "worker-*.json*")):
+        os.remove(path)
+
+
+def render_prometheus(extra_lines: Optional[List[str]] = None) -> str:
+    lines: List[str] = []
+    if METRICS_DIR:
+        write_worker_snapshot()
+        merged = merged_snapshots(METRICS_DIR)
+        for histogram in HISTOGRAMS:
+            lines.extend(histogram.render(merged[histogram.name]))
+    else:
+        for histogram in HISTOGRAMS:
+            lines.extend(histogram.render())
+    if extra_lines:
+        lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
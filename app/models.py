@@ -1,12 +1,17 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, CHAR, VARCHAR, TIMESTAMP, DECIMAL
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, DateTime, Date, ForeignKey, Index, CHAR, VARCHAR, TIMESTAMP, DECIMAL, Text, BigInteger
+from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
 
+# 全テーブルのメタデータを持つ唯一のBase（database.py・マイグレーション・bootstrapもこれを使う）
 Base = declarative_base()
 
+# インデックス名はマイグレーション（migrations/versions）と一致させる
+
 class Product(Base):
     __tablename__ = "product_master"
+    __table_args__ = (
+        Index("ux_product_master_code", "CODE", unique=True),  # スキャン・購入は商品コードで検索
+    )
 
     PRD_ID = Column(Integer, primary_key=True, autoincrement=True)
     CODE = Column(CHAR(13), nullable=False)
@@ -22,6 +27,10 @@ class TaxMaster(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_datetime", "DATETIME"),
+        Index("ix_transactions_store_pos_datetime", "STORE_CD", "POS_NO", "DATETIME"),
+    )
 
     TRD_ID = Column(Integer, primary_key=True, autoincrement=True)
     DATETIME = Column(TIMESTAMP, default=datetime.now)
@@ -36,9 +45,14 @@ class Transaction(Base):
 
 class TransactionDetail(Base):
     __tablename__ = "transaction_details"
+    __table_args__ = (
+        # TRD_IDは主キーの先頭列でカバーされる
+        Index("ix_transaction_details_prd_id", "PRD_ID"),
+        Index("ix_transaction_details_tax_cd", "TAX_CD"),
+    )
 
     TRD_ID = Column(Integer, ForeignKey("transactions.TRD_ID"), primary_key=True)
-    DTL_ID = Column(Integer, primary_key=True, autoincrement=True)
+    DTL_ID = Column(Integer, primary_key=True, autoincrement=False)  # 明細番号はアプリ側で採番（1始まりの連番）
     PRD_ID = Column(Integer, ForeignKey("product_master.PRD_ID"), nullable=False)
     PRD_CODE = Column(CHAR(13), nullable=False)
     PRD_NAME = Column(VARCHAR(50), nullable=False)
@@ -49,4 +63,80 @@ class TransactionDetail(Base):
     # リレーション
     transaction = relationship("Transaction", back_populates="details")
     product = relationship("Product")
-    tax_master = relationship("TaxMaster") 
\ No newline at end of file
+    tax_master = relationship("TaxMaster")
+
+class CatalogChange(Base):
+    """商品マスタの変更履歴（差分同期用）"""
+    __tablename__ = "catalog_changes"
+    __table_args__ = (
+        Index("ix_catalog_changes_changed_at", "CHANGED_AT"),  # 保持期間を過ぎた履歴の削除
+    )
+
+    CHG_ID = Column(Integer, primary_key=True, autoincrement=True)
+    PRD_ID = Column(Integer, nullable=False)
+    CODE = Column(CHAR(13), nullable=False)
+    OP = Column(CHAR(1), nullable=False)  # U: 登録・更新, D: 削除
+    CHANGED_AT = Column(TIMESTAMP, default=datetime.now)
+
+class PurchaseIdempotency(Base):
+    """購入登録の冪等性キー（再送時は保存済みのレスポンスを返す）"""
+    __tablename__ = "purchase_idempotency"
+    __table_args__ = (
+        Index("ix_purchase_idempotency_trd_id", "TRD_ID"),
+        Index("ix_purchase_idempotency_created_at", "CREATED_AT"),  # 期限切れキーの削除
+    )
+
+    IDEMPOTENCY_KEY = Column(VARCHAR(64), primary_key=True)
+    # 外部キーなし: ジャーナル有効時は取引より先に（在庫の確保と同時に）登録する
+    TRD_ID = Column(Integer, nullable=False)
+    RESPONSE = Column(Text, nullable=False)  # TransactionResponseのJSON
+    CREATED_AT = Column(TIMESTAMP, default=datetime.now)
+
+class DailySales(Base):
+    """日別・店舗・レジ別の売上集計（購入登録時に加算）"""
+    __tablename__ = "daily_sales"
+
+    SALES_DATE = Column(Date, primary_key=True)
+    STORE_CD = Column(CHAR(5), primary_key=True)
+    POS_NO = Column(CHAR(3), primary_key=True)
+    TRD_COUNT = Column(Integer, nullable=False, default=0)
+    ITEM_QTY = Column(Integer, nullable=False, default=0)
+    AMT_EX_TAX = Column(BigInteger, nullable=False, default=0)
+    TOTAL_AMT = Column(BigInteger, nullable=False, default=0)
+
+class DailyProductSales(Base):
+    """日別・店舗・商品別の売上集計（購入登録時に加算）"""
+    __tablename__ = "daily_product_sales"
+
+    SALES_DATE = Column(Date, primary_key=True)
+    STORE_CD = Column(CHAR(5), primary_key=True)
+    PRD_ID = Column(Integer, primary_key=True, autoincrement=False)
+    PRD_CODE = Column(CHAR(13), nullable=False)
+    PRD_NAME = Column(VARCHAR(50), nullable=False)
+    QTY = Column(Integer, nullable=False, default=0)
+    AMT_EX_TAX = Column(BigInteger, nullable=False, default=0)
+
+class RollupWatermark(Base):
+    """日別の再集計（backfill）で集計した最大TRD_ID（これ以下の後回しの加算は書き込まない）"""
+    __tablename__ = "rollup_watermarks"
+
+    SALES_DATE = Column(Date, primary_key=True)
+    TRD_ID = Column(Integer, nullable=False)
+
+class ProductStockSlot(Base):
+    """売れ筋商品の在庫スロット（在庫を分割して別々の行で減らす）
+
+    販売可能数は product_master.STOCK + 全スロットのQTY。
+    """
+    __tablename__ = "product_stock_slots"
+
+    PRD_ID = Column(Integer, ForeignKey("product_master.PRD_ID"), primary_key=True, autoincrement=False)
+    SLOT_NO = Column(Integer, primary_key=True, autoincrement=False)
+    QTY = Column(Integer, nullable=False, default=0)
+
+class IdBlock(Base):
+    """アプリ側で採番するIDの払い出し済み上限（NAME毎、ブロック単位で確保する）"""
+    __tablename__ = "id_blocks"
+
+    NAME = Column(VARCHAR(32), primary_key=True)
+    NEXT_ID = Column(BigInteger, nullable=False)
@@ -0,0 +1,152 @@
+import time
+import logging
+import threading
+from typing import Any, Dict, List
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics:
+    """コネクションプールの取得待ち時間・接続失敗などの累積値"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.connects = 0
+        self.connect_failures = 0
+        self.timeouts = 0
+        self.invalidations = 0
+
+    def record_checkout(self, wait_time: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time_total += wait_time
+            if wait_time > self.wait_time_max:
+                self.wait_time_max = wait_time
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_connect_failure(self):
+        with self._lock:
+            self.connect_failures += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_invalidation(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_time_total_ms": round(self.wait_time_total * 1000, 3),
+                "wait_time_avg_ms": round(self.wait_time_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_time_max_ms": round(self.wait_time_max * 1000, 3),
+                "connects": self.connects,
+                "connect_failures": self.connect_failures,
+                "timeouts": self.timeouts,
+                "invalidations": self.invalidations,
+            }
+
+
+class _InstrumentedPoolMixin:
+    """_do_getの所要時間を計測し、タイムアウト・接続失敗を記録する"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_timeout()
+            raise
+        except Exception:
+            self.metrics.record_connect_failure()
+            raise
+        self.metrics.record_checkout(time.perf_counter() - start)
+        return conn
+
+    def recreate(self):
+        # engine.dispose()後も累積値を引き継ぐ
+        new_pool = super().recreate()
+        new_pool.metrics = self.metrics
+        return new_pool
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def register_pool_events(engine):
+    """接続確立・無効化をプールイベントから記録する"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        pool = sync_engine.pool
+        if hasattr(pool, "metrics"):
+            pool.metrics.record_connect()
+
+    @event.listens_for(sync_engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        pool = sync_engine.pool
+        if hasattr(pool, "metrics"):
+            pool.metrics.record_invalidation()
+
+
+def pool_status(engine) -> Dict[str, Any]:
+    """プールの現在値（使用中・アイドル・オーバーフロー）と累積値を返す"""
+    if engine is None:
+        return {"status": "not_configured"}
+    pool = getattr(engine, "sync_engine", engine).pool
+    status: Dict[str, Any] = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "timeout": pool.timeout(),
+        })
+    if hasattr(pool, "metrics"):
+        status.update(pool.metrics.snapshot())
+    return status
+
+
+def prometheus_lines(engines: Dict[str, Any]) -> List[str]:
+    """プール統計をPrometheusのgauge/counterとして出力する"""
+    gauges = ("size", "checked_out", "idle", "overflow")
+    counters = ("checkouts", "connects", "connect_failures", "timeouts", "invalidations")
+    lines: List[str] = []
+    statuses = {name: pool_status(engine) for name, engine in engines.items() if engine is not None}
+    for key in gauges:
+        lines.append(f"# TYPE pos_db_pool_{key} gauge")
+        for name, status in statuses.items():
+            if key in status:
+                lines.append(f'pos_db_pool_{key}{{engine="{name}"}} {status[key]}')
+    for key in counters:
+        lines.append(f"# TYPE pos_db_pool_{key}_total counter")
+        for name, status in statuses.items():
+            if key in status:
+                lines.append(f'pos_db_pool_{key}_total{{engine="{name}"}} {status[key]}')
+    lines.append("# TYPE pos_db_pool_wait_seconds_total counter")
+    for name, status in statuses.items():
+        if "wait_time_total_ms" in status:
+            lines.append(f'pos_db_pool_wait_seconds_total{{engine="{name}"}} {status["wait_time_total_ms"] / 1000}')
+    return lines
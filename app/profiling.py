@@ -0,0 +1,398 @@
+"""リクエスト単位のサンプリングプロファイラ
+
+PROFILING_ENABLED=true または POST /debug/profiling で有効にすると、PROFILE_SAMPLE_RATE の割合のリクエストについて
+PROFILE_INTERVAL 秒毎に処理中のスレッドのスタックを採取し、ルート毎に集計する。
+PROFILING_TOKEN 設定時は、`X-Profile` ヘッダにその値を付けたリクエストを無効時でも採取する。
+PROFILING_TOKEN 未設定時はヘッダでの採取と /debug/profiling* を無効にする（404）。
+
+- 集計したスタックは speedscope（https://www.speedscope.app）形式・折りたたみ形式（flamegraph.pl）で取得できる
+- リクエスト毎に、SQL時間・件数（metricsのカーソル計測）、ORMのロード件数・flush時間（SQLAlchemyのイベント）、
+  サンプルを SQL / ORM / シリアライズ / ログ / アプリ / その他 に分類した時間を記録する
+- 無効時はミドルウェアでヘッダを確認するだけで、採取用スレッド・ORMイベントは初めて採取する時まで登録しない
+- 採取中に同時に処理されている他のリクエストのスタックも含まれる（採取はスレッド単位のため）
+"""
+import os
+import sys
+import hmac
+import time
+import random
+import logging
+import threading
+import contextvars
+import importlib.util
+from collections import deque
+from itertools import count
+from typing import Dict, List, Optional, Tuple
+from fastapi import Header, HTTPException
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper, Session
+
+from .metrics import current_request_stats, route_label
+
+logger = logging.getLogger(__name__)
+
+# 起動時からサンプリングを有効にする（実行中は POST /debug/profiling で切り替え）
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# 採取するリクエストの割合
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+# スタックの採取間隔（秒）
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+# 内訳を保持する直近のリクエスト数
+PROFILE_MAX_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "200"))
+# ルート毎に保持する異なるスタックの上限（超えた分は [truncated] にまとめる）
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", "10000"))
+# X-Profileヘッダ・/debug/profiling（X-Profile-Token）に必要な値（未設定ならどちらも使えない）
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+
+def _module_prefixes(*names: str) -> Tuple[str, ...]:
+    """モジュール・パッケージのファイルパスの接頭辞（インストールされていないものは除く）"""
+    prefixes = []
+    for name in names:
+        try:
+            spec = importlib.util.find_spec(name)
+        except (ImportError, ValueError):
+            spec = None
+        if spec is None or spec.origin is None:
+            continue
+        if spec.submodule_search_locations:
+            prefixes.extend(os.path.join(location, "") for location in spec.submodule_search_locations)
+        else:
+            prefixes.append(spec.origin)
+    return tuple(prefixes)
+
+
+# このファイルのフレームを含むスレッドをリクエスト処理中とみなす（バックグラウンドタスク・ログ出力スレッドは除く）
+REQUEST_CODE_PREFIXES = _module_prefixes("fastapi", "starlette") + (APP_DIR + "main.py", APP_DIR + "async_routes.py")
+# リクエストを待っているだけのスレッド（TestClientの呼び出し元）は除く
+CLIENT_CODE_PREFIXES = _module_prefixes("starlette.testclient")
+# サンプルの分類（末端のフレームから順に最初に一致したもの）
+CATEGORIES = (
+    ("sql", _module_prefixes(
+        "sqlalchemy.engine", "sqlalchemy.sql", "sqlalchemy.pool", "pymysql", "aiomysql", "sqlite3", "aiosqlite"
+    )),
+    ("orm", _module_prefixes("sqlalchemy.orm")),
+    ("serialization", _module_prefixes(
+        "pydantic", "pydantic_core", "fastapi.encoders", "fastapi._compat", "json"
+    ) + (APP_DIR + "responses.py",)),
+    ("logging", _module_prefixes("logging") + (APP_DIR + "logging_config.py",)),
+    ("app", (APP_DIR,)),
+)
+CATEGORY_NAMES = tuple(name for name, _ in CATEGORIES) + ("other",)
+
+
+class ProfiledRequest:
+    """採取中のリクエスト（スタック毎の秒数とORMイベントの計測値）"""
+
+    __slots__ = ("id", "method", "path", "started", "db_time", "db_queries", "stacks", "orm_loaded", "flush_time", "_flush_started")
+
+    def __init__(self, request_id: int, method: str, path: str):
+        self.id = request_id
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        stats = current_request_stats.get()
+        self.db_time = stats.db_time if stats is not None else 0.0
+        self.db_queries = stats.db_queries if stats is not None else 0
+        self.stacks: Dict[Tuple[int, ...], float] = {}
+        self.orm_loaded = 0
+        self.flush_time = 0.0
+        self._flush_started = 0.0
+
+
+# 採取中のリクエスト（スレッドプール・greenletにもコンテキストが引き継がれる）
+current_profile: contextvars.ContextVar[Optional[ProfiledRequest]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+def _on_load(target, context):
+    record = current_profile.get()
+    if record is not None:
+        record.orm_loaded += 1
+
+
+def _before_flush(session, flush_context, instances):
+    record = current_profile.get()
+    if record is not None:
+        record._flush_started = time.perf_counter()
+
+
+def _after_flush(session, flush_context):
+    record = current_profile.get()
+    if record is not None and record._flush_started:
+        record.flush_time += time.perf_counter() - record._flush_started
+        record._flush_started = 0.0
+
+
+def _short_path(path: str) -> str:
+    if path.startswith(APP_DIR):
+        return "app/" + path[len(APP_DIR):]
+    marker = "site-packages" + os.sep
+    index = path.find(marker)
+    return path[index + len(marker):] if index >= 0 else path
+
+
+class Profiler:
+    """採取用スレッドと、ルート毎のスタック・直近のリクエストの内訳"""
+
+    def __init__(self):
+        self.enabled = PROFILING_ENABLED
+        self.sample_rate = PROFILE_SAMPLE_RATE
+        self.interval = PROFILE_INTERVAL
+        self._lock = threading.Lock()
+        self._ids = count(1)
+        self._active: Dict[int, ProfiledRequest] = {}
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._hooks_installed = False
+        # フレーム（コードオブジェクト）-> speedscopeのframesの添字
+        self._frame_index: Dict[object, int] = {}
+        self._frames: List[dict] = [{"name": "[truncated]"}]
+        self._routes: Dict[str, Dict[Tuple[int, ...], float]] = {}
+        self._route_requests: Dict[str, int] = {}
+        self.requests: deque = deque(maxlen=PROFILE_MAX_REQUESTS)
+
+    # --- 採取 ---
+
+    def should_profile(self, scope) -> bool:
+        if self.enabled and random.random() < self.sample_rate:
+            return not scope["path"].startswith("/debug/profiling")
+        if not PROFILING_TOKEN:
+            return False
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return token_matches(value)
+        return False
+
+    def begin(self, scope) -> ProfiledRequest:
+        if not self._hooks_installed:
+            self._start()
+        record = ProfiledRequest(next(self._ids), scope["method"], scope["path"])
+        with self._lock:
+            self._active[record.id] = record
+        self._wakeup.set()
+        return record
+
+    def end(self, record: ProfiledRequest, scope, status_code: int) -> dict:
+        duration = time.perf_counter() - record.started
+        with self._lock:
+            self._active.pop(record.id, None)
+            route = f"{record.method} {route_label(scope)}"
+            stacks = self._routes.setdefault(route, {})
+            for key, seconds in record.stacks.items():
+                if key not in stacks and len(stacks) >= PROFILE_MAX_STACKS:
+                    key = (0,)
+                stacks[key] = stacks.get(key, 0.0) + seconds
+            self._route_requests[route] = self._route_requests.get(route, 0) + 1
+            categories = dict.fromkeys(CATEGORY_NAMES, 0.0)
+            for key, seconds in record.stacks.items():
+                categories[self._category(key)] += seconds
+        stats = current_request_stats.get()
+        breakdown = {
+            "id": record.id,
+            "route": route,
+            "path": record.path,
+            "status": status_code,
+            "duration_ms": round(duration * 1000, 3),
+            "sql_ms": round((stats.db_time - record.db_time) * 1000, 3) if stats is not None else None,
+            "sql_queries": stats.db_queries - record.db_queries if stats is not None else None,
+            "orm_loaded": record.orm_loaded,
+            "orm_flush_ms": round(record.flush_time * 1000, 3),
+            "sampled_ms": {name: round(seconds * 1000, 3) for name, seconds in categories.items()},
+        }
+        self.requests.append(breakdown)
+        return breakdown
+
+    def _start(self):
+        """初回採取時にORMイベントと採取用スレッドを登録する"""
+        with self._lock:
+            if self._hooks_installed:
+                return
+            event.listen(Mapper, "load", _on_load)
+            event.listen(Session, "before_flush", _before_flush)
+            event.listen(Session, "after_flush_postexec", _after_flush)
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+            self._hooks_installed = True
+        logger.info("🔬 Profiler started (interval=%ss)", self.interval)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            while self._active:
+                stacks = self._sample()
+                with self._lock:
+                    for record in self._active.values():
+                        for key in stacks:
+                            record.stacks[key] = record.stacks.get(key, 0.0) + self.interval
+                time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._wakeup.clear()
+
+    def _sample(self) -> List[Tuple[int, ...]]:
+        """リクエスト処理中のスレッドのスタック（ルート→末端のフレーム添字）"""
+        own = threading.get_ident()
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            codes = []
+            handling_request = False
+            while frame is not None:
+                code = frame.f_code
+                codes.append(code)
+                if code.co_filename.startswith(REQUEST_CODE_PREFIXES):
+                    if code.co_filename.startswith(CLIENT_CODE_PREFIXES):
+                        handling_request = False
+                        break
+                    handling_request = True
+                frame = frame.f_back
+            if handling_request:
+                stacks.append(tuple(self._frame(code) for code in reversed(codes)))
+        return stacks
+
+    def _frame(self, code) -> int:
+        index = self._frame_index.get(code)
+        if index is None:
+            index = self._frame_index[code] = len(self._frames)
+            self._frames.append({
+                "name": getattr(code, "co_qualname", code.co_name),
+                "file": code.co_filename,
+                "line": code.co_firstlineno,
+            })
+        return index
+
+    def _category(self, key: Tuple[int, ...]) -> str:
+        for index in reversed(key):
+            path = self._frames[index].get("file")
+            if path is None:
+                continue
+            for name, prefixes in CATEGORIES:
+                if path.startswith(prefixes):
+                    return name
+        return "other"
+
+    # --- 設定・出力 ---
+
+    def configure(self, enabled: Optional[bool] = None, sample_rate: Optional[float] = None,
+                  interval: Optional[float] = None, reset: bool = False):
+        if enabled is not None:
+            self.enabled = enabled
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if interval is not None:
+            self.interval = interval
+        if reset:
+            with self._lock:
+                self._routes.clear()
+                self._route_requests.clear()
+                self.requests.clear()
+        logger.info("🔬 Profiling %s (sample_rate=%s, interval=%ss)", "enabled" if self.enabled else "disabled", self.sample_rate, self.interval)
+
+    def speedscope(self, route: Optional[str] = None) -> dict:
+        """speedscopeのファイル形式（ルート毎のsampledプロファイル）"""
+        with self._lock:
+            routes = {name: dict(stacks) for name, stacks in self._routes.items() if route in (None, name)}
+            requests = dict(self._route_requests)
+            frames = list(self._frames)
+        profiles = []
+        for name, stacks in sorted(routes.items()):
+            total = sum(stacks.values())
+            profiles.append({
+                "type": "sampled",
+                "name": f"{name} ({requests.get(name, 0)} requests)",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": [list(key) for key in stacks],
+                "weights": list(stacks.values()),
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": "POS API profile",
+            "exporter": "pos-api",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def folded(self, route: Optional[str] = None) -> str:
+        """折りたたみ形式（1行1スタック、ルート;フレーム;... マイクロ秒）"""
+        with self._lock:
+            routes = {name: dict(stacks) for name, stacks in self._routes.items() if route in (None, name)}
+            frames = list(self._frames)
+        labels = [
+            frame["name"] if "file" not in frame else f"{frame['name']} ({_short_path(frame['file'])}:{frame['line']})"
+            for frame in frames
+        ]
+        lines = []
+        for name, stacks in sorted(routes.items()):
+            for key, seconds in stacks.items():
+                lines.append(";".join([name, *(labels[index] for index in key)]) + f" {round(seconds * 1_000_000)}")
+        return "\n".join(lines) + "\n"
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = {
+                name: {"requests": self._route_requests.get(name, 0), "sampled_seconds": round(sum(stacks.values()), 3), "stacks": len(stacks)}
+                for name, stacks in self._routes.items()
+            }
+            active = len(self._active)
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "interval": self.interval,
+            "active": active,
+            "recent_requests": len(self.requests),
+            "routes": routes,
+        }
+
+
+profiler = Profiler()
+
+
+def token_matches(value: Optional[bytes]) -> bool:
+    """PROFILING_TOKEN と一致するか（比較時間から値を推測されないよう hmac.compare_digest で比較）"""
+    return bool(PROFILING_TOKEN) and value is not None and hmac.compare_digest(value, PROFILING_TOKEN.encode("utf-8"))
+
+
+def require_profiling_token(x_profile_token: Optional[str] = Header(None)):
+    """/debug/profiling にトークンを要求する（PROFILING_TOKEN 未設定ならエンドポイント自体を無効にする）"""
+    if not PROFILING_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token_matches(x_profile_token.encode("latin-1") if x_profile_token is not None else None):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+class ProfilingMiddleware:
+    """採取対象のリクエストのスタック・内訳を記録するASGIミドルウェア（レスポンスに X-Profile-Id を付ける）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiler.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        record = profiler.begin(scope)
+        token = current_profile.set(record)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", str(record.id).encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_profile.reset(token)
+            breakdown = profiler.end(record, scope, status_code)
+            logger.debug("🔬 Profiled %s: %s", breakdown["route"], breakdown["sampled_ms"])
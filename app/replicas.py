@@ -0,0 +1,212 @@
+"""読み取りレプリカへのルーティング
+
+DB_READ_REPLICA_URLS を設定すると、読み取り専用のエンドポイント（商品・カタログ・レシート・レポート）の
+セッションをレプリカに振り分ける（ラウンドロビン）。
+
+- 書き込み（POST等）が成功したレスポンスに X-Read-Primary-Until（期限のUNIX時刻）を付け、
+  クライアントが同じヘッダを付けて送った読み取りは期限までプライマリから読む
+  （アドレスやCookieに頼らないため、NAT配下の端末やクロスサイトのフロントエンドでも書き込んだ端末だけが対象になる）
+- 接続できないレプリカは REPLICA_RETRY_INTERVAL 秒間使わず、次のレプリカ・プライマリに切り替える
+"""
+import os
+import time
+import logging
+from itertools import count
+from typing import Dict, List, Optional
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# 書き込み後にプライマリから読む期間（秒。レプリカの遅延より長くする）
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# 接続できなかったレプリカを再び使うまでの間隔（秒）
+REPLICA_RETRY_INTERVAL = float(os.getenv("REPLICA_RETRY_INTERVAL", "30"))
+# 書き込み後の期限（UNIX時刻）を返し、クライアントが読み取り時に送り返すヘッダ
+READ_YOUR_WRITES_HEADER = "X-Read-Primary-Until"
+# 書き込みとみなさないメソッド
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+class Replica:
+    """レプリカ1台分のエンジンと稼働状態"""
+
+    def __init__(self, name: str, engine, async_engine=None):
+        self.name = name
+        self.engine = engine
+        self.async_engine = async_engine
+        self.down_until = 0.0
+        self.reads = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        # クエリ実行中に接続が切れた場合も切り離す
+        for target in (engine, async_engine):
+            if target is not None:
+                event.listen(getattr(target, "sync_engine", target), "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            self.mark_down(context.original_exception)
+
+    def available(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def mark_down(self, error: Exception):
+        self.down_until = time.monotonic() + REPLICA_RETRY_INTERVAL
+        self.failures += 1
+        self.last_error = str(error)[:200]
+        logger.warning("⚠️ Read replica %s unavailable, using next (retry in %ss): %s", self.name, REPLICA_RETRY_INTERVAL, self.last_error)
+
+    def stats(self) -> dict:
+        remaining = self.down_until - time.monotonic()
+        return {
+            "name": self.name,
+            "available": remaining <= 0,
+            "retry_in": round(max(remaining, 0.0), 1),
+            "reads": self.reads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class ReadRouter:
+    """読み取りセッションの接続先（レプリカ or プライマリ）を選ぶ"""
+
+    def __init__(self, replicas: List[Replica]):
+        self.replicas = replicas
+        self._next = count()
+        self.primary_reads = 0
+        self.sticky_reads = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def is_sticky(self, request: Request) -> bool:
+        """書き込み時に返した期限をクライアントが送り返し、期限内ならプライマリから読む"""
+        try:
+            until = float(request.headers.get(READ_YOUR_WRITES_HEADER, "0"))
+        except ValueError:
+            return False
+        now = time.time()
+        # 書き込み時に返しうる値より先の期限は無視する（常にプライマリに固定させない）
+        return now < until <= now + READ_YOUR_WRITES_SECONDS + 1
+
+    def candidates(self, request: Request) -> List[Replica]:
+        """使用可能なレプリカを試す順に返す（空ならプライマリ）"""
+        if not self.replicas:
+            return []
+        if self.is_sticky(request):
+            self.sticky_reads += 1
+            return []
+        now = time.monotonic()
+        start = next(self._next) % len(self.replicas)
+        ordered = self.replicas[start:] + self.replicas[:start]
+        return [replica for replica in ordered if replica.available(now)]
+
+    def engines(self) -> Dict[str, object]:
+        """プール統計用のエンジン一覧"""
+        engines = {}
+        for index, replica in enumerate(self.replicas):
+            engines[f"replica{index}"] = replica.engine
+            if replica.async_engine is not None:
+                engines[f"replica{index}_async"] = replica.async_engine
+        return engines
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "primary_reads": self.primary_reads,
+            "sticky_reads": self.sticky_reads,
+            "replicas": [replica.stats() for replica in self.replicas],
+        }
+
+
+def _replica_name(engine) -> str:
+    return engine.url.host or engine.url.database or str(engine.url)
+
+
+read_router = ReadRouter([
+    Replica(_replica_name(engine), engine, async_engine)
+    for engine, async_engine in zip(database.read_engines, database.async_read_engines)
+])
+
+
+def open_read_session(request: Request) -> Session:
+    """レプリカのセッションを開く（接続できなければ次のレプリカ、最後はプライマリ）"""
+    for replica in read_router.candidates(request):
+        db = database.SessionLocal(bind=replica.engine)
+        try:
+            db.connection()
+        except DBAPIError as e:
+            db.close()
+            replica.mark_down(e)
+            continue
+        replica.reads += 1
+        return db
+    read_router.primary_reads += 1
+    return database.SessionLocal()
+
+
+async def open_async_read_session(request: Request):
+    """open_read_session の非同期版"""
+    for replica in read_router.candidates(request):
+        db = database.AsyncSessionLocal(bind=replica.async_engine)
+        try:
+            await db.connection()
+        except DBAPIError as e:
+            await db.close()
+            replica.mark_down(e)
+            continue
+        replica.reads += 1
+        return db
+    read_router.primary_reads += 1
+    return database.AsyncSessionLocal()
+
+
+# 読み取り専用エンドポイント用のDBセッション生成関数
+def get_read_db(request: Request):
+    db = open_read_session(request)
+    try:
+        yield db
+    except Exception as e:
+        logger.error("❌ Database session error: %s", e)
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request):
+    async with await open_async_read_session(request) as db:
+        try:
+            yield db
+        except Exception as e:
+            logger.error("❌ Async database session error: %s", e)
+            await db.rollback()
+            raise
+
+
+class ReadYourWritesMiddleware:
+    """書き込みが成功したレスポンスに、プライマリから読む期限（X-Read-Primary-Until）を付けるASGIミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not read_router.enabled or scope["method"] in READ_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                until = f"{time.time() + READ_YOUR_WRITES_SECONDS:.3f}".encode("latin-1")
+                header = (READ_YOUR_WRITES_HEADER.lower().encode("latin-1"), until)
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
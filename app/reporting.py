@@ -0,0 +1,407 @@
+"""売上集計（日別・店舗・レジ・商品別のロールアップ）
+
+購入のコミット後に daily_sales / daily_product_sales への加算をプロセス内でまとめ、
+定期的に別トランザクションで書き込む。レポートAPIはロールアップだけを読む。過去分は backfill で再集計する。
+
+    python -m app.reporting --from 2024-04-01 --to 2024-04-30
+"""
+import os
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select, delete, insert, func, literal, event
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# 購入登録時にロールアップを更新する
+REPORT_ROLLUPS_ENABLED = os.getenv("REPORT_ROLLUPS_ENABLED", "true").lower() == "true"
+# コミット済みの購入の加算をまとめて書き込む間隔（秒、0なら購入と同じトランザクションで加算）
+REPORT_ROLLUP_FLUSH_INTERVAL = float(os.getenv("REPORT_ROLLUP_FLUSH_INTERVAL", "5"))
+# backfillで1トランザクションにまとめる日数
+REPORT_BACKFILL_BATCH_DAYS = int(os.getenv("REPORT_BACKFILL_BATCH_DAYS", "7"))
+# レポートAPIで指定できる最大期間（日）
+REPORT_MAX_DAYS = int(os.getenv("REPORT_MAX_DAYS", "366"))
+
+DAILY_SALES_KEYS = ("SALES_DATE", "STORE_CD", "POS_NO")
+DAILY_SALES_SUMS = ("TRD_COUNT", "ITEM_QTY", "AMT_EX_TAX", "TOTAL_AMT")
+PRODUCT_SALES_KEYS = ("SALES_DATE", "STORE_CD", "PRD_ID")
+PRODUCT_SALES_SUMS = ("QTY", "AMT_EX_TAX")
+
+
+def _dialect_insert(connection, table):
+    """方言毎のupsert対応INSERT（MySQL: ON DUPLICATE KEY, SQLite/PostgreSQL: ON CONFLICT）"""
+    name = connection.dialect.name
+    if name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        return mysql_insert(table)
+    if name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table)
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table)
+    raise NotImplementedError(f"Rollup upsert is not supported for dialect: {name}")
+
+
+def upsert_increment(connection, table, rows: List[dict], keys: Tuple[str, ...], sums: Tuple[str, ...], replace: Tuple[str, ...] = ()):
+    """キーが存在すれば sums を加算（replace は上書き）、なければ挿入する"""
+    if not rows:
+        return
+    # ロック順を揃えてデッドロックを避ける
+    rows = sorted(rows, key=lambda row: tuple(row[key] for key in keys))
+    stmt = _dialect_insert(connection, table)
+    if connection.dialect.name == "mysql":
+        updates = {col: table.c[col] + stmt.inserted[col] for col in sums}
+        updates.update({col: stmt.inserted[col] for col in replace})
+        stmt = stmt.on_duplicate_key_update(**updates)
+    else:
+        updates = {col: table.c[col] + stmt.excluded[col] for col in sums}
+        updates.update({col: stmt.excluded[col] for col in replace})
+        stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_=updates)
+    connection.execute(stmt, rows)
+
+
+def rollup_rows(headers: Iterable[models.Transaction], details: Iterable[dict]) -> Tuple[List[dict], List[dict]]:
+    """取引ヘッダと明細dictから、ロールアップに加算する行を作る"""
+    header_by_id = {header.TRD_ID: header for header in headers}
+    sales: Dict[tuple, dict] = {}
+    for header in header_by_id.values():
+        key = (header.DATETIME.date(), header.STORE_CD, header.POS_NO)
+        row = sales.get(key)
+        if row is None:
+            row = sales[key] = dict(zip(DAILY_SALES_KEYS, key), TRD_COUNT=0, ITEM_QTY=0, AMT_EX_TAX=0, TOTAL_AMT=0)
+        row["TRD_COUNT"] += 1
+        row["AMT_EX_TAX"] += header.TTL_AMT_EX_TAX
+        row["TOTAL_AMT"] += header.TOTAL_AMT
+
+    products: Dict[tuple, dict] = {}
+    for detail in details:
+        header = header_by_id[detail["TRD_ID"]]
+        sales_date = header.DATETIME.date()
+        sales[(sales_date, header.STORE_CD, header.POS_NO)]["ITEM_QTY"] += detail["QTY"]
+        key = (sales_date, header.STORE_CD, detail["PRD_ID"])
+        row = products.get(key)
+        if row is None:
+            row = products[key] = dict(
+                zip(PRODUCT_SALES_KEYS, key), PRD_CODE=detail["PRD_CODE"], PRD_NAME=detail["PRD_NAME"], QTY=0, AMT_EX_TAX=0
+            )
+        row["QTY"] += detail["QTY"]
+        row["AMT_EX_TAX"] += detail["PRD_PRICE"] * detail["QTY"]
+    return list(sales.values()), list(products.values())
+
+
+def write_rollups(connection, sales: List[dict], products: List[dict]):
+    upsert_increment(connection, models.DailySales.__table__, sales, DAILY_SALES_KEYS, DAILY_SALES_SUMS)
+    upsert_increment(
+        connection, models.DailyProductSales.__table__, products, PRODUCT_SALES_KEYS, PRODUCT_SALES_SUMS,
+        replace=("PRD_CODE", "PRD_NAME")
+    )
+
+
+def record_sales(connection, headers: Iterable[models.Transaction], details: Iterable[dict]):
+    """呼び出し側のトランザクションでロールアップを加算する（ジャーナルの後書きなどリクエスト外の書き込み用）"""
+    if not REPORT_ROLLUPS_ENABLED:
+        return
+    write_rollups(connection, *rollup_rows(headers, details))
+
+
+# --- 購入のロールアップ加算の後回し ---
+
+def _merge(target: Dict[tuple, dict], rows: Iterable[dict], keys: Tuple[str, ...], sums: Tuple[str, ...]):
+    for row in rows:
+        key = tuple(row[column] for column in keys)
+        merged = target.get(key)
+        if merged is None:
+            target[key] = dict(row)
+            continue
+        for column in sums:
+            merged[column] += row[column]
+        # 商品コード・商品名は後から加算した行の値で上書きする
+        merged.update({column: value for column, value in row.items() if column not in keys and column not in sums})
+
+
+# 後回しにした加算（取引毎: TRD_ID, 売上日, daily_sales の行, daily_product_sales の行）
+PendingEntry = Tuple[int, date, List[dict], List[dict]]
+
+
+def backfilled_through(db: Session, sales_dates: Iterable[date]) -> Dict[date, int]:
+    """売上日毎に、再集計（backfill）で集計済みの最大TRD_ID
+
+    ロックして読むため、同じ日を再集計中のbackfillがあればそのコミットを待つ。
+    """
+    W = models.RollupWatermark
+    return dict(db.execute(
+        select(W.SALES_DATE, W.TRD_ID).where(W.SALES_DATE.in_(list(sales_dates))).with_for_update()
+    ).all())
+
+
+class PendingRollups:
+    """コミット済みの購入のロールアップ加算をプロセス内で溜め、合算してまとめて書き込む
+
+    daily_sales はすべての購入が同じ行（STORE_CD・POS_NOは固定値）に加算するため、
+    購入のトランザクション内で加算すると購入どうしがこの行のロックで直列化される。
+    取引毎に溜めておき、書き込み時に backfill で集計済みの取引（rollup_watermarks のTRD_ID以下）を除く。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: List[PendingEntry] = []
+        self.flushes = 0
+        self.skipped = 0
+
+    def add(self, entries: Iterable[PendingEntry]):
+        with self._lock:
+            self._entries.extend(entries)
+
+    def take(self) -> List[PendingEntry]:
+        with self._lock:
+            entries, self._entries = self._entries, []
+        return entries
+
+    def flush(self, db: Session) -> int:
+        """合算した加算を1トランザクションで書き込む（失敗したら戻して次回に再試行）"""
+        entries = self.take()
+        if not entries:
+            return 0
+        try:
+            watermarks = backfilled_through(db, {sales_date for _, sales_date, _, _ in entries})
+            sales: Dict[tuple, dict] = {}
+            products: Dict[tuple, dict] = {}
+            skipped = 0
+            for trd_id, sales_date, sales_rows, product_rows in entries:
+                if trd_id <= watermarks.get(sales_date, 0):
+                    skipped += 1
+                    continue
+                _merge(sales, sales_rows, DAILY_SALES_KEYS, DAILY_SALES_SUMS)
+                _merge(products, product_rows, PRODUCT_SALES_KEYS, PRODUCT_SALES_SUMS)
+            write_rollups(db.connection(), list(sales.values()), list(products.values()))
+            db.commit()
+        except Exception:
+            db.rollback()
+            self.add(entries)
+            raise
+        self.flushes += 1
+        self.skipped += skipped
+        if skipped:
+            logger.info("📊 Pending rollups already rebuilt by backfill: %s transactions", skipped)
+        return len(sales) + len(products)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pending_transactions": len(self._entries), "flushes": self.flushes, "skipped": self.skipped}
+
+
+pending_rollups = PendingRollups()
+
+# Session.info に積んだ加算はコミットされた場合だけ pending_rollups に渡す
+_PENDING_KEY = "pending_rollups"
+
+
+def pending_entries(headers: Iterable[models.Transaction], details: Iterable[dict]) -> List[PendingEntry]:
+    """取引毎の加算行（TRD_IDはflush済みであること）"""
+    details_by_trd: Dict[int, List[dict]] = {}
+    for detail in details:
+        details_by_trd.setdefault(detail["TRD_ID"], []).append(detail)
+    entries = []
+    for header in headers:
+        sales, products = rollup_rows([header], details_by_trd.get(header.TRD_ID, []))
+        entries.append((header.TRD_ID, header.DATETIME.date(), sales, products))
+    return entries
+
+
+def defer_sales(db: Session, headers: Iterable[models.Transaction], details: Iterable[dict]):
+    """購入のロールアップ加算をコミット後に回す（REPORT_ROLLUP_FLUSH_INTERVAL=0なら同じトランザクションで加算）"""
+    if not REPORT_ROLLUPS_ENABLED:
+        return
+    if REPORT_ROLLUP_FLUSH_INTERVAL <= 0:
+        record_sales(db.connection(), headers, details)
+        return
+    db.info.setdefault(_PENDING_KEY, []).append((pending_rollups, pending_entries(headers, details)))
+
+
+@event.listens_for(Session, "after_commit")
+def _queue_committed_sales(session):
+    for pending, entries in session.info.pop(_PENDING_KEY, ()):
+        pending.add(entries)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_sales(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def flush_pending(session_factory) -> int:
+    with session_factory() as db:
+        return pending_rollups.flush(db)
+
+
+async def flush_rollups_periodically(session_factory):
+    """バックグラウンドで後回しにしたロールアップ加算を書き込む"""
+    while True:
+        await asyncio.sleep(REPORT_ROLLUP_FLUSH_INTERVAL)
+        try:
+            await run_in_threadpool(flush_pending, session_factory)
+        except Exception as e:
+            logger.warning("⚠️ Rollup flush failed: %s", e)
+
+
+# --- 過去分の再集計 ---
+
+def _day_range(start: date, end: date) -> Tuple[datetime, datetime]:
+    return datetime.combine(start, datetime.min.time()), datetime.combine(end + timedelta(days=1), datetime.min.time())
+
+
+def backfill_range(db: Session, start: date, end: date) -> Tuple[int, int]:
+    """start〜endのロールアップを削除し、取引テーブルからINSERT ... SELECTで作り直す
+
+    集計した最大TRD_IDを日毎に rollup_watermarks に記録し、ワーカーに溜まっている
+    後回しの加算のうち集計済みの取引を書き込ませない（二重計上を防ぐ）。
+    """
+    T, D = models.Transaction, models.TransactionDetail
+    W = models.RollupWatermark
+    since, until = _day_range(start, end)
+    in_window = (T.DATETIME >= since, T.DATETIME < until)
+    sales_date = func.date(T.DATETIME)
+
+    # 先に削除して行ロックを取り、同じ日の後回しの加算の書き込みをコミットまで待たせる
+    db.execute(delete(W).where(W.SALES_DATE >= start, W.SALES_DATE <= end))
+    db.execute(delete(models.DailySales).where(
+        models.DailySales.SALES_DATE >= start, models.DailySales.SALES_DATE <= end
+    ))
+    db.execute(delete(models.DailyProductSales).where(
+        models.DailyProductSales.SALES_DATE >= start, models.DailyProductSales.SALES_DATE <= end
+    ))
+
+    # 取引毎の数量（ヘッダの金額を明細の行数分重複させないため先に集約）
+    qty_per_trd = (
+        select(D.TRD_ID, func.sum(D.QTY).label("qty"))
+        .join(T, T.TRD_ID == D.TRD_ID)
+        .where(*in_window)
+        .group_by(D.TRD_ID)
+        .subquery()
+    )
+    sales_select = (
+        select(
+            sales_date, T.STORE_CD, T.POS_NO,
+            func.count(T.TRD_ID), func.coalesce(func.sum(qty_per_trd.c.qty), literal(0)),
+            func.sum(T.TTL_AMT_EX_TAX), func.sum(T.TOTAL_AMT),
+        )
+        .outerjoin(qty_per_trd, qty_per_trd.c.TRD_ID == T.TRD_ID)
+        .where(*in_window)
+        .group_by(sales_date, T.STORE_CD, T.POS_NO)
+    )
+    sales_result = db.execute(
+        insert(models.DailySales).from_select(list(DAILY_SALES_KEYS + DAILY_SALES_SUMS), sales_select)
+    )
+
+    product_select = (
+        select(
+            sales_date, T.STORE_CD, D.PRD_ID, func.max(D.PRD_CODE), func.max(D.PRD_NAME),
+            func.sum(D.QTY), func.sum(D.PRD_PRICE * D.QTY),
+        )
+        .join(T, T.TRD_ID == D.TRD_ID)
+        .where(*in_window)
+        .group_by(sales_date, T.STORE_CD, D.PRD_ID)
+    )
+    product_result = db.execute(
+        insert(models.DailyProductSales).from_select(
+            list(PRODUCT_SALES_KEYS + ("PRD_CODE", "PRD_NAME") + PRODUCT_SALES_SUMS), product_select
+        )
+    )
+
+    # 集計した取引の最大TRD_ID（ロックして読み、集計した時点の取引と揃える）
+    covered = db.execute(select(func.max(T.TRD_ID)).where(*in_window).with_for_update(read=True)).scalar()
+    if covered is not None:
+        db.execute(insert(W), [
+            {"SALES_DATE": start + timedelta(days=offset), "TRD_ID": covered}
+            for offset in range((end - start).days + 1)
+        ])
+    db.commit()
+    return sales_result.rowcount, product_result.rowcount
+
+
+def backfill(db: Session, start: Optional[date] = None, end: Optional[date] = None, batch_days: int = REPORT_BACKFILL_BATCH_DAYS) -> dict:
+    """期間をbatch_days日ずつに分けて再集計する（未指定の場合は取引の最初の日〜今日）"""
+    started = time.perf_counter()
+    if start is None:
+        first = db.execute(select(func.min(models.Transaction.DATETIME))).scalar()
+        if first is None:
+            return {"days": 0, "daily_sales_rows": 0, "product_sales_rows": 0, "seconds": 0.0}
+        start = first.date() if isinstance(first, datetime) else date.fromisoformat(str(first)[:10])
+    end = end or date.today()
+
+    sales_rows = product_rows = 0
+    batch_start = start
+    while batch_start <= end:
+        batch_end = min(end, batch_start + timedelta(days=batch_days - 1))
+        sales, products = backfill_range(db, batch_start, batch_end)
+        sales_rows += sales
+        product_rows += products
+        logger.info("📊 Rollups rebuilt: %s..%s (sales=%s, products=%s)", batch_start, batch_end, sales, products)
+        batch_start = batch_end + timedelta(days=1)
+
+    return {
+        "days": (end - start).days + 1,
+        "daily_sales_rows": sales_rows,
+        "product_sales_rows": product_rows,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+# --- レポート ---
+
+def daily_sales(db: Session, date_from: date, date_to: date, store_cd: Optional[str] = None, pos_no: Optional[str] = None) -> List[dict]:
+    stmt = (
+        select(models.DailySales)
+        .where(models.DailySales.SALES_DATE >= date_from, models.DailySales.SALES_DATE <= date_to)
+        .order_by(models.DailySales.SALES_DATE, models.DailySales.STORE_CD, models.DailySales.POS_NO)
+    )
+    if store_cd:
+        stmt = stmt.where(models.DailySales.STORE_CD == store_cd)
+    if pos_no:
+        stmt = stmt.where(models.DailySales.POS_NO == pos_no)
+    columns = DAILY_SALES_KEYS + DAILY_SALES_SUMS
+    return [{column: getattr(row, column) for column in columns} for row in db.execute(stmt).scalars()]
+
+
+def top_products(db: Session, date_from: date, date_to: date, store_cd: Optional[str] = None, order_by: str = "qty", limit: int = 10) -> List[dict]:
+    """期間内の商品別売上（数量または税抜売上の降順）"""
+    P = models.DailyProductSales
+    qty = func.sum(P.QTY).label("QTY")
+    amount = func.sum(P.AMT_EX_TAX).label("AMT_EX_TAX")
+    stmt = (
+        select(P.PRD_ID, func.max(P.PRD_CODE).label("PRD_CODE"), func.max(P.PRD_NAME).label("PRD_NAME"), qty, amount)
+        .where(P.SALES_DATE >= date_from, P.SALES_DATE <= date_to)
+        .group_by(P.PRD_ID)
+        .order_by((qty if order_by == "qty" else amount).desc(), P.PRD_ID)
+        .limit(limit)
+    )
+    if store_cd:
+        stmt = stmt.where(P.STORE_CD == store_cd)
+    return [dict(row) for row in db.execute(stmt).mappings()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="開始日（既定: 最初の取引日）")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="終了日（既定: 今日）")
+    parser.add_argument("--batch-days", type=int, default=REPORT_BACKFILL_BATCH_DAYS)
+    args = parser.parse_args()
+
+    from .logging_config import setup_logging
+    from .database import SessionLocal
+    setup_logging()
+    with SessionLocal() as db:
+        print(backfill(db, args.date_from, args.date_to, args.batch_days))
+
+
+if __name__ == "__main__":
+    main()
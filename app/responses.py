@@ -0,0 +1,236 @@
+import os
+import gzip
+import json
+import zlib
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional, Tuple
+from fastapi.responses import Response
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:  # orjsonがない環境では標準のjsonで同じ形式に出力する
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotliがない環境ではgzipのみ
+    brotli = None
+
+# 高速レスポンス: ハンドラが組み立てたdictをそのままバイト列にし、response_modelの検証を省略する
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "false").lower() == "true"
+
+# レスポンス圧縮（Accept-Encodingに応じてbrotli/gzip）
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "true").lower() == "true"
+# これより小さいレスポンスは圧縮しない（バイト）
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# リクエスト毎の圧縮レベル（圧縮済みボディのキャッシュは最高圧縮率で1回だけ圧縮する）
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "5"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+# 商品の読み取り（/products, /products/{code}）に付けるCache-Controlのmax-age（秒、0で付けない）
+PRODUCT_CACHE_MAX_AGE = int(os.getenv("PRODUCT_CACHE_MAX_AGE", "0"))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def _default(obj: Any):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(
+        content, ensure_ascii=False, separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """orjsonでシリアライズするJSONレスポンス（jsonable_encoderを通さない）"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def fast_response(content: Any, headers: Optional[Dict[str, str]] = None):
+    """FAST_JSON_RESPONSES有効時はレスポンスオブジェクトを返し、FastAPIの検証・変換を省略する
+
+    無効時はcontentをそのまま返す（従来どおりresponse_modelで検証される）。
+    contentはresponse_modelと同じ形のdict/listであること。
+    """
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(content, headers=headers)
+    return content
+
+
+# --- 圧縮・HTTPキャッシュ ---
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Accept-Encodingから使うエンコーディング（br / gzip / None）を選ぶ"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if best else COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class _StreamCompressor:
+    """ストリーミングレスポンス（NDJSON等）の逐次圧縮"""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+            self.process, self.finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.process, self.finish = compressor.compress, compressor.flush
+
+
+class PrecompressedBody:
+    """バージョン毎（カタログのバージョン等）にシリアライズ・圧縮済みのボディを保持する
+
+    バージョンが変わるまで同じバイト列を返す。エンコーディング毎の圧縮は初回のみ行う。
+    DBアクセス（build）をロックの外で行うため、同時に作り直した場合は後の結果で上書きする。
+    """
+
+    def __init__(self):
+        self._entry = None  # (version, {encoding: body})
+        self.hits = 0
+        self.builds = 0
+
+    def body(self, version: Any, build: Callable[[], Any], encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """(ボディ, 適用したエンコーディング) を返す。小さいボディは圧縮しない"""
+        entry = self._entry
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            bodies = entry[1]
+        else:
+            self.builds += 1
+            bodies = {None: dumps(build())}
+            self._entry = (version, bodies)
+        if encoding is None or len(bodies[None]) < COMPRESSION_MIN_SIZE:
+            return bodies[None], None
+        compressed = bodies.get(encoding)
+        if compressed is None:
+            compressed = bodies[encoding] = compress(bodies[None], encoding, best=True)
+        return compressed, encoding
+
+    def response(self, version: Any, build: Callable[[], Any], accept_encoding: Optional[str],
+                 headers: Optional[Dict[str, str]] = None) -> Response:
+        """Accept-Encodingに合う圧縮済みボディのレスポンス（圧縮ミドルウェアは再圧縮しない）"""
+        encoding = negotiate_encoding(accept_encoding) if RESPONSE_COMPRESSION else None
+        body, applied = self.body(version, build, encoding)
+        headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+        if applied is not None:
+            headers["Content-Encoding"] = applied
+        return Response(body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        entry = self._entry
+        return {
+            "version": entry[0] if entry else None,
+            "encodings": sorted(encoding or "identity" for encoding in entry[1]) if entry else [],
+            "hits": self.hits,
+            "builds": self.builds,
+        }
+
+
+def product_cache_control(scope) -> Optional[str]:
+    """商品の読み取りに付けるCache-Control（PRODUCT_CACHE_MAX_AGE未設定ならNone）"""
+    if PRODUCT_CACHE_MAX_AGE <= 0 or scope["method"] not in ("GET", "HEAD"):
+        return None
+    path = scope["path"]
+    if path == "/products" or path.startswith(("/products/", "/product/")):
+        return f"public, max-age={PRODUCT_CACHE_MAX_AGE}"
+    return None
+
+
+class CompressionMiddleware:
+    """JSON/NDJSONレスポンスをAccept-Encodingに応じて圧縮し、商品の読み取りにCache-Controlを付けるASGIミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (RESPONSE_COMPRESSION or PRODUCT_CACHE_MAX_AGE > 0):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding")) if RESPONSE_COMPRESSION else None
+        cache_control = product_cache_control(scope)
+        start = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # ボディの大きさ・ストリーミングかどうかが分かるまでヘッダの送信を遅らせる
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            if start is None:
+                # ストリーミングの2チャンク目以降
+                if compressor is not None:
+                    body = compressor.process(message.get("body", b""))
+                    if message.get("more_body", False):
+                        if not body:
+                            return
+                    else:
+                        body += compressor.finish()
+                    message = {**message, "body": body}
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=list(start["headers"]))
+            if cache_control and start["status"] == 200 and "cache-control" not in headers:
+                headers["Cache-Control"] = cache_control
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            compressible = (
+                RESPONSE_COMPRESSION
+                and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                and "content-encoding" not in headers
+            )
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+                if encoding is not None and (more_body or len(body) >= COMPRESSION_MIN_SIZE):
+                    headers["Content-Encoding"] = encoding
+                    if more_body:
+                        compressor = _StreamCompressor(encoding)
+                        del headers["Content-Length"]
+                        body = compressor.process(body)
+                    else:
+                        body = compress(body, encoding)
+                        headers["Content-Length"] = str(len(body))
+                    message = {**message, "body": body}
+            await send({**start, "headers": headers.raw})
+            start = None
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
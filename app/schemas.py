@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime
 
 # Product関連
 class ProductBase(BaseModel):
@@ -49,6 +49,25 @@ class TransactionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# 一括購入登録（オフライン端末の再送用）
+class BatchPurchaseSale(PurchaseRequest):
+    idempotency_key: str = Field(min_length=1, max_length=64, description="端末側で生成した一意なキー")
+
+class BatchPurchaseRequest(BaseModel):
+    sales: List[BatchPurchaseSale] = Field(max_length=1000)
+
+class BatchPurchaseResult(BaseModel):
+    idempotency_key: str
+    status: str  # created: 登録, duplicate: 登録済み, error: エラー
+    transaction: Optional[TransactionResponse] = None
+    error: Optional[str] = None
+
+class BatchPurchaseResponse(BaseModel):
+    created: int
+    duplicates: int
+    errors: int
+    results: List[BatchPurchaseResult]
+
 # トランザクション詳細取得用スキーマ
 class TransactionItemDetail(BaseModel):
     name: str
@@ -63,4 +82,28 @@ class TransactionDetailWithTotals(BaseModel):
     items: List[TransactionItemDetail]
     total_excl_tax: int
     total_tax: int
-    total_incl_tax: int 
\ No newline at end of file
+    total_incl_tax: int
+
+# カタログ差分同期用スキーマ
+class CatalogSyncResponse(BaseModel):
+    token: int
+    full: bool
+    products: List[Product]
+    deleted: List[str]
+
+# 売上レポート
+class DailySalesRow(BaseModel):
+    SALES_DATE: date
+    STORE_CD: str
+    POS_NO: str
+    TRD_COUNT: int
+    ITEM_QTY: int
+    AMT_EX_TAX: int
+    TOTAL_AMT: int
+
+class TopProductRow(BaseModel):
+    PRD_ID: int
+    PRD_CODE: str
+    PRD_NAME: str
+    QTY: int
+    AMT_EX_TAX: int
@@ -0,0 +1,165 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+def process_age() -> Optional[float]:
+    """プロセス起動からの経過秒（/procがない環境ではNone）"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# このモジュールが読み込まれた時点（=アプリのimport中）の時刻と、それまでのプロセス経過秒
+IMPORT_STARTED = time.perf_counter()
+PROCESS_AGE_AT_IMPORT = process_age()
+
+# 遅延初期化: 起動時はDBへ接続せず、ウォームアップをバックグラウンドで実行する
+# false の場合はウォームアップ完了までリクエストの受付を待つ
+DB_LAZY_INIT = os.getenv("DB_LAZY_INIT", "true").lower() == "true"
+# ウォームアップで事前に張る接続数（0で無効、既定はプールサイズ）
+WARMUP_POOL_CONNECTIONS = int(os.getenv("WARMUP_POOL_CONNECTIONS", os.getenv("DB_POOL_SIZE", "5")))
+# ウォームアップで商品キャッシュに載せる件数（0で無効）
+WARMUP_PRODUCTS = int(os.getenv("WARMUP_PRODUCTS", "1000"))
+# DB_LAZY_INIT=false の場合にウォームアップを待つ最大秒数（超えたらバックグラウンドで継続）
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))
+# ウォームアップ失敗時の再試行間隔（秒）
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "5"))
+
+
+class StartupState:
+    """起動時間の計測結果とレディネス"""
+
+    def __init__(self):
+        self.ready = False
+        self.phases: Dict[str, float] = {}
+        self.warmup: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        if PROCESS_AGE_AT_IMPORT is not None:
+            self.phases["import"] = round(PROCESS_AGE_AT_IMPORT, 4)
+
+    def mark(self, phase: str):
+        """プロセス起動（取得できない場合はアプリのimport）からの経過秒を記録する"""
+        elapsed = time.perf_counter() - IMPORT_STARTED + (PROCESS_AGE_AT_IMPORT or 0.0)
+        self.phases[phase] = round(elapsed, 4)
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.ready,
+            "lazy_init": DB_LAZY_INIT,
+            "phases_seconds": dict(self.phases),
+            "warmup_seconds": dict(self.warmup),
+            "errors": dict(self.errors),
+        }
+
+    def prometheus_lines(self) -> List[str]:
+        lines = [
+            "# HELP pos_startup_seconds Seconds from process start to each startup phase",
+            "# TYPE pos_startup_seconds gauge",
+        ]
+        lines.extend(f'pos_startup_seconds{{phase="{phase}"}} {value}' for phase, value in self.phases.items())
+        lines.append("# TYPE pos_warmup_step_seconds gauge")
+        lines.extend(f'pos_warmup_step_seconds{{step="{step}"}} {value}' for step, value in self.warmup.items())
+        lines.append("# TYPE pos_ready gauge")
+        lines.append(f"pos_ready {int(self.ready)}")
+        return lines
+
+
+startup_state = StartupState()
+
+
+async def _timed(name: str, func, *args):
+    """ウォームアップの1ステップ（同期関数はスレッドプール）を実行し、所要時間を記録する"""
+    started = time.perf_counter()
+    try:
+        if asyncio.iscoroutinefunction(func):
+            await func(*args)
+        else:
+            await run_in_threadpool(func, *args)
+        startup_state.errors.pop(name, None)
+        return True
+    except Exception as e:
+        startup_state.errors[name] = str(e)
+        logger.warning("⚠️ Warmup step %s failed: %s", name, e)
+        return False
+    finally:
+        startup_state.warmup[name] = round(time.perf_counter() - started, 4)
+
+
+def prefill_pool(engine, connections: int):
+    """プールに接続を張っておく（同時にチェックアウトしてから返却する）"""
+    if engine is None or connections <= 0:
+        return
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+        opened[0].execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            conn.close()
+
+
+async def prefill_async_pool(async_engine, connections: int):
+    if async_engine is None or connections <= 0:
+        return
+    results = await asyncio.gather(
+        *(async_engine.connect().start() for _ in range(connections)), return_exceptions=True
+    )
+    opened = [conn for conn in results if not isinstance(conn, BaseException)]
+    try:
+        if len(opened) < len(results):
+            raise next(conn for conn in results if isinstance(conn, BaseException))
+        await opened[0].execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            await conn.close()
+
+
+async def warmup(session_factory, engine, async_engine, prime_products, prime_tax) -> bool:
+    """プールの事前接続・税率表と商品キャッシュの読み込みを並行して行う"""
+    started = time.perf_counter()
+
+    def _with_session(func):
+        def run():
+            with session_factory() as db:
+                func(db)
+        return run
+
+    steps = [
+        _timed("pool", prefill_pool, engine, WARMUP_POOL_CONNECTIONS),
+        _timed("tax_table", _with_session(prime_tax)),
+    ]
+    if WARMUP_PRODUCTS > 0:
+        steps.append(_timed("products", _with_session(lambda db: prime_products(db, WARMUP_PRODUCTS))))
+    if async_engine is not None:
+        steps.append(_timed("async_pool", prefill_async_pool, async_engine, WARMUP_POOL_CONNECTIONS))
+    results = await asyncio.gather(*steps)
+    startup_state.warmup["total"] = round(time.perf_counter() - started, 4)
+    return all(results)
+
+
+async def warmup_until_ready(session_factory, engine, async_engine, prime_products, prime_tax):
+    """ウォームアップが成功するまで再試行し、成功したらレディにする"""
+    while True:
+        if await warmup(session_factory, engine, async_engine, prime_products, prime_tax):
+            startup_state.ready = True
+            startup_state.mark("ready")
+            logger.info(
+                "⏱️ Cold start: import=%ss, startup=%ss, ready=%ss, warmup=%s",
+                startup_state.phases.get("import"), startup_state.phases.get("startup"), startup_state.phases.get("ready"), startup_state.warmup
+            )
+            return
+        logger.warning("⚠️ Warmup incomplete, retrying in %ss", WARMUP_RETRY_INTERVAL)
+        await asyncio.sleep(WARMUP_RETRY_INTERVAL)
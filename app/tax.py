@@ -0,0 +1,132 @@
+import os
+import time
+import logging
+import threading
+from decimal import Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# 端数処理: down=切り捨て（従来の動作）, up=切り上げ, half_up=四捨五入, half_even=銀行丸め
+ROUNDING_MODES = ("down", "up", "half_up", "half_even")
+
+# 税額の端数処理（既定は切り捨て）
+TAX_ROUNDING = os.getenv("TAX_ROUNDING", "down").lower()
+if TAX_ROUNDING not in ROUNDING_MODES:
+    raise ValueError(f"TAX_ROUNDING must be one of {ROUNDING_MODES}: {TAX_ROUNDING}")
+# 税率マスタの再読み込み間隔（秒）
+TAX_TABLE_TTL = float(os.getenv("TAX_TABLE_TTL", "300"))
+# 税率マスタに行がない場合に使う税率（%）
+FALLBACK_TAX_RATES = {"10": Decimal("10.00")}
+
+# 税率は 1/100 % 単位の整数で保持する（10.00% -> 1000）
+_RATE_SCALE = 10000
+
+
+def rate_to_bp(rate: Decimal) -> int:
+    return int(Decimal(rate) * 100)
+
+
+def tax_for(amount: int, rate_bp: int, rounding: Optional[str] = None) -> int:
+    """税抜金額と税率(1/100%単位)から税額を整数演算のみで求める"""
+    quotient, remainder = divmod(amount * rate_bp, _RATE_SCALE)
+    rounding = rounding or TAX_ROUNDING
+    if rounding == "down" or remainder == 0:
+        return quotient
+    if rounding == "up":
+        return quotient + 1
+    doubled = remainder * 2
+    if rounding == "half_up":
+        return quotient + (doubled >= _RATE_SCALE)
+    # half_even
+    return quotient + (doubled > _RATE_SCALE or (doubled == _RATE_SCALE and quotient % 2 == 1))
+
+
+class LineTax(NamedTuple):
+    tax_cd: str
+    tax_rate: Decimal
+    subtotal_excl_tax: int
+    tax_amount: int
+    price_incl_tax: int
+
+
+class BasketTax(NamedTuple):
+    lines: List[LineTax]
+    total_excl_tax: int
+    total_tax: int
+    total_incl_tax: int
+
+
+class TaxTable:
+    """税率マスタ(tax_master)のメモリ上のコピー（TAX_CD -> 税率%）"""
+
+    def __init__(self, ttl: float = TAX_TABLE_TTL):
+        self.ttl = ttl
+        self._rates: Dict[str, Decimal] = {}
+        self._rates_bp: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session) -> Dict[str, Decimal]:
+        rows = db.execute(select(models.TaxMaster.TAX_CD, models.TaxMaster.TAX_RATE)).all()
+        rates = {tax_cd.strip(): Decimal(rate) for tax_cd, rate in rows}
+        with self._lock:
+            self._rates = rates
+            self._rates_bp = {cd: rate_to_bp(rate) for cd, rate in rates.items()}
+            self._loaded_at = time.monotonic()
+        logger.info("🧾 Tax table loaded: %s", {cd: str(rate) for cd, rate in rates.items()})
+        return rates
+
+    def rates(self, db: Optional[Session] = None) -> Dict[str, Decimal]:
+        """TTL切れ・未ロードの場合はdbから再読み込みする"""
+        loaded_at = self._loaded_at
+        if db is not None and (loaded_at is None or time.monotonic() - loaded_at > self.ttl):
+            try:
+                return self.refresh(db)
+            except Exception as e:
+                logger.warning("⚠️ Failed to load tax table, using cached rates: %s", e)
+        return self._rates
+
+    def rate(self, tax_cd: str, db: Optional[Session] = None) -> Decimal:
+        rate = self.rates(db).get(tax_cd)
+        if rate is None:
+            rate = FALLBACK_TAX_RATES.get(tax_cd)
+        if rate is None:
+            raise KeyError(f"Unknown TAX_CD: {tax_cd}")
+        return rate
+
+    def compute(self, lines: Iterable[Tuple[int, int, str]], db: Optional[Session] = None, rounding: Optional[str] = None) -> BasketTax:
+        """(単価, 数量, TAX_CD) の明細から行毎・バスケット全体の税額を1パスで計算する
+
+        バスケットの税額は税率ごとに税抜合計へ1回だけ端数処理する（行毎の税額合計とは一致しない場合がある）。
+        """
+        self.rates(db)
+        rates_bp = self._rates_bp
+        rounding = rounding or TAX_ROUNDING
+        # TAX_CD -> (税率, 税率bp) を明細ループ中に使い回す
+        resolved: Dict[str, Tuple[Decimal, int]] = {}
+        result_lines: List[LineTax] = []
+        subtotal_by_cd: Dict[str, int] = {}
+        total_excl_tax = 0
+        for unit_price, quantity, tax_cd in lines:
+            entry = resolved.get(tax_cd)
+            if entry is None:
+                rate = self.rate(tax_cd)
+                entry = resolved[tax_cd] = (rate, rates_bp.get(tax_cd) or rate_to_bp(rate))
+            subtotal = unit_price * quantity
+            line_tax = tax_for(subtotal, entry[1], rounding)
+            result_lines.append(LineTax(tax_cd, entry[0], subtotal, line_tax, subtotal + line_tax))
+            subtotal_by_cd[tax_cd] = subtotal_by_cd.get(tax_cd, 0) + subtotal
+            total_excl_tax += subtotal
+        total_tax = sum(
+            tax_for(subtotal, resolved[tax_cd][1], rounding)
+            for tax_cd, subtotal in subtotal_by_cd.items()
+        )
+        return BasketTax(result_lines, total_excl_tax, total_tax, total_excl_tax + total_tax)
+
+
+tax_table = TaxTable()
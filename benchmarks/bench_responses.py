@@ -0,0 +1,99 @@
+"""レスポンスのシリアライズのマイクロベンチマーク
+
+大きな商品一覧・レシート・購入レスポンスについて、FastAPI既定の経路
+（response_modelでの検証 -> jsonable_encoder -> JSONResponse）と
+FAST_JSON_RESPONSES の経路（FastJSONResponse）の1リクエストあたりのCPU時間を比較する。
+
+    python -m benchmarks.bench_responses --products 100 1000 10000 --receipt-lines 10 100 --repeat 50
+"""
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app import schemas
+from app.responses import FastJSONResponse, orjson
+
+
+async def default_path(field, content):
+    """FastAPIがresponse_model付きのハンドラの戻り値に対して行う処理"""
+    return JSONResponse(await serialize_response(field=field, response_content=content)).body
+
+
+def fast_path(content):
+    return FastJSONResponse(content).body
+
+
+def cpu_time_us(func, repeat: int) -> float:
+    started = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - started) / repeat * 1e6
+
+
+def products_payload(n: int, rng: random.Random) -> List[dict]:
+    return [
+        {"PRD_ID": i + 1, "CODE": f"{4900000000000 + i:013d}", "NAME": f"商品{i:07d}", "PRICE": rng.randint(50, 5000), "STOCK": rng.randint(0, 999)}
+        for i in range(n)
+    ]
+
+
+def receipt_payload(n: int, rng: random.Random) -> dict:
+    items = [
+        {"name": f"商品{i:07d}", "unit_price": 100 + i, "quantity": rng.randint(1, 5), "tax_rate": 10.0, "tax_amount": 10 + i, "price_incl_tax": 110 + i}
+        for i in range(n)
+    ]
+    return {"transaction_id": 1, "items": items, "total_excl_tax": 1000, "total_tax": 100, "total_incl_tax": 1100}
+
+
+def purchase_payload(n: int, rng: random.Random) -> dict:
+    return {
+        "TRD_ID": 1, "DATETIME": datetime.now().replace(microsecond=0).isoformat(), "EMP_CD": "9999999999",
+        "STORE_CD": "30", "POS_NO": "90", "TOTAL_AMT": 1100, "TTL_AMT_EX_TAX": 1000,
+        "details": [
+            {"DTL_ID": i + 1, "PRD_ID": i + 1, "PRD_CODE": f"{4900000000000 + i:013d}", "PRD_NAME": f"商品{i:07d}", "PRD_PRICE": 100 + i, "QTY": rng.randint(1, 5), "TAX_CD": "10"}
+            for i in range(n)
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--receipt-lines", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    cases = []
+    for n in args.products:
+        cases.append((f"GET /products n={n}", List[schemas.Product], products_payload(n, rng)))
+    for n in args.receipt_lines:
+        cases.append((f"GET /transactions lines={n}", schemas.TransactionDetailWithTotals, receipt_payload(n, rng)))
+        cases.append((f"POST /purchase lines={n}", schemas.TransactionResponse, purchase_payload(n, rng)))
+
+    print(f"encoder: {'orjson ' + orjson.__version__ if orjson else 'json (orjson not installed)'}")
+    print(f"{'payload':<32}{'bytes':>10}{'default_us':>14}{'fast_us':>12}{'saved_us':>12}{'speedup':>9}")
+    # serialize_responseはasync関数（同期ハンドラの戻り値もイベントループ上で変換される）
+    loop = asyncio.new_event_loop()
+    for name, model, content in cases:
+        field = create_response_field(name="Response", type_=model)
+        default = lambda: loop.run_until_complete(default_path(field, content))
+        fast = lambda: fast_path(content)
+        default_us = cpu_time_us(default, args.repeat)
+        fast_us = cpu_time_us(fast, args.repeat)
+        print(
+            f"{name:<32}{len(fast()):>10}{default_us:>14.1f}{fast_us:>12.1f}"
+            f"{default_us - fast_us:>12.1f}{default_us / fast_us:>8.1f}x"
+        )
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""税計算のマイクロベンチマーク
+
+大きなバスケットでの TaxTable.compute と従来のfloat計算を比較する。
+
+    python -m benchmarks.bench_tax --lines 10 100 1000 --repeat 200
+"""
+import argparse
+import random
+import timeit
+from decimal import Decimal
+
+from app.tax import TaxTable
+
+
+def legacy_compute(lines, rates):
+    """従来の計算（行毎にfloatで税額を求めて合算）"""
+    total_excl_tax = 0
+    total_tax = 0
+    for unit_price, quantity, tax_cd in lines:
+        subtotal = unit_price * quantity
+        total_excl_tax += subtotal
+        total_tax += int(subtotal * (float(rates[tax_cd]) / 100))
+    return total_excl_tax, total_tax
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    table = TaxTable()
+    table._rates = {"10": Decimal("10.00"), "08": Decimal("8.00")}
+    table._rates_bp = {"10": 1000, "08": 800}
+
+    for n in args.lines:
+        lines = [
+            (random.randint(50, 5000), random.randint(1, 5), random.choice(["10", "08"]))
+            for _ in range(n)
+        ]
+        new = timeit.timeit(lambda: table.compute(lines), number=args.repeat) / args.repeat
+        old = timeit.timeit(lambda: legacy_compute(lines, table._rates), number=args.repeat) / args.repeat
+        print(f"lines={n:>6}  TaxTable.compute={new * 1e6:10.1f}us  legacy_float={old * 1e6:10.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""POS APIの負荷試験
+
+スキャン（商品検索）中心＋会計（購入）の混合負荷をかけ、エンドポイント毎の
+p50/p95/p99レイテンシ・スループット・1リクエストあたりのクエリ数をJSONで保存する。
+
+インプロセス（ASGI直接呼び出し、SQLite等のローカルDB）:
+    python -m benchmarks.loadtest --db-url sqlite:///bench.db --seed --products 10000 --transactions 10000
+
+起動済みのuvicornに対して:
+    python -m benchmarks.loadtest --base-url http://localhost:8000 --products 10000
+"""
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+DEFAULT_MIX = "scan=0.80,checkout=0.12,receipt=0.05,catalog=0.03"
+
+METRIC_LINE = re.compile(r'^pos_http_request_db_queries_(sum|count)\{route="([^"]+)",method="([^"]+)"\} ([0-9.e+-]+)$')
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for entry in value.split(","):
+        name, weight = entry.split("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def scrape_query_counts(client: httpx.AsyncClient) -> Dict[str, List[float]]:
+    """/metrics からルート毎のクエリ数(sum, count)を取得する"""
+    counts: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0.0])
+    try:
+        response = await client.get("/metrics")
+    except httpx.HTTPError:
+        return counts
+    for line in response.text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            kind, route, method, value = match.groups()
+            counts[f"{method} {route}"][0 if kind == "sum" else 1] += float(value)
+    return counts
+
+
+class Scenario:
+    def __init__(self, products: int, transactions: int, max_items: int, rng: random.Random):
+        from benchmarks.seed import product_code
+        self.product_code = product_code
+        self.products = products
+        self.transactions = transactions
+        self.max_items = max_items
+        self.rng = rng
+
+    async def scan(self, client):
+        code = self.product_code(self.rng.randrange(self.products))
+        return "GET /products/{code}", await client.get(f"/products/{code}")
+
+    async def checkout(self, client):
+        items = [
+            {"prd_code": self.product_code(self.rng.randrange(self.products)), "qty": 1}
+            for _ in range(self.rng.randint(1, self.max_items))
+        ]
+        return "POST /purchase", await client.post("/purchase", json={"emp_cd": "", "items": items})
+
+    async def receipt(self, client):
+        trd_id = self.rng.randint(1, max(1, self.transactions))
+        return "GET /transactions/{transaction_id}", await client.get(f"/transactions/{trd_id}")
+
+    async def catalog(self, client):
+        after_id = self.rng.randrange(max(1, self.products - 500))
+        return "GET /products", await client.get("/products", params={"limit": 500, "after_id": after_id})
+
+
+async def run_load(client: httpx.AsyncClient, scenario: Scenario, mix: Dict[str, float], requests: int, concurrency: int):
+    operations = list(mix.keys())
+    weights = [mix[name] for name in operations]
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            operation = getattr(scenario, scenario.rng.choices(operations, weights)[0])
+            start = time.perf_counter()
+            try:
+                endpoint, response = await operation(client)
+                if response.status_code >= 500:
+                    errors[endpoint] += 1
+            except httpx.HTTPError:
+                endpoint = operation.__name__
+                errors[endpoint] += 1
+            latencies[endpoint].append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def summarize(latencies, errors, elapsed, before, after) -> Dict[str, dict]:
+    endpoints = {}
+    for endpoint, values in sorted(latencies.items()):
+        values.sort()
+        query_sum = after.get(endpoint, [0, 0])[0] - before.get(endpoint, [0, 0])[0]
+        query_count = after.get(endpoint, [0, 0])[1] - before.get(endpoint, [0, 0])[1]
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": errors.get(endpoint, 0),
+            "throughput_rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+            "queries_per_request": round(query_sum / query_count, 2) if query_count else None,
+        }
+    return endpoints
+
+
+def build_client(args) -> httpx.AsyncClient:
+    if args.base_url:
+        return httpx.AsyncClient(base_url=args.base_url, timeout=30)
+
+    # インプロセス: 環境変数でローカルDBを指定してからアプリを読み込む
+    os.environ["DATABASE_URL"] = args.db_url
+    os.environ["DB_HOST"] = ""
+    os.environ.setdefault("LOG_HOT_PATH_LEVEL", "WARNING")
+    from app.main import app
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=30)
+
+
+async def main_async(args):
+    seed_result: Optional[dict] = None
+    if args.seed and not args.base_url:
+        from sqlalchemy import create_engine
+        from benchmarks.seed import seed
+        seed_result = seed(create_engine(args.db_url), args.products, args.transactions)
+        print(f"seeded: {seed_result}")
+
+    scenario = Scenario(args.products, args.transactions, args.max_items, random.Random(args.random_seed))
+    mix = parse_mix(args.mix)
+
+    async with build_client(args) as client:
+        if args.warmup:
+            await run_load(client, scenario, mix, args.warmup, args.concurrency)
+        before = await scrape_query_counts(client)
+        latencies, errors, elapsed = await run_load(client, scenario, mix, args.requests, args.concurrency)
+        after = await scrape_query_counts(client)
+
+    total = sum(len(values) for values in latencies.values())
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "mode": "http" if args.base_url else "asgi",
+            "target": args.base_url or args.db_url,
+            "products": args.products,
+            "transactions": args.transactions,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mix": mix,
+            "python": platform.python_version(),
+        },
+        "seed": seed_result,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1),
+        "endpoints": summarize(latencies, errors, elapsed, before, after),
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default="sqlite:///bench.db", help="インプロセス実行時のDB")
+    parser.add_argument("--base-url", help="指定した場合は起動済みサーバーにHTTPで負荷をかける")
+    parser.add_argument("--seed", action="store_true", help="実行前にデータを投入する（インプロセスのみ）")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--transactions", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--max-items", type=int, default=10, help="1会計あたりの最大明細数")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--random-seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"{'endpoint':<40}{'req':>7}{'err':>5}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'q/req':>7}")
+    for endpoint, stats in result["endpoints"].items():
+        print(
+            f"{endpoint:<40}{stats['requests']:>7}{stats['errors']:>5}"
+            f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+            f"{stats['queries_per_request'] if stats['queries_per_request'] is not None else '-':>7}"
+        )
+    print(f"total throughput: {result['throughput_rps']} req/s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""ベンチマーク用のデータ投入（app.bootstrap を使う）
+
+    python -m benchmarks.seed --db-url sqlite:///bench.db --products 10000 --transactions 100000
+"""
+import argparse
+
+from sqlalchemy import create_engine
+
+from app.bootstrap import product_code, seed  # noqa: F401 (loadtest から利用)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default="sqlite:///bench.db")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--transactions", type=int, default=10000)
+    parser.add_argument("--max-lines", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url)
+    print(seed(engine, args.products, args.transactions, args.max_lines))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# Gunicorn設定（マルチワーカー運用）
+#   gunicorn -c gunicorn.conf.py app.main:app
+import os
+import tempfile
+import multiprocessing
+
+# ポートはAzure App ServiceのPORTに合わせる
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# ワーカー数（既定はCPUコア数）
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# true にするとマスターでアプリを読み込んでからforkする（起動は速いが、fork後にDBプールを作り直す）
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# 一定件数ごとにワーカーを入れ替える（0で無効）
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+# アクセスログはアプリのログ設定に任せる
+accesslog = None
+
+# ワーカー間でメトリクスを合算するための共有ディレクトリ（アプリのimport前に設定する）
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "pos-api-metrics"))
+
+
+def on_starting(server):
+    """前回起動時のワーカー別メトリクスを消す"""
+    from app.metrics import clear_worker_snapshots
+    clear_worker_snapshots(os.environ["METRICS_DIR"])
+    server.log.info("🚀 Starting %s workers (preload=%s)", workers, preload_app)
+
+
+def post_fork(server, worker):
+    """preload時はマスターから引き継いだDBプールとログ出力スレッドを子プロセス用に作り直す"""
+    if not preload_app:
+        return
+    from app import database
+    from app.logging_config import restart_after_fork
+    restart_after_fork()
+    database.dispose_engines()
@@ -0,0 +1,54 @@
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+
+from app import models
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = models.Base.metadata
+
+
+def database_url() -> str:
+    """-x db_url=... で上書き可能。未指定ならアプリと同じ設定を使う"""
+    override = context.get_x_argument(as_dictionary=True).get("db_url")
+    if override:
+        return override
+    from app.database import DATABASE_URL
+    return DATABASE_URL
+
+
+def run_migrations_offline() -> None:
+    """SQLを出力する（alembic upgrade head --sql）"""
+    context.configure(
+        url=database_url(),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    override = context.get_x_argument(as_dictionary=True).get("db_url")
+    if override:
+        connectable = create_engine(override)
+    else:
+        # Azure MySQLのSSL設定を含むアプリのエンジンを使う
+        from app.database import engine as connectable
+
+    with connectable.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
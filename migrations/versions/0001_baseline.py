@@ -0,0 +1,59 @@
+"""baseline: product_master, tax_master, transactions, transaction_details
+
+既存のデータベースはテーブル作成済みのため `alembic stamp 0001` で適用済みにする。
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "product_master",
+        sa.Column("PRD_ID", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("CODE", sa.CHAR(13), nullable=False),
+        sa.Column("NAME", sa.VARCHAR(50), nullable=False),
+        sa.Column("PRICE", sa.Integer(), nullable=False),
+        sa.Column("STOCK", sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        "tax_master",
+        sa.Column("TAX_CD", sa.CHAR(2), primary_key=True),
+        sa.Column("TAX_RATE", sa.DECIMAL(5, 2), nullable=False),
+    )
+    op.create_table(
+        "transactions",
+        sa.Column("TRD_ID", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("DATETIME", sa.TIMESTAMP()),
+        sa.Column("EMP_CD", sa.CHAR(10), nullable=False),
+        sa.Column("STORE_CD", sa.CHAR(5), nullable=False),
+        sa.Column("POS_NO", sa.CHAR(3), nullable=False),
+        sa.Column("TOTAL_AMT", sa.Integer(), nullable=False),
+        sa.Column("TTL_AMT_EX_TAX", sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        "transaction_details",
+        sa.Column("TRD_ID", sa.Integer(), sa.ForeignKey("transactions.TRD_ID"), primary_key=True),
+        sa.Column("DTL_ID", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("PRD_ID", sa.Integer(), sa.ForeignKey("product_master.PRD_ID"), nullable=False),
+        sa.Column("PRD_CODE", sa.CHAR(13), nullable=False),
+        sa.Column("PRD_NAME", sa.VARCHAR(50), nullable=False),
+        sa.Column("PRD_PRICE", sa.Integer(), nullable=False),
+        sa.Column("QTY", sa.Integer(), nullable=False),
+        sa.Column("TAX_CD", sa.CHAR(2), sa.ForeignKey("tax_master.TAX_CD"), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("transaction_details")
+    op.drop_table("transactions")
+    op.drop_table("tax_master")
+    op.drop_table("product_master")
@@ -0,0 +1,58 @@
+"""catalog_changes, purchase_idempotency, daily_sales, daily_product_sales
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "catalog_changes",
+        sa.Column("CHG_ID", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("PRD_ID", sa.Integer(), nullable=False),
+        sa.Column("CODE", sa.CHAR(13), nullable=False),
+        sa.Column("OP", sa.CHAR(1), nullable=False),
+        sa.Column("CHANGED_AT", sa.TIMESTAMP()),
+    )
+    op.create_table(
+        "purchase_idempotency",
+        sa.Column("IDEMPOTENCY_KEY", sa.VARCHAR(64), primary_key=True),
+        sa.Column("TRD_ID", sa.Integer(), sa.ForeignKey("transactions.TRD_ID"), nullable=False),
+        sa.Column("RESPONSE", sa.Text(), nullable=False),
+        sa.Column("CREATED_AT", sa.TIMESTAMP()),
+    )
+    op.create_table(
+        "daily_sales",
+        sa.Column("SALES_DATE", sa.Date(), primary_key=True),
+        sa.Column("STORE_CD", sa.CHAR(5), primary_key=True),
+        sa.Column("POS_NO", sa.CHAR(3), primary_key=True),
+        sa.Column("TRD_COUNT", sa.Integer(), nullable=False),
+        sa.Column("ITEM_QTY", sa.Integer(), nullable=False),
+        sa.Column("AMT_EX_TAX", sa.BigInteger(), nullable=False),
+        sa.Column("TOTAL_AMT", sa.BigInteger(), nullable=False),
+    )
+    op.create_table(
+        "daily_product_sales",
+        sa.Column("SALES_DATE", sa.Date(), primary_key=True),
+        sa.Column("STORE_CD", sa.CHAR(5), primary_key=True),
+        sa.Column("PRD_ID", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("PRD_CODE", sa.CHAR(13), nullable=False),
+        sa.Column("PRD_NAME", sa.VARCHAR(50), nullable=False),
+        sa.Column("QTY", sa.Integer(), nullable=False),
+        sa.Column("AMT_EX_TAX", sa.BigInteger(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("daily_product_sales")
+    op.drop_table("daily_sales")
+    op.drop_table("purchase_idempotency")
+    op.drop_table("catalog_changes")
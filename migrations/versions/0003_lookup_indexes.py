@@ -0,0 +1,36 @@
+"""indexes for the columns the API filters on
+
+- product_master.CODE: 一意インデックス（既存データに重複があると失敗するため、事前に確認すること）
+- transactions: 日時、店舗・レジ・日時の複合インデックス
+- transaction_details / purchase_idempotency: 外部キー列
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ux_product_master_code", "product_master", ["CODE"], unique=True)
+    op.create_index("ix_transactions_datetime", "transactions", ["DATETIME"])
+    op.create_index("ix_transactions_store_pos_datetime", "transactions", ["STORE_CD", "POS_NO", "DATETIME"])
+    op.create_index("ix_transaction_details_prd_id", "transaction_details", ["PRD_ID"])
+    op.create_index("ix_transaction_details_tax_cd", "transaction_details", ["TAX_CD"])
+    op.create_index("ix_purchase_idempotency_trd_id", "purchase_idempotency", ["TRD_ID"])
+    op.create_index("ix_purchase_idempotency_created_at", "purchase_idempotency", ["CREATED_AT"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_purchase_idempotency_created_at", table_name="purchase_idempotency")
+    op.drop_index("ix_purchase_idempotency_trd_id", table_name="purchase_idempotency")
+    op.drop_index("ix_transaction_details_tax_cd", table_name="transaction_details")
+    op.drop_index("ix_transaction_details_prd_id", table_name="transaction_details")
+    op.drop_index("ix_transactions_store_pos_datetime", table_name="transactions")
+    op.drop_index("ix_transactions_datetime", table_name="transactions")
+    op.drop_index("ux_product_master_code", table_name="product_master")
@@ -0,0 +1,35 @@
+"""product_stock_slots
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-06-15 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "product_stock_slots",
+        sa.Column("PRD_ID", sa.Integer(), sa.ForeignKey("product_master.PRD_ID"), primary_key=True, autoincrement=False),
+        sa.Column("SLOT_NO", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("QTY", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    # スロットに残っている在庫を商品マスタへ戻してから削除する
+    product = sa.table("product_master", sa.column("PRD_ID"), sa.column("STOCK"))
+    slots = sa.table("product_stock_slots", sa.column("PRD_ID"), sa.column("QTY"))
+    slot_total = (
+        sa.select(sa.func.coalesce(sa.func.sum(slots.c.QTY), 0))
+        .where(slots.c.PRD_ID == product.c.PRD_ID)
+        .scalar_subquery()
+    )
+    op.execute(product.update().values(STOCK=product.c.STOCK + slot_total))
+    op.drop_table("product_stock_slots")
@@ -0,0 +1,25 @@
+"""id_blocks
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-06-20 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "id_blocks",
+        sa.Column("NAME", sa.VARCHAR(32), primary_key=True),
+        sa.Column("NEXT_ID", sa.BigInteger(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("id_blocks")
@@ -0,0 +1,20 @@
+"""catalog_changes.CHANGED_AT index (retention prune)
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-06-25 00:00:00
+"""
+from alembic import op
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_catalog_changes_changed_at", "catalog_changes", ["CHANGED_AT"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_catalog_changes_changed_at", table_name="catalog_changes")
@@ -0,0 +1,32 @@
+"""drop purchase_idempotency.TRD_ID foreign key
+
+購入ジャーナル有効時は、冪等性キーを取引より先に（在庫の確保と同じトランザクションで）登録するため。
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-06-25 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == "sqlite":
+        return  # SQLiteは外部キー制約を強制していない（名前のない制約は削除できない）
+    for foreign_key in sa.inspect(bind).get_foreign_keys("purchase_idempotency"):
+        if foreign_key["referred_table"] == "transactions":
+            op.drop_constraint(foreign_key["name"], "purchase_idempotency", type_="foreignkey")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        return
+    op.create_foreign_key(
+        "fk_purchase_idempotency_trd_id", "purchase_idempotency", "transactions", ["TRD_ID"], ["TRD_ID"]
+    )
@@ -0,0 +1,25 @@
+"""rollup_watermarks
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-06-28 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "rollup_watermarks",
+        sa.Column("SALES_DATE", sa.Date(), primary_key=True),
+        sa.Column("TRD_ID", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("rollup_watermarks")
@@ -3,15 +3,10 @@ import sys
 import logging
 import uvicorn
 
-# ログ設定
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.StreamHandler(sys.stderr)
-    ]
-)
+from app.logging_config import setup_logging
+
+# ログ設定（キュー経由でstdoutへ出力）
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
@@ -19,9 +14,9 @@ if __name__ == "__main__":
     logger.info("🚀 Starting POS API application...")
     
     # 環境情報のログ出力
-    logger.info(f"Python version: {sys.version}")
-    logger.info(f"Current working directory: {os.getcwd()}")
-    logger.info(f"PORT: {os.environ.get('PORT', '8000')}")
+    logger.info("Python version: %s", sys.version)
+    logger.info("Current working directory: %s", os.getcwd())
+    logger.info("PORT: %s", os.environ.get('PORT', '8000'))
     
     # モジュールのインポートテスト
     try:
@@ -31,13 +26,18 @@ if __name__ == "__main__":
         
         # Azure App Serviceでは環境変数PORTが設定される
         port = int(os.environ.get("PORT", 8000))
-        logger.info(f"🌐 Starting server on port {port}")
+        logger.info("🌐 Starting server on port %s", port)
         
-        uvicorn.run("app.main:app", host="0.0.0.0", port=port, reload=False)
+        # WEB_CONCURRENCY>1 の場合は複数プロセスで起動（各ワーカーがアプリを読み込み直すのでDBプールは共有されない）
+        workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+        if workers > 1:
+            logger.info("👥 Starting %s worker processes", workers)
+        # uvicorn既定のログ設定（アクセスログを直接stdoutへ書くハンドラ）は使わず、キュー経由の設定のままにする
+        uvicorn.run("app.main:app", host="0.0.0.0", port=port, reload=False, workers=workers, log_config=None)
         
     except ImportError as e:
-        logger.error(f"❌ Import error: {e}")
+        logger.error("❌ Import error: %s", e)
         sys.exit(1)
     except Exception as e:
-        logger.error(f"❌ Startup error: {e}")
+        logger.error("❌ Startup error: %s", e)
         sys.exit(1) 
\ No newline at end of file
@@ -13,48 +13,23 @@ echo "  SSL_CA_PATH: ${SSL_CA_PATH:-'Not set'}"
 echo "  PYTHONPATH: ${PYTHONPATH:-'Not set'}"
 echo "  WEBSITE_HOSTNAME: ${WEBSITE_HOSTNAME:-'Not set'}"
 
-# Python環境の確認
-echo "🐍 Python environment:"
-python --version
-pip --version
-echo "  Current working directory: $(pwd)"
-
-# ファイル構造の確認
-echo "📁 File structure:"
-ls -la
-echo "📁 App directory:"
-ls -la app/
-
-# 依存関係がインストールされているか確認
-echo "📦 Checking dependencies..."
-if ! python -c "import uvicorn, fastapi, sqlalchemy, pymysql" 2>/dev/null; then
-    echo "📦 Installing dependencies..."
-    pip install -r requirements.txt
-    echo "📦 Installation completed"
-else
-    echo "✅ Dependencies already installed"
+# 起動前の診断（Python/pip/importの確認は別プロセスを何度も起動して遅いため、既定では行わない）
+# 依存関係はデプロイ時のビルドでインストールされる前提
+if [ "${STARTUP_DIAGNOSTICS:-false}" = "true" ]; then
+    echo "🐍 Python environment:"
+    python --version
+    pip --version
+    echo "  Current working directory: $(pwd)"
+
+    echo "📁 File structure:"
+    ls -la
+    echo "📁 App directory:"
+    ls -la app/
+
+    echo "📦 Installed packages:"
+    pip list | grep -E "(fastapi|uvicorn|sqlalchemy|pymysql|pydantic)"
 fi
 
-# インストールされたパッケージの確認
-echo "📦 Installed packages:"
-pip list | grep -E "(fastapi|uvicorn|sqlalchemy|pymysql|pydantic)"
-
-# Pythonモジュールのテスト
-echo "🧪 Testing Python imports..."
-python -c "
-try:
-    import app.main
-    print('✅ app.main imported successfully')
-    import app.models
-    print('✅ app.models imported successfully')
-    import app.schemas
-    print('✅ app.schemas imported successfully')
-    import app.database
-    print('✅ app.database imported successfully')
-except Exception as e:
-    print(f'❌ Import failed: {e}')
-"
-
 # Azure App Serviceのポート設定
 PORT=${PORT:-8000}
 
@@ -67,8 +42,11 @@ echo "🌐 Starting FastAPI server on port $PORT..."
 echo "📋 Log level: INFO"
 echo "⏰ Startup time: $(date)"
 
-# uvicornの起動確認
-echo "🔧 Testing uvicorn command..."
-uvicorn --version
+# DB接続・キャッシュの事前読み込みは起動後にバックグラウンドで実行（/health/ready で完了を確認）
+# WEB_CONCURRENCY>1 の場合はGunicorn + uvicornワーカーで複数プロセス起動
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+    echo "👥 Workers: $WEB_CONCURRENCY (gunicorn)"
+    exec gunicorn -c gunicorn.conf.py app.main:app
+fi
 
 exec uvicorn app.main:app --host 0.0.0.0 --port $PORT --log-level info 
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""テスト共通: 一時ディレクトリのSQLiteでアプリを読み込み直す
+
+設定はモジュール読み込み時の環境変数で決まるため、テスト毎に app パッケージを読み込み直す。
+"""
+import sys
+import importlib
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+PRODUCT_COUNT = 5
+INITIAL_STOCK = 100
+
+
+def _unload_app():
+    for name in [name for name in sys.modules if name == "app" or name.startswith("app.")]:
+        del sys.modules[name]
+
+
+def seed_products(url: str, count: int = PRODUCT_COUNT, stock: int = INITIAL_STOCK, name_prefix: str = "商品"):
+    """スキーマを作成し、税率と商品（コードは bootstrap.product_code）を登録する"""
+    from app import bootstrap, models
+    engine = create_engine(url)
+    bootstrap.create_schema(engine)
+    with Session(engine) as db:
+        db.add(models.TaxMaster(TAX_CD="10", TAX_RATE=10))
+        for index in range(count):
+            db.add(models.Product(
+                PRD_ID=index + 1, CODE=bootstrap.product_code(index), NAME=f"{name_prefix}{index}",
+                PRICE=100 * (index + 1), STOCK=stock
+            ))
+        db.commit()
+    engine.dispose()
+
+
+@pytest.fixture
+def load_app(tmp_path, monkeypatch):
+    """環境変数を設定して app.main を読み込む（DATABASE_URL は一時ディレクトリのSQLite）"""
+    def _load(seed: bool = True, **env):
+        url = f"sqlite:///{tmp_path / 'pos.db'}"
+        # .env のMySQL設定より優先させる
+        monkeypatch.setenv("DB_HOST", "")
+        monkeypatch.setenv("DATABASE_URL", url)
+        monkeypatch.setenv("CATALOG_WATCH_INTERVAL", "0")
+        for key, value in env.items():
+            monkeypatch.setenv(key, str(value))
+        _unload_app()
+        if seed:
+            seed_products(url)
+        return importlib.import_module("app.main")
+
+    yield _load
+    database = sys.modules.get("app.database")
+    if database is not None and database.engine is not None:
+        database.engine.dispose()
+    _unload_app()
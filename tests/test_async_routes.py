@@ -0,0 +1,66 @@
+"""DB_ASYNC=true（sqlite+aiosqlite）で差し替えた非同期ルート"""
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.conftest import INITIAL_STOCK, PRODUCT_COUNT
+
+CODE = "4900000000000"
+
+
+@pytest.fixture
+def client(load_app):
+    main = load_app(DB_ASYNC="true")
+    assert main.DB_ASYNC
+    import app.database as database
+    assert database.async_engine.url.drivername == "sqlite+aiosqlite"
+    return TestClient(main.app)
+
+
+def test_routes_are_async(client):
+    endpoints = {route.path: route.endpoint for route in client.app.routes if hasattr(route, "endpoint")}
+    for path in ("/products", "/products/{code}", "/purchase", "/transactions/{transaction_id}"):
+        assert endpoints[path].__module__ == "app.async_routes"
+
+
+def test_list_products(client):
+    response = client.get("/products")
+    assert response.status_code == 200
+    products = response.json()
+    assert len(products) == PRODUCT_COUNT
+    assert products[0]["CODE"] == CODE
+
+    response = client.get("/products", params={"limit": 2, "fields": "code,price"})
+    assert response.status_code == 200
+    assert response.json() == [{"PRD_ID": 1, "CODE": CODE, "PRICE": 100}, {"PRD_ID": 2, "CODE": "4900000000001", "PRICE": 200}]
+    assert response.headers["x-next-after-id"] == "2"
+
+
+def test_product_lookup(client):
+    response = client.get(f"/products/{CODE}")
+    assert response.status_code == 200
+    assert response.json()["STOCK"] == INITIAL_STOCK
+    assert client.get(f"/product/{CODE}").json()["CODE"] == CODE
+    assert client.get("/products/0000000000000").status_code == 404
+
+
+def test_purchase_and_receipt(client):
+    response = client.post("/purchase", json={"emp_cd": "1", "items": [{"prd_code": CODE, "qty": 3}]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["TOTAL_AMT"] == 330
+    assert client.get(f"/products/{CODE}").json()["STOCK"] == INITIAL_STOCK - 3
+
+    receipt = client.get(f"/transactions/{body['TRD_ID']}")
+    assert receipt.status_code == 200
+    assert receipt.json()["total_incl_tax"] == 330
+
+
+def test_idempotent_retry(client):
+    purchase = {"emp_cd": "1", "items": [{"prd_code": CODE, "qty": 2}]}
+    headers = {"Idempotency-Key": "async-retry-1"}
+    first = client.post("/purchase", json=purchase, headers=headers)
+    retry = client.post("/purchase", json=purchase, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    # 在庫は1回分だけ減る
+    assert client.get(f"/products/{CODE}").json()["STOCK"] == INITIAL_STOCK - 2
@@ -0,0 +1,86 @@
+"""カタログ差分同期と変更履歴の削除"""
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+
+CODE = "4900000000000"
+
+
+def purchase(client):
+    response = client.post("/purchase", json={"emp_cd": "1", "items": [{"prd_code": CODE, "qty": 1}]})
+    assert response.status_code == 200
+
+
+def settle(age=timedelta(minutes=1)):
+    """変更履歴をコミットの遅れの上限より古くする"""
+    from app import models
+    from app.database import SessionLocal
+    with SessionLocal() as db:
+        db.execute(update(models.CatalogChange).values(CHANGED_AT=datetime.now() - age))
+        db.commit()
+
+
+def test_delta_sync(load_app):
+    client = TestClient(load_app().app)
+    settle()
+    full = client.get("/catalog/sync").json()
+    assert full["full"]
+    purchase(client)
+    # コミットの遅れの上限までは新しい変更をバージョンに含めない
+    assert client.get("/catalog/sync", params={"since": full["token"]}).status_code == 304
+    settle()
+    delta = client.get("/catalog/sync", params={"since": full["token"]}).json()
+    assert not delta["full"]
+    assert [product["CODE"] for product in delta["products"]] == [CODE]
+    assert client.get("/catalog/sync", params={"since": delta["token"]}).status_code == 304
+
+
+def test_out_of_order_commit_included_in_delta(load_app):
+    """採番が先の変更が後からコミットされても、先に渡したトークン以降の差分に含まれる"""
+    main = load_app()
+    client = TestClient(main.app)
+    from app import catalog, models
+    from app.database import SessionLocal
+
+    settle()
+    token = client.get("/catalog/sync").json()["token"]
+    with SessionLocal() as db:
+        # CHG_IDが大きい変更が先にコミットされる
+        db.add(models.CatalogChange(CHG_ID=token + 2, PRD_ID=2, CODE="4900000000001", OP="U", CHANGED_AT=datetime.now()))
+        db.commit()
+    assert client.get("/catalog/sync", params={"since": token}).status_code == 304
+    with SessionLocal() as db:
+        db.add(models.CatalogChange(CHG_ID=token + 1, PRD_ID=1, CODE=CODE, OP="U", CHANGED_AT=datetime.now()))
+        db.commit()
+
+    settle()
+    delta = client.get("/catalog/sync", params={"since": token}).json()
+    assert delta["token"] == token + 2
+    assert sorted(product["CODE"] for product in delta["products"]) == [CODE, "4900000000001"]
+    with SessionLocal() as db:
+        codes, version = catalog.changed_codes(db, token)
+    assert sorted(codes) == [CODE, "4900000000001"] and version == token + 2
+
+
+def test_prune_keeps_version_and_forces_full_resync(load_app):
+    main = load_app()
+    client = TestClient(main.app)
+    from app import catalog
+    from app.database import SessionLocal
+
+    settle(timedelta(days=30))
+    stale = client.get("/catalog/sync").json()["token"]
+    purchase(client)
+    purchase(client)
+    settle(timedelta(days=30))
+    with SessionLocal() as db:
+        version = catalog.catalog_version(db)
+        assert catalog.prune_changes(db) == version - 1
+        # 最新の1行は残り、バージョンは変わらない
+        assert catalog.catalog_version(db) == version
+
+    resync = client.get("/catalog/sync", params={"since": stale}).json()
+    assert resync["full"]
+    assert resync["token"] == version
+    assert client.get("/catalog/sync", params={"since": version - 1}).json()["full"] is False
@@ -0,0 +1,37 @@
+"""購入登録の冪等性キー"""
+from fastapi.testclient import TestClient
+
+from tests.conftest import INITIAL_STOCK
+
+CODE = "4900000000000"
+PURCHASE = {"emp_cd": "1", "items": [{"prd_code": CODE, "qty": 1}]}
+
+
+def test_retry_returns_stored_response(load_app):
+    client = TestClient(load_app().app)
+    headers = {"Idempotency-Key": "retry-1"}
+    first = client.post("/purchase", json=PURCHASE, headers=headers)
+    retry = client.post("/purchase", json=PURCHASE, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert client.get(f"/products/{CODE}").json()["STOCK"] == INITIAL_STOCK - 1
+
+
+def test_concurrent_retry_resolved_by_stored_key(load_app, monkeypatch):
+    """先行リクエストのコミット後に照会をすり抜けた再送は、キーの重複から保存済みレスポンスを返す"""
+    main = load_app()
+    client = TestClient(main.app)
+    headers = {"Idempotency-Key": "race-1"}
+    first = client.post("/purchase", json=PURCHASE, headers=headers)
+    assert first.status_code == 200
+
+    # 最初の照会だけ未登録に見せ、並行リクエストが同時に照会した状況を再現する
+    lookup_response = main.lookup_response
+    misses = [None]
+    monkeypatch.setattr(main, "lookup_response", lambda db, key: misses.pop() if misses else lookup_response(db, key))
+
+    retry = client.post("/purchase", json=PURCHASE, headers=headers)
+    assert not misses
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+    assert client.get(f"/products/{CODE}").json()["STOCK"] == INITIAL_STOCK - 1
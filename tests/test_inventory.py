@@ -0,0 +1,42 @@
+"""売れ筋商品の在庫スロット"""
+from fastapi.testclient import TestClient
+
+from tests.conftest import INITIAL_STOCK
+
+CODE = "4900000000000"
+
+
+def purchase(client, qty, code=CODE):
+    return client.post("/purchase", json={"emp_cd": "1", "items": [{"prd_code": code, "qty": qty}]})
+
+
+def stock(client, code=CODE):
+    return client.get(f"/products/{code}").json()["STOCK"]
+
+
+def test_slots_follow_recent_sales(load_app):
+    main = load_app(STOCK_SLOT_COUNT=4, STOCK_SLOT_MIN_QTY=1, PRODUCT_CACHE_ENABLED="false")
+    client = TestClient(main.app)
+    from app import inventory, models
+    from app.database import SessionLocal
+
+    assert purchase(client, 2).status_code == 200
+    with SessionLocal() as db:
+        hot = inventory.hot_product_ids(db)
+        assert hot == [1]
+        assert inventory.compact(db, hot) == {"slotted": 1, "folded": 0}
+        slots = db.query(models.ProductStockSlot.QTY).filter_by(PRD_ID=1).all()
+        assert [qty for qty, in slots] == [24, 24, 24, 24]
+        # 直近に売れていない商品は売れ筋にならない
+        assert inventory.hot_product_ids(db, window=0) == []
+    assert stock(client) == INITIAL_STOCK - 2
+
+    # 1スロットで賄える購入、全スロットと STOCK から減らす購入
+    assert purchase(client, 20).status_code == 200
+    assert purchase(client, 70).status_code == 200
+    assert stock(client) == INITIAL_STOCK - 92
+    assert purchase(client, 9).status_code == 400
+
+    with SessionLocal() as db:
+        assert inventory.compact(db) == {"slotted": 0, "folded": 1}
+        assert db.get(models.Product, 1).STOCK == INITIAL_STOCK - 92
@@ -0,0 +1,64 @@
+"""購入ジャーナル（冪等性キーの登録と、キーだけが残った購入の復旧）"""
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from tests.conftest import INITIAL_STOCK
+
+CODE = "4900000000000"
+PURCHASE = {"emp_cd": "1", "items": [{"prd_code": CODE, "qty": 1}]}
+
+
+def load_journal_app(load_app, tmp_path):
+    return load_app(PURCHASE_JOURNAL_ENABLED="true", PURCHASE_JOURNAL_DIR=tmp_path / "journal", PRODUCT_CACHE_ENABLED="false")
+
+
+def test_key_claimed_with_stock_reservation(load_app, tmp_path, monkeypatch):
+    main = load_journal_app(load_app, tmp_path)
+    from app.idempotency import idempotency_cache
+    from app.journal import drain
+    from app.database import SessionLocal
+
+    with TestClient(main.app) as client:
+        headers = {"Idempotency-Key": "journal-1"}
+        first = client.post("/purchase", json=PURCHASE, headers=headers)
+        assert first.status_code == 200
+        appended = main.purchase_journal.appended
+
+        # 他のワーカーが同じキーを同時に受けた状況（照会ではまだ見えない）を再現する
+        idempotency_cache.clear()
+        lookup_response = main.lookup_response
+        misses = [None]
+        monkeypatch.setattr(main, "lookup_response", lambda db, key: misses.pop() if misses else lookup_response(db, key))
+        retry = client.post("/purchase", json=PURCHASE, headers=headers)
+        assert retry.status_code == 200
+        assert retry.json() == first.json()
+        assert main.purchase_journal.appended == appended
+
+        drain(SessionLocal, main.purchase_journal)
+        assert client.get(f"/products/{CODE}").json()["STOCK"] == INITIAL_STOCK - 1
+        assert client.get(f"/transactions/{first.json()['TRD_ID']}").status_code == 200
+
+
+def test_orphaned_key_restored_on_recovery(load_app, tmp_path):
+    main = load_journal_app(load_app, tmp_path)
+    from app import models
+    from app.idempotency import idempotency_row
+    from app.journal import recover
+    from app.database import SessionLocal
+
+    response = {
+        "TRD_ID": 900001, "DATETIME": "2024-06-01T10:00:00", "EMP_CD": "1", "STORE_CD": "30", "POS_NO": "90",
+        "TOTAL_AMT": 110, "TTL_AMT_EX_TAX": 100,
+        "details": [{"DTL_ID": 1, "PRD_ID": 1, "PRD_CODE": CODE, "PRD_NAME": "商品0", "PRD_PRICE": 100, "QTY": 1, "TAX_CD": "10"}],
+    }
+    with SessionLocal() as db:
+        db.add(models.PurchaseIdempotency(**idempotency_row("orphan-1", 900001, response), CREATED_AT=datetime.now() - timedelta(hours=1)))
+        # 直近のキーは動作中のプロセスのジャーナルにある可能性があるため対象外
+        db.add(models.PurchaseIdempotency(**idempotency_row("recent-1", 900002, dict(response, TRD_ID=900002))))
+        db.commit()
+
+    assert recover(SessionLocal, main.purchase_journal) == 1
+    with SessionLocal() as db:
+        assert db.get(models.Transaction, 900001).TOTAL_AMT == 110
+        assert db.get(models.Transaction, 900002) is None
@@ -0,0 +1,38 @@
+"""uvicornのログがキュー経由で出力されること"""
+import sys
+import logging
+import logging.config
+from logging.handlers import QueueHandler
+
+from uvicorn.config import LOGGING_CONFIG
+
+SERVER_LOGGERS = ("uvicorn", "uvicorn.access", "uvicorn.error")
+
+
+def assert_routed_to_queue():
+    for name in SERVER_LOGGERS:
+        server_logger = logging.getLogger(name)
+        assert server_logger.handlers == []
+        assert server_logger.propagate
+    handlers = logging.getLogger().handlers
+    assert len(handlers) == 1 and isinstance(handlers[0], QueueHandler)
+
+
+def test_uvicorn_loggers_use_queue(load_app):
+    # uvicornはアプリのimport前にLOGGING_CONFIGを適用する
+    logging.config.dictConfig(LOGGING_CONFIG)
+    assert logging.getLogger("uvicorn.access").handlers
+    load_app()
+    assert_routed_to_queue()
+
+    from app import logging_config
+    # 設定済みの後にuvicornがログ設定を適用し直しても、次の呼び出しで外す
+    logging.config.dictConfig(LOGGING_CONFIG)
+    logging_config.setup_logging()
+    assert_routed_to_queue()
+
+    # UvicornWorkerがfork前に付けたハンドラもfork後に外す
+    logging.getLogger("uvicorn.error").addHandler(logging.StreamHandler(sys.stderr))
+    logging.getLogger("uvicorn.error").propagate = False
+    logging_config.restart_after_fork()
+    assert_routed_to_queue()
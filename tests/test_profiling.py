@@ -0,0 +1,27 @@
+"""プロファイリング（PROFILING_TOKEN によるアクセス制御）"""
+from fastapi.testclient import TestClient
+
+
+def test_disabled_without_token(load_app):
+    client = TestClient(load_app().app)
+    response = client.get("/products", headers={"X-Profile": "1"})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert client.get("/debug/profiling").status_code == 404
+    assert client.post("/debug/profiling", params={"enabled": "true"}).status_code == 404
+    assert client.get("/debug/profiling/speedscope").status_code == 404
+
+
+def test_token_required(load_app):
+    client = TestClient(load_app(PROFILING_TOKEN="s3cret").app)
+    assert "x-profile-id" not in client.get("/products", headers={"X-Profile": "1"}).headers
+    assert client.get("/debug/profiling").status_code == 403
+    assert client.get("/debug/profiling", headers={"X-Profile-Token": "wrong"}).status_code == 403
+
+    profiled = client.get("/products", headers={"X-Profile": "s3cret"})
+    assert profiled.status_code == 200
+    profile_id = profiled.headers["x-profile-id"]
+    requests = client.get(
+        "/debug/profiling/requests", params={"id": profile_id}, headers={"X-Profile-Token": "s3cret"}
+    )
+    assert requests.status_code == 200
@@ -0,0 +1,24 @@
+"""主なクエリの実行計画（python -m benchmarks.query_plans と同じチェック）"""
+import sys
+import importlib
+
+from sqlalchemy import create_engine
+
+
+def test_hot_queries_do_not_full_scan(load_app):
+    load_app(seed=False)
+    # 読み込み直した app パッケージのモデルでチェックする
+    sys.modules.pop("benchmarks.query_plans", None)
+    query_plans = importlib.import_module("benchmarks.query_plans")
+    from app import models
+
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    full_scans = {}
+    with engine.connect() as connection:
+        for name, statement in query_plans.hot_queries().items():
+            _, scans = query_plans.explain(connection, statement)
+            if scans:
+                full_scans[name] = scans
+    engine.dispose()
+    assert full_scans == {}
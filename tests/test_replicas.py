@@ -0,0 +1,59 @@
+"""読み取りレプリカへの振り分け（2つのSQLiteファイル）"""
+import time
+
+from fastapi.testclient import TestClient
+
+from tests.conftest import seed_products
+
+CODE = "4900000000000"
+PURCHASE = {"emp_cd": "1", "items": [{"prd_code": CODE, "qty": 1}]}
+
+
+def product_name(client, headers=None):
+    return client.get(f"/products/{CODE}", headers=headers).json()["NAME"]
+
+
+def test_reads_routed_to_replica(load_app, tmp_path):
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    seed_products(replica_url, name_prefix="レプリカ")
+    main = load_app(DB_READ_REPLICA_URLS=replica_url, PRODUCT_CACHE_ENABLED="false")
+    client = TestClient(main.app)
+
+    assert product_name(client) == "レプリカ0"
+    assert client.get("/products").json()[0]["NAME"] == "レプリカ0"
+
+    # 書き込みはプライマリ。レスポンスの期限を送り返した読み取りだけプライマリから読む
+    response = client.post("/purchase", json=PURCHASE)
+    assert response.status_code == 200
+    until = response.headers["x-read-primary-until"]
+    assert float(until) > time.time()
+    assert product_name(client, {"X-Read-Primary-Until": until}) == "商品0"
+    assert product_name(client) == "レプリカ0"
+
+    # 期限切れ・不正な値・書き込み時に返しうる値より先の期限はレプリカ
+    assert product_name(client, {"X-Read-Primary-Until": str(time.time() - 1)}) == "レプリカ0"
+    assert product_name(client, {"X-Read-Primary-Until": "soon"}) == "レプリカ0"
+    assert product_name(client, {"X-Read-Primary-Until": str(time.time() + 3600)}) == "レプリカ0"
+
+    stats = client.get("/metrics/pool").json()["read_routing"]
+    assert stats["sticky_reads"] == 1
+    assert stats["replicas"][0]["reads"] >= 5
+
+
+def test_unavailable_replica_falls_back_to_primary(load_app, tmp_path):
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    seed_products(replica_url, name_prefix="レプリカ")
+    bad_url = f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"
+    main = load_app(DB_READ_REPLICA_URLS=f"{bad_url},{replica_url}", PRODUCT_CACHE_ENABLED="false")
+    client = TestClient(main.app)
+
+    # 接続できないレプリカは切り離し、次のレプリカから読む
+    assert {product_name(client) for _ in range(4)} == {"レプリカ0"}
+    replicas = client.get("/metrics/pool").json()["read_routing"]["replicas"]
+    assert [replica["available"] for replica in replicas] == [False, True]
+    assert replicas[0]["failures"] == 1
+
+    # 全て使えなければプライマリから読む
+    main.read_router.replicas[1].mark_down(RuntimeError("down"))
+    assert product_name(client) == "商品0"
+    assert client.get("/metrics/pool").json()["read_routing"]["primary_reads"] >= 1
@@ -0,0 +1,66 @@
+"""売上集計（購入のコミット後に加算をまとめて書き込む）"""
+from fastapi.testclient import TestClient
+
+CODE = "4900000000000"
+
+
+def purchase(client, qty=1, code=CODE):
+    return client.post("/purchase", json={"emp_cd": "1", "items": [{"prd_code": code, "qty": qty}]})
+
+
+def test_rollups_written_after_commit(load_app):
+    main = load_app()
+    client = TestClient(main.app)
+    from app import reporting
+    from app.database import SessionLocal
+
+    assert purchase(client, 2).status_code == 200
+    assert purchase(client, 3).status_code == 200
+    # 在庫不足でロールバックされた購入は加算しない
+    assert purchase(client, 1000).status_code == 400
+    assert client.get("/reports/daily-sales").json() == []
+
+    assert reporting.flush_pending(SessionLocal) == 2
+    rows = client.get("/reports/daily-sales").json()
+    assert [(row["TRD_COUNT"], row["ITEM_QTY"], row["AMT_EX_TAX"]) for row in rows] == [(2, 5, 500)]
+    top = client.get("/reports/top-products").json()
+    assert [(row["PRD_CODE"], row["QTY"]) for row in top] == [(CODE, 5)]
+    assert reporting.flush_pending(SessionLocal) == 0
+
+
+def test_rollups_in_purchase_transaction(load_app):
+    client = TestClient(load_app(REPORT_ROLLUP_FLUSH_INTERVAL="0").app)
+    assert purchase(client, 2).status_code == 200
+    rows = client.get("/reports/daily-sales").json()
+    assert [(row["TRD_COUNT"], row["ITEM_QTY"]) for row in rows] == [(1, 2)]
+
+
+def test_rollups_deferred_in_async_mode(load_app):
+    client = TestClient(load_app(DB_ASYNC="true").app)
+    from app import reporting
+    from app.database import SessionLocal
+
+    assert purchase(client, 4).status_code == 200
+    assert reporting.flush_pending(SessionLocal) == 2
+    rows = client.get("/reports/daily-sales").json()
+    assert [(row["TRD_COUNT"], row["ITEM_QTY"]) for row in rows] == [(1, 4)]
+
+
+def test_backfill_skips_pending_rollups(load_app):
+    """backfillで集計済みの取引の後回しの加算は二重に書き込まない"""
+    main = load_app()
+    client = TestClient(main.app)
+    from app import reporting
+    from app.database import SessionLocal
+
+    assert purchase(client, 2).status_code == 200
+    with SessionLocal() as db:
+        reporting.backfill(db)
+    assert purchase(client, 3).status_code == 200
+
+    assert reporting.flush_pending(SessionLocal) == 2
+    assert reporting.pending_rollups.stats()["skipped"] == 1
+    rows = client.get("/reports/daily-sales").json()
+    assert [(row["TRD_COUNT"], row["ITEM_QTY"], row["AMT_EX_TAX"]) for row in rows] == [(2, 5, 500)]
+    top = client.get("/reports/top-products").json()
+    assert [(row["PRD_CODE"], row["QTY"]) for row in top] == [(CODE, 5)]